@@ -6,10 +6,16 @@ and running the different subsystems of the program
 """
 
 import argparse
+import sys
 from core_search import add_parser as add_search_parser
 from core_try import add_parser as add_try_parser
 from core_log import add_parser as add_log_parser
-from c_printer import print_title
+from core_bench import add_parser as add_bench_parser
+from core_report import add_parser as add_report_parser
+from core_reduce import add_parser as add_reduce_parser
+from core_export import add_parser as add_export_parser
+from c_printer import print_content, print_title, print_warning
+from sanity_check import SanityCheckError
 
 def main() -> None:
     '''main function of the program. responsible for
@@ -27,10 +33,23 @@ def main() -> None:
     add_search_parser(subparsers.add_parser("search", help="search for bugs in Z3"))
     add_try_parser(subparsers.add_parser("try", help="try the 2 provided words on Z3"))
     add_log_parser(subparsers.add_parser("log", help="print the SMT file that would be generated for the 2 words"))
+    add_bench_parser(subparsers.add_parser("bench", help="benchmark the generation of formulas"))
+    add_report_parser(subparsers.add_parser("report", help="summarize the recorded results of searches and tries"))
+    add_reduce_parser(subparsers.add_parser("reduce", help="shrink the 2 provided words and their formula while Z3 keeps making a mistake"))
+    add_export_parser(subparsers.add_parser("export", help="generate a benchmark set of SMT files with a manifest"))
 
     args = parser.parse_args()
+    if hasattr(args, "check_method"):
+        # arguments that depend on each other, which argparse cannot check on its own
+        args.check_method(args)
     if hasattr(args, "run_method"):
-        args.run_method(args)
+        try:
+            args.run_method(args)
+        except SanityCheckError as e:
+            # testing Z3 is pointless if it does not agree with the definitions
+            print_warning("sanity check failed")
+            print_content(str(e))
+            sys.exit(1)
     else:
         parser.print_help()
 
@@ -0,0 +1,46 @@
+'''
+Argument types that are shared by the parsers of the subcommands
+'''
+
+import argparse
+import os
+
+
+def positive_int(value: str) -> int:
+    '''
+    parses an integer that is at least 1, for argparse
+    '''
+    return _bounded_int(value, 1)
+
+
+def non_negative_int(value: str) -> int:
+    '''
+    parses an integer that is at least 0, for argparse
+    '''
+    return _bounded_int(value, 0)
+
+
+def check_source_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    '''
+    checks the arguments of the word sources (see random_word.make_source) that depend on each other,
+    such that they fail before any words are drawn. Exits through parser.error if they do not fit
+    '''
+    if args.source == "dictionary" and args.dictionary is None:
+        parser.error("--source dictionary needs --dictionary")
+    if args.dictionary is not None and args.source in ("dictionary", "mutation") and not os.path.isfile(args.dictionary):
+        parser.error(f"--dictionary {args.dictionary} is not a file")
+    if len(args.alphabet) == 0:
+        parser.error("--alphabet must not be empty")
+    min_length, max_length = args.lengths
+    if min_length < 0 or min_length > max_length:
+        parser.error(f"--lengths {min_length} {max_length}: MIN must be at least 0 and at most MAX")
+
+
+def _bounded_int(value: str, minimum: int) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'") from None
+    if number < minimum:
+        raise argparse.ArgumentTypeError(f"must be at least {minimum}, got {number}")
+    return number
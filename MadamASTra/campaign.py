@@ -0,0 +1,201 @@
+'''
+This module checkpoints search campaigns, such that a search that was stopped, or whose machine was lost, can be resumed.
+A campaign lives in a directory:
+- campaign.json: the arguments that determine the work items of the search, written once when the campaign starts,
+  and the fingerprint of its words (see WordSource.fingerprint)
+- words.txt: a copy of the word list of the search, if it reads one from a file
+- results.jsonl: the record of every test (see result_log), including the mistakes and findings
+- checkpoints.jsonl: append-only checkpoints, each with the ranges of the indices of the work items that completed
+  since the checkpoint before, and the aggregate stats of the campaign so far
+Nothing is ever rewritten. A checkpoint that is cut off by a crash is skipped, its work items are run again on resume.
+'''
+
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Iterator
+from result_log import TestRecord
+
+SETTINGS = "campaign.json"
+CHECKPOINTS = "checkpoints.jsonl"
+RESULTS = "results.jsonl"
+WORDS = "words.txt"
+# the setting that holds the fingerprint of the words of the campaign
+FINGERPRINT = "words_sha256"
+# the arguments of a search that determine its stream of work items and how they are tested
+CAMPAIGN_ARGS = ["runs", "timeout", "seed", "campaign_seed", "deficit", "style", "source", "dictionary", "alphabet",
+                 "lengths", "length_distribution", "mutations", "differential", "z3", "slowdown"]
+
+
+def to_ranges(indices: list[int]) -> list[list[int]]:
+    '''
+    returns the indices as a sorted list of [first, last] ranges
+    '''
+    ranges = []
+    for index in sorted(indices):
+        if len(ranges) > 0 and ranges[-1][1] + 1 >= index:
+            ranges[-1][1] = max(ranges[-1][1], index)
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def merge_ranges(ranges: list[list[int]]) -> list[list[int]]:
+    '''
+    returns the union of the [first, last] ranges as a sorted list of disjoint ranges
+    '''
+    merged = []
+    for first, last in sorted(ranges):
+        if len(merged) > 0 and merged[-1][1] + 1 >= first:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class Campaign():
+    '''
+    summary: keeps track of the work items of a search campaign that completed, and checkpoints them to directory.
+    Can be shared between threads.
+    targets: the number of results of a work item, which is only complete once all of them are in
+    interval: time [seconds] after which the completed work items are checkpointed
+    '''
+
+    def __init__(self, directory: str, targets: int = 1, interval: float = 10.0) -> None:
+        self.directory = directory
+        self.targets = targets
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.done = []
+        self.ends_with_newline = True
+        self.stats = {"tests": 0, "mistakes": 0, "timeouts": 0, "findings": 0, "elapsed": 0.0}
+        self.__load()
+        self.started = time.monotonic()
+        self.elapsed = self.stats["elapsed"]
+        # the work items that are handed out but not complete: the indices and missing results per work item
+        self.pending = {}
+        self.completed = []
+        self.last_checkpoint = time.monotonic()
+        self.file = open(os.path.join(directory, CHECKPOINTS), "a", encoding='utf-8')  # pylint: disable=consider-using-with
+        if self.file.tell() > 0 and not self.ends_with_newline:
+            # the last checkpoint was cut off, the next one must not be glued to it
+            self.file.write("\n")
+
+    @staticmethod
+    def create(directory: str, settings: dict) -> None:
+        '''
+        summary: starts a campaign in directory with the given settings
+        raises: FileExistsError if directory already holds a campaign
+        '''
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SETTINGS)
+        if os.path.exists(path):
+            raise FileExistsError(f"{directory} already holds a campaign")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding='utf-8') as f:
+            json.dump(settings, f, indent=2)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def snapshot(directory: str, words: str) -> str:
+        '''
+        summary: copies the word list words into directory, before the campaign is created in it,
+        such that the words of the campaign do not change with the original list
+        returns: the path of the copy
+        raises: FileExistsError if directory already holds a campaign
+        '''
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, SETTINGS)):
+            raise FileExistsError(f"{directory} already holds a campaign")
+        copy = os.path.join(directory, WORDS)
+        temporary = f"{copy}.{os.getpid()}.tmp"
+        shutil.copyfile(words, temporary)
+        os.replace(temporary, copy)
+        return copy
+
+    @staticmethod
+    def settings(directory: str) -> dict:
+        '''
+        returns the settings of the campaign in directory
+        raises: FileNotFoundError if directory holds no campaign
+        '''
+        with open(os.path.join(directory, SETTINGS), "r", encoding='utf-8') as f:
+            return json.load(f)
+
+    def completed_before(self) -> int:
+        '''
+        returns the number of work items that completed in earlier runs of the campaign
+        '''
+        return sum(last - first + 1 for first, last in self.done)
+
+    def track(self, work: Iterator[tuple]) -> Iterator[tuple]:
+        '''
+        summary: skips the work items of the stream work that completed before, and keeps track of the others
+        '''
+        done = iter(self.done)
+        skip = next(done, None)
+        for index, work_item in enumerate(work):
+            while skip is not None and skip[1] < index:
+                skip = next(done, None)
+            if skip is not None and skip[0] <= index:
+                continue
+            with self.lock:
+                self.pending.setdefault(work_item, []).append([index, self.targets])
+            yield work_item
+
+    def complete(self, work_item: tuple, record: TestRecord) -> None:
+        '''
+        summary: records a result of work_item, checkpoints if the last checkpoint is interval seconds old
+        '''
+        with self.lock:
+            self.stats["tests"] += 1
+            self.stats["mistakes"] += record.mistake and not record.finding
+            self.stats["timeouts"] += record.timed_out
+            self.stats["findings"] += bool(record.finding)
+            # identical work items are interchangeable, so the results go to the oldest of them
+            entries = self.pending.get(work_item)
+            if entries is None:
+                return
+            entries[0][1] -= 1
+            if entries[0][1] == 0:
+                self.completed.append(entries.pop(0)[0])
+                if len(entries) == 0:
+                    del self.pending[work_item]
+            if time.monotonic() - self.last_checkpoint >= self.interval:
+                self.__checkpoint()
+
+    def close(self) -> None:
+        '''
+        summary: checkpoints the work items that completed since the last checkpoint
+        '''
+        with self.lock:
+            if not self.file.closed:
+                self.__checkpoint()
+                self.file.close()
+
+    def __checkpoint(self) -> None:
+        self.stats["elapsed"] = round(self.elapsed + time.monotonic() - self.started, 3)
+        entry = {"done": to_ranges(self.completed), "stats": self.stats, "time": time.time()}
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.completed = []
+        self.last_checkpoint = time.monotonic()
+
+    def __load(self) -> None:
+        path = os.path.join(self.directory, CHECKPOINTS)
+        if not os.path.exists(path):
+            return
+        ranges = []
+        with open(path, "r", encoding='utf-8') as f:
+            for line in f:
+                self.ends_with_newline = line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                    ranges += entry["done"]
+                    self.stats = entry["stats"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+        self.done = merge_ranges(ranges)
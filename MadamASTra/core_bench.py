@@ -0,0 +1,278 @@
+"""
+This module contains the benchmarks of MadamASTra.
+They measure how long the different parts of generating formulas take,
+and how many tests per second the search gets done with each executor and backend,
+such that changes to them can be compared against the previous implementations.
+The results can be saved as JSON and compared against a saved baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from typing import NamedTuple
+import core_search
+from c_printer import print_content, print_success, print_title, print_warning
+from edit_distance import banded_edit_distance, compute_edit_distance, hirschberg_edit_script, table_edit_script
+from formula_generator import get_sat_z3_formulas, get_unsat_z3_formula, just_compute_edit_distance
+from z3_tester import Z3Tester
+
+SUITES = ["distance", "formula", "throughput"]
+# the search options of the configurations whose throughput is measured
+THROUGHPUT_CONFIGS = {
+    "process": ["-e", "process"],
+    "process-batch": ["-e", "process", "-b", "8"],
+    "process-workers": ["-e", "process", "-w", "1"],
+    "thread": ["-e", "thread"],
+    "thread-workers": ["-e", "thread", "-w", "4"],
+    "async": ["-e", "async"],
+    "api": ["-e", "process", "--backend", "api"],
+}
+FAKE_Z3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_z3.py")
+
+
+class BenchResult(NamedTuple):
+    '''a single measurement. unit is either s (lower is better) or tests/s (higher is better)'''
+    suite: str
+    name: str
+    value: float
+    unit: str
+
+
+def add_parser(parser: argparse.ArgumentParser) -> None:
+    '''adds the arguments to the parser used for benchmarking'''
+    parser.set_defaults(run_mode="bench")
+    parser.set_defaults(run_method=run)
+    parser.add_argument("-s", "--suites", nargs="+", choices=SUITES, default=["distance", "formula"],
+                        help="the benchmarks to run. default: distance formula")
+    parser.add_argument("-l", "--lengths", type=int, nargs="+", default=[10, 100, 1000],
+                        help="word lengths to benchmark. default: 10 100 1000")
+    parser.add_argument("-d", "--distances", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="edit distances to benchmark the assembly of sat formulas for. default: 10 100 1000 10000")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="number of repetitions per measurement. default: 3")
+    parser.add_argument("--seed", type=int, default=0, help="the seed used to generate the words. default: 0")
+    parser.add_argument("-c", "--configs", nargs="+", choices=list(THROUGHPUT_CONFIGS), default=list(THROUGHPUT_CONFIGS),
+                        help="the executors and backends to measure the throughput of. default: all")
+    parser.add_argument("-r", "--runs", type=int, default=64, help="number of tests per throughput measurement. default: 64")
+    parser.add_argument("-t", "--timeout", type=int, default=5, help="Z3 timeout [seconds] of the throughput tests. default: 5")
+    parser.add_argument("--fake-z3", action="store_true",
+                        help="measure the throughput with a stand-in for z3 that answers unknown right away, "
+                        "which leaves only the overhead of MadamASTra")
+    parser.add_argument("-o", "--output", type=str, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, metavar="BASELINE",
+                        help="compare the results against a JSON file written by --output and flag regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change that counts as a regression in --compare. default: 0.1")
+
+
+def measure(function, *args, repeat: int = 3) -> float:
+    '''returns the best time [seconds] out of repeat calls of function(*args)'''
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_word_pair(length: int, rng: random.Random) -> tuple[str, str]:
+    '''returns a random word and a copy of it in which about a quarter of the characters were changed'''
+    word1 = "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+    word2 = list(word1)
+    for _ in range(length // 4):
+        word2[rng.randrange(length)] = rng.choice(string.ascii_lowercase)
+    return word1, "".join(word2)
+
+
+def print_results(key: str, results: list[BenchResult]) -> None:
+    '''prints the timings of a measurement on a single line'''
+    # the names start with the engine or function that was measured
+    print_content(f"{key}, " + ", ".join(f"{result.name.split(' ')[0]}: {result.value * 1000:10.3f}ms"
+                                         for result in results))
+
+
+def bench_edit_distance(lengths: list[int], repeat: int, rng: random.Random) -> list[BenchResult]:
+    '''compares the edit distance engines against the original DP'''
+    results = []
+    print_title("edit distance")
+    for length in lengths:
+        word1, word2 = random_word_pair(length, rng)
+        distance = compute_edit_distance(word1, word2)
+        timings = {
+            "original": measure(just_compute_edit_distance, word1, word2, repeat=repeat),
+            "python": measure(compute_edit_distance, word1, word2, "python", repeat=repeat),
+            "numpy": measure(compute_edit_distance, word1, word2, "numpy", repeat=repeat),
+            "myers": measure(compute_edit_distance, word1, word2, "myers", repeat=repeat),
+            "banded": measure(banded_edit_distance, word1, word2, distance, repeat=repeat),
+        }
+        measured = [BenchResult("distance", f"{name} length={length}", seconds, "s") for name, seconds in timings.items()]
+        print_results(f"length: {length:6}", measured)
+        results += measured
+
+    print_title("edit script")
+    for length in lengths:
+        word1, word2 = random_word_pair(length, rng)
+        timings = {
+            "table": measure(table_edit_script, word1, word2, repeat=repeat),
+            "hirschberg": measure(hirschberg_edit_script, word1, word2, repeat=repeat),
+        }
+        measured = [BenchResult("distance", f"{name} length={length}", seconds, "s") for name, seconds in timings.items()]
+        print_results(f"length: {length:6}", measured)
+        results += measured
+    return results
+
+
+def bench_formulas(lengths: list[int], distances: list[int], repeat: int, rng: random.Random) -> list[BenchResult]:
+    '''measures how long the sat and unsat formulas take to generate for words of the given lengths,
+    and how long get_sat_z3_formulas takes to assemble formulas with the given edit distances'''
+    results = []
+    print_title("formulas")
+    for length in lengths:
+        word1, word2 = random_word_pair(length, rng)
+        measured = [
+            BenchResult("formula", f"sat length={length}", measure(get_sat_z3_formulas, word1, word2, repeat=repeat), "s"),
+            BenchResult("formula", f"unsat length={length}",
+                        measure(get_unsat_z3_formula, word1, word2, 0, repeat=repeat), "s")]
+        print_results(f"length: {length:6}", measured)
+        results += measured
+
+    print_title("sat formulas")
+    for distance in distances:
+        # transforming the empty word takes exactly one insert per character,
+        # so the time goes to assembling the formula rather than to the DP
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(distance))
+        measured = [BenchResult("formula", f"get_sat_z3_formulas distance={distance}",
+                                measure(get_sat_z3_formulas, "", word, repeat=repeat), "s")]
+        print_results(f"edit distance: {distance:6}", measured)
+        results += measured
+    return results
+
+
+def measure_throughput(config: list[str], runs: int, timeout: int, seed: int) -> float:
+    '''runs runs tests of the search with the given search options and returns the number of tests per second.
+    The words are short, such that Z3 solves them quickly and the overhead shows'''
+    parser = argparse.ArgumentParser()
+    core_search.add_parser(parser)
+    args = parser.parse_args(["-r", str(runs), "-t", str(timeout), "--source", "alphabet", "--lengths", "1", "4",
+                              "--campaign-seed", str(seed), "--seed", str(seed), "--results", ""] + config)
+    z3_tester = Z3Tester(args.verbose, args.timeout, args.workers, args.worker_reset, args.backend, args.style,
+                         sanity_check=False)
+    work = core_search.generate_work(args, core_search.CONFIGS)
+    done = 0
+
+    def count(*_):
+        nonlocal done
+        done += 1
+
+    try:
+        if args.executor == "async":
+            start = time.perf_counter()
+            asyncio.run(core_search.run_async(args, z3_tester, work, count))
+        else:
+            pool = core_search.make_pool(args, z3_tester)
+            start = time.perf_counter()
+            try:
+                for results, _ in pool.imap_unordered(core_search.run_work_batch, core_search.batched(work, args.batch),
+                                                      chunksize=core_search.get_chunksize(args)):
+                    done += len(results)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        return done / (time.perf_counter() - start)
+    finally:
+        z3_tester.close()
+
+
+def use_fake_z3(directory: str) -> None:
+    '''puts a z3 that runs fake_z3.py into directory and in front of the PATH of this process and its children'''
+    path = os.path.join(directory, "z3")
+    with open(path, "w", encoding='utf-8') as f:
+        f.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{FAKE_Z3}\" \"$@\"\n")
+    os.chmod(path, 0o755)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+
+def bench_throughput(configs: list[str], runs: int, timeout: int, seed: int, fake: bool) -> list[BenchResult]:
+    '''measures the tests per second of the search for each of the configs'''
+    results = []
+    print_title("throughput (fake z3)" if fake else "throughput")
+    for name in configs:
+        if name == "api" and fake:
+            print_content(f"{name:16} skipped, the fake z3 can only replace the binary")
+            continue
+        try:
+            tests_per_second = measure_throughput(THROUGHPUT_CONFIGS[name], runs, timeout, seed)
+        except ImportError as e:
+            print_warning(f"{name} skipped")
+            print_content(str(e))
+            continue
+        result = BenchResult("throughput-fake" if fake else "throughput", name, tests_per_second, "tests/s")
+        print_content(f"{name:16} {tests_per_second:10.2f} tests/s")
+        results.append(result)
+    return results
+
+
+def compare(results: list[BenchResult], baseline_path: str, threshold: float) -> int:
+    '''compares results against the baseline and returns the number of regressions.
+    A result regressed if it is worse than the baseline by more than threshold (relative)'''
+    with open(baseline_path, "r", encoding='utf-8') as f:
+        baseline = {(entry["suite"], entry["name"]): entry for entry in json.load(f)["results"]}
+    print_title("comparison")
+    regressions = 0
+    for result in results:
+        entry = baseline.get((result.suite, result.name))
+        if entry is None or entry["value"] <= 0:
+            continue
+        change = result.value / entry["value"] - 1
+        worse = change > threshold if result.unit == "s" else change < -threshold
+        line = f"{result.suite:16} {result.name:36} {entry['value']:12.6g} -> {result.value:12.6g} {result.unit:8} {change:+8.1%}"
+        if worse:
+            regressions += 1
+            print_warning("regression")
+        print_content(line)
+    return regressions
+
+
+def run(args: argparse.Namespace) -> None:
+    '''runs the benchmarks
+    args: the parsed arguments from the CLI
+    '''
+    rng = random.Random(args.seed)
+    results = []
+    if "distance" in args.suites:
+        results += bench_edit_distance(args.lengths, args.repeat, rng)
+    if "formula" in args.suites:
+        results += bench_formulas(args.lengths, args.distances, args.repeat, rng)
+    if "throughput" in args.suites:
+        if args.fake_z3:
+            with tempfile.TemporaryDirectory() as directory:
+                use_fake_z3(directory)
+                results += bench_throughput(args.configs, args.runs, args.timeout, args.seed, True)
+        elif shutil.which("z3") is None:
+            print_warning("z3 not found, use --fake-z3 to measure the throughput without it")
+        else:
+            results += bench_throughput(args.configs, args.runs, args.timeout, args.seed, False)
+
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump({"time": time.time(), "python": sys.version, "results": [result._asdict() for result in results]},
+                      f, indent=2)
+        print_content(f"results written to {args.output}")
+
+    regressions = 0
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+
+    print_title("done")
+    if args.compare:
+        if regressions > 0:
+            print_warning(f"{regressions} regressions")
+            sys.exit(1)
+        print_success("no regressions")
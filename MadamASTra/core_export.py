@@ -0,0 +1,149 @@
+"""
+This module contains the export command, which generates a benchmark set of SMT files.
+The formulas of many word pairs are generated by a pool of processes and stored, named by their content
+and without duplicates, in a directory or a compressed archive together with a manifest,
+such that other solvers and CI can use them without generating them again.
+"""
+
+import argparse
+import os
+import random
+import signal
+import string
+import threading
+from functools import partial
+from itertools import islice, product
+from multiprocessing import Pool
+import alive_progress
+from arguments import check_source_args, positive_int
+from c_printer import print_content, print_success, print_title, print_warning
+from core_search import throttle
+from formula_generator import FORMULA_STYLES
+from random_word import LENGTH_DISTRIBUTIONS, SOURCES, WordGenerator, make_source, test_seed
+from smt_export import ARCHIVE_MODES, MANIFEST, generate, is_archive, make_exporter
+
+# number of formulas that are handed to a process of the pool at once
+CHUNKSIZE = 32
+
+
+def add_parser(parser: argparse.ArgumentParser) -> None:
+    '''
+    adds the arguments to the parser used for exporting formulas
+    '''
+    parser.set_defaults(run_mode="export")
+    parser.set_defaults(run_method=run)
+    parser.set_defaults(check_method=partial(check_source_args, parser))
+    parser.add_argument("-n", "--count", type=int, default=100,
+                        help="number of word pairs, each exported in every mode and for every solver. "
+                        "0 exports every pair of --pairs. default: 100")
+    parser.add_argument("-o", "--output", type=str, default="export",
+                        help="the directory to export into, or an archive ending in "
+                        f"{', '.join(ARCHIVE_MODES)}. default: export")
+    parser.add_argument("--pairs", type=str, metavar="PATH",
+                        help="file with a word pair per line (separated by whitespace) to export instead of drawing "
+                        "the words from --source")
+    parser.add_argument("-m", "--mode", choices=["sat", "unsat", "both"], default="both",
+                        help="the modes to export. default: both")
+    parser.add_argument("-s", "--solver", choices=["seq", "z3str3", "both"], default="both",
+                        help="the solvers to export for. default: both")
+    parser.add_argument("--campaign-seed", type=int,
+                        help="the seed of the words and of the unsat formulas. default: random")
+    parser.add_argument("--deficit", type=positive_int, default=1,
+                        help="how many operations less than the edit distance the unsat formulas use. default: 1")
+    parser.add_argument("--style", choices=FORMULA_STYLES, default="nested",
+                        help="how the chain of operations is written in SMT. default: nested")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="number of processes that generate formulas. default: 0 (one per CPU)")
+    parser.add_argument("--source", choices=SOURCES, default="local",
+                        help="where the words come from. default: local")
+    parser.add_argument("--dictionary", type=str, help="word list (one word per line) for the dictionary and mutation sources")
+    parser.add_argument("--alphabet", type=str, default=string.ascii_lowercase,
+                        help="the characters of the alphabet and mutation sources. default: a-z")
+    parser.add_argument("--lengths", type=int, nargs=2, default=[1, 12], metavar=("MIN", "MAX"),
+                        help="word lengths of the alphabet source. default: 1 12")
+    parser.add_argument("--length-distribution", choices=LENGTH_DISTRIBUTIONS, default="uniform",
+                        help="how the word lengths of the alphabet source are distributed. default: uniform")
+    parser.add_argument("--mutations", type=positive_int, default=3,
+                        help="maximum number of edits between the words of the mutation source. default: 3")
+
+
+def read_pairs(path: str):
+    '''lazily yields the word pairs of a file with a pair per line. Empty lines and lines starting with # are skipped'''
+    with open(path, "r", encoding='utf-8') as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 0 or words[0].startswith("#"):
+                continue
+            if len(words) != 2:
+                print_warning(f"skipping line \"{line.strip()}\", it is not a pair of words")
+                continue
+            yield words[0], words[1]
+
+
+def generate_work(args: argparse.Namespace, configs: list[tuple[str, str]]):
+    '''lazily generates the formulas to export: every pair in every configuration of mode and solver.
+    The configurations of a pair share the seed of its unsat formulas
+    '''
+    if args.pairs:
+        pairs = read_pairs(args.pairs)
+    else:
+        source = make_source(args.source, args.dictionary, args.alphabet, args.lengths,
+                             args.length_distribution, args.mutations)
+        pairs = WordGenerator(source).pairs(args.campaign_seed)
+    if args.count > 0:
+        pairs = islice(pairs, args.count)
+    for index, (word1, word2) in enumerate(pairs):
+        seed = test_seed(args.campaign_seed, index)
+        for mode, solver in configs:
+            yield (word1, word2, mode, solver, seed, args.style, args.deficit)
+
+
+def export_item(work_item: tuple):
+    '''generates the formula of a work item in a process of the pool'''
+    return generate(*work_item)
+
+
+def run(args: argparse.Namespace) -> None:
+    '''exports the formulas of many word pairs
+    args: the parsed arguments from the CLI
+    '''
+    if args.count == 0 and not args.pairs:
+        print_warning("--count 0 needs --pairs, the word sources never run out")
+        return
+    modes = ["sat", "unsat"] if args.mode == "both" else [args.mode]
+    solvers = ["seq", "z3str3"] if args.solver == "both" else [args.solver]
+    configs = list(product(modes, solvers))
+    if args.campaign_seed is None:
+        args.campaign_seed = random.randrange(2**32)
+    processes = args.processes if args.processes > 0 else os.cpu_count()
+
+    print_title("exporting formulas")
+    print_content(f"campaign seed: {args.campaign_seed}")
+    exporter = make_exporter(args.output)
+    # the formulas wait in memory until they are written, so only a few chunks per process are generated ahead
+    in_flight = threading.Semaphore(4 * processes * CHUNKSIZE)
+    exported, duplicates = 0, 0
+    try:
+        # ctrl-c is handled here, the processes of the pool ignore it
+        with Pool(processes, signal.signal, (signal.SIGINT, signal.SIG_IGN)) as pool, \
+                alive_progress.alive_bar(args.count * len(configs) or None) as progress:
+            work = throttle(generate_work(args, configs), threading.Event(), in_flight)
+            for data, entry in pool.imap(export_item, work, CHUNKSIZE):
+                in_flight.release()
+                if exporter.add(data, entry):
+                    exported += 1
+                else:
+                    duplicates += 1
+                progress()
+    except KeyboardInterrupt:
+        print_warning("aborted")
+    finally:
+        exporter.close()
+
+    print_title("done")
+    print_content(f"{exported} formulas exported, {duplicates} duplicates skipped")
+    print_success(f"written to {args.output}")
+    if is_archive(args.output):
+        print_content(f"the manifest is {MANIFEST} in the archive")
+    else:
+        print_content(f"the manifest is {os.path.join(args.output, MANIFEST)}")
@@ -6,9 +6,14 @@ module is to debug both MadamASTra and Z3.
 """
 
 import argparse
-from formula_generator import get_sat_z3_formulas, get_unsat_z3_formula, wrap_formula
+import random
+from arguments import positive_int
+from formula_generator import iter_sat_z3_formula, iter_unsat_z3_formula, write_formula, FORMULA_STYLES
 from c_printer import print_title, print_content, print_warning, print_success
 
+# formulas up to this size [bytes] are also printed
+PRINT_LIMIT = 1 << 16
+
 def add_parser(parser: argparse.ArgumentParser) -> None:
     '''
     add the parser for the log command
@@ -27,6 +32,12 @@ def add_parser(parser: argparse.ArgumentParser) -> None:
                         help="the mode to use. default: sat")
     parser.add_argument("-f", "--file", type=str, help="the file to write the SMT formula to")
     parser.add_argument("--seed", type=int, help="the seed to use for the unsat mode")
+    parser.add_argument("--deficit", type=positive_int, default=1,
+                        help="how many operations less than the edit distance the unsat formula uses. default: 1")
+    parser.add_argument("--style",
+                        choices=FORMULA_STYLES,
+                        default="nested",
+                        help="how the chain of operations is written in SMT. default: nested")
 
 
 def run(args: argparse.Namespace) -> None:
@@ -36,21 +47,20 @@ def run(args: argparse.Namespace) -> None:
     '''
     print_title("generating SMT files")
 
-    # generate formulas depending on the mode
+    # the formulas are generated piece by piece while they are written, not as a whole
     if args.mode == "sat":
-        formulas, _ = get_sat_z3_formulas(args.word1, args.word2)
+        pieces = iter_sat_z3_formula(args.word1, args.word2, args.style)
     elif args.mode == "unsat":
-        formulas, _ = get_unsat_z3_formula(args.word1, args.word2, seed=args.seed)
+        seed = args.seed if args.seed is not None else random.randrange(2**32)
+        pieces = iter_unsat_z3_formula(args.word1, args.word2, seed, style=args.style, deficit=args.deficit)
+        print_content(f"seed: {seed}")
     else:
         print_warning(f"unknown mode {args.mode}")
         return
+    if args.s not in ["seq", "z3str3"]:
+        print_warning(f"unknown solver {args.s}")
+        return
 
-    # add the solver and wrap the formulas in a string that can be written to a file
-    full_formula = wrap_formula(formulas, args.s)
-
-    print_content(full_formula)
-
-    # write to file
     if args.file:
         file_name = args.file
         file_name = "".join(x for x in file_name if x.isalnum() or x in ["_", "."])
@@ -58,8 +68,16 @@ def run(args: argparse.Namespace) -> None:
             file_name += ".smt2"
     else:
         file_name = f"{args.word1}_{args.word2}_{args.mode}_{args.s}.smt2"
-    with open(file_name, "w", encoding='utf-8') as f:
-        f.write(full_formula)
+
+    # add the solver and write the wrapped formula to the file
+    with open(file_name, "wb") as f:
+        size = write_formula(f, pieces, args.s)
+
+    if size <= PRINT_LIMIT:
+        with open(file_name, "r", encoding='utf-8') as f:
+            print_content(f.read())
+    else:
+        print_content(f"the formula has {size} bytes, too many to print")
 
     print_success(f"written to {file_name}")
 
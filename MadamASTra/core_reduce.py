@@ -0,0 +1,96 @@
+"""
+This module contains the reduce command, which shrinks a test on which Z3 made a mistake.
+A mistake found by the search comes with long words and a seed, which is slow to triage by hand.
+The words are reduced first, which keeps the verdict of the formula guaranteed, and then the formula itself.
+"""
+
+import argparse
+from random import randint
+from arguments import positive_int
+from c_printer import print_content, print_success, print_title, print_warning
+from formula_generator import FORMULA_STYLES, wrap_preamble
+from reducer import Reducer
+from result_cache import CACHE_PATH
+from z3_driver import BACKENDS
+from z3_tester import WRONG_RESPONSES, Z3Tester
+
+SOLVERS = ["seq", "z3str3"]
+
+
+def add_parser(parser: argparse.ArgumentParser) -> None:
+    '''
+    adds the arguments to the parser used for reducing a test on which Z3 made a mistake
+    '''
+    parser.set_defaults(run_mode="reduce")
+    parser.set_defaults(run_method=run)
+    parser.add_argument("word1", help="first word")
+    parser.add_argument("word2", help="second word")
+    parser.add_argument("-s", "--solver", choices=SOLVERS, default="seq", help="the solver that made the mistake. default: seq")
+    parser.add_argument("-m", "--mode", choices=["sat", "unsat"], default="sat", help="the mode of the test. default: sat")
+    parser.add_argument("--seed", type=int, help="the seed of the unsat mode. default: random")
+    parser.add_argument("--deficit", type=positive_int, default=1,
+                        help="how many operations less than the edit distance the unsat formulas use. default: 1")
+    parser.add_argument("--verdict", type=str,
+                        help="the answer of Z3 that has to be kept, e.g. unknown. default: the wrong verdict of the mode")
+    parser.add_argument("--reference", choices=SOLVERS + ["none"],
+                        help="the solver that has to confirm the expected verdict of formulas that are reduced "
+                        "beyond the words. none only reduces the words. default: the other solver")
+    parser.add_argument("-t", "--timeout", type=int, default=30, help="Z3 timeout [seconds] of every candidate. default: 30")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="number of candidates that are tried at the same time. default: 0 (four per CPU)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="makes the command line output more verbose")
+    parser.add_argument("--backend", choices=BACKENDS, default="subprocess",
+                        help="how Z3 is run: the z3 binary or the z3 python bindings. default: subprocess")
+    parser.add_argument("--style", choices=FORMULA_STYLES, default="nested",
+                        help="how the chain of operations is written in SMT. default: nested")
+    parser.add_argument("--cache", nargs="?", const=CACHE_PATH, metavar="PATH",
+                        help=f"reuse the results of formulas that Z3 already solved, stored at PATH. default PATH: {CACHE_PATH}")
+    parser.add_argument("-f", "--file", type=str, help="the file to write the reduced SMT formula to")
+
+
+def run(args: argparse.Namespace) -> None:
+    '''reduces the test of word1 and word2
+    args: the parsed arguments from the CLI
+    '''
+    verdict = args.verdict or WRONG_RESPONSES[args.mode]
+    reference = args.reference or [solver for solver in SOLVERS if solver != args.solver][0]
+    # the seed must not change between candidates
+    seed = args.seed if args.seed is not None else randint(0, 2**32)
+
+    z3_tester = Z3Tester(args.verbose, args.timeout, backend=args.backend, formula_style=args.style,
+                         sanity_check=False, cache=args.cache, deficit=args.deficit)
+    reducer = Reducer(z3_tester, args.mode, args.solver, seed, verdict,
+                      None if reference == "none" else reference, args.processes)
+
+    print_content(f"words: {args.word1}, {args.word2}, mode: {args.mode}, solver: {args.solver}, seed: {seed}")
+    try:
+        if not reducer.interesting(reducer.query(args.word1, args.word2)):
+            print_warning(f"Z3 does not answer {verdict} on this test, nothing to reduce")
+            return
+
+        print_title("reducing words")
+        word1, word2 = reducer.reduce_words(args.word1, args.word2)
+        query = reducer.query(word1, word2)
+
+        if reducer.reference is not None:
+            print_title("reducing formula")
+            if reducer.interesting(query, confirm=True):
+                query = reducer.reduce_smt(query)
+            else:
+                print_warning(f"{reference} does not find {args.mode} either, the formula is kept as it is")
+    finally:
+        reducer.close()
+        z3_tester.close()
+
+    print_title("done")
+    print_content(f"words: {word1}, {word2}, seed: {seed}")
+    print_content(f"{reducer.tests} formulas tried, {reducer.hits} candidates were already known")
+    formula = wrap_preamble(args.solver) + query
+    print_content(formula)
+    if args.file:
+        file_name = args.file if args.file.endswith(".smt2") else args.file + ".smt2"
+    else:
+        file_name = f"reduced_{word1}_{word2}_{args.mode}_{args.solver}.smt2"
+    with open(file_name, "w", encoding='utf-8') as f:
+        f.write(formula)
+    print_success(f"written to {file_name}")
@@ -0,0 +1,112 @@
+"""
+This module summarizes the results that searches and tries recorded.
+It reads the JSON lines files of any number of runs, one record at a time,
+deduplicates the mistakes and timeouts of Z3 by the hash of their formula and reports
+how the verdicts of Z3 are distributed per solver and mode.
+"""
+
+import argparse
+import os
+from collections import Counter, defaultdict
+from c_printer import print_content, print_success, print_title, print_warning
+from result_log import RESULTS_PATH, read_records
+
+
+def add_parser(parser: argparse.ArgumentParser) -> None:
+    '''adds the arguments to the parser used for reporting recorded results'''
+    parser.set_defaults(run_mode="report")
+    parser.set_defaults(run_method=run)
+    parser.add_argument("files", type=str, nargs="*", default=[RESULTS_PATH],
+                        help=f"the recorded results. default: {RESULTS_PATH}")
+    parser.add_argument("-s", "--solver", choices=["seq", "z3str3"], help="only report tests of this solver")
+    parser.add_argument("-m", "--mode", choices=["sat", "unsat"], help="only report tests of this mode")
+    parser.add_argument("--verdict", type=str, help="only report tests with this verdict of Z3 (e.g. unknown)")
+    parser.add_argument("-n", "--limit", type=int, default=20,
+                        help="maximum number of mistakes that are listed. default: 20")
+
+
+def run(args: argparse.Namespace) -> None:
+    '''prints a summary of the recorded results
+    args: the parsed arguments from the CLI
+    '''
+    files = [path for path in args.files if os.path.exists(path)]
+    for path in set(args.files) - set(files):
+        print_warning(f"no results at {path}")
+
+    # per (solver, mode): number of tests, verdicts, total and max wall time
+    tests = Counter()
+    verdicts = defaultdict(Counter)
+    wall_time = Counter()
+    max_wall_time = Counter()
+    # mistakes and timeouts are rare, so only they are kept in memory
+    mistakes = {}
+    mistake_count = 0
+    # formulas that timed out and were not solved by a later test (e.g. a retry with a longer timeout)
+    timeouts = {}
+    # disagreements and slowdowns between the solvers of differential tests
+    findings = []
+    finding_counts = Counter()
+
+    for record in read_records(files):
+        if (args.solver and record.solver != args.solver) or (args.mode and record.mode != args.mode) \
+                or (args.verdict is not None and record.verdict != args.verdict):
+            continue
+        # tests of other binaries than the default z3 are reported separately
+        config = (record.solver if record.z3 == "z3" else f"{record.z3}:{record.solver}", record.mode)
+        tests[config] += 1
+        verdicts[config][record.verdict or "error"] += 1
+        wall_time[config] += record.wall_time
+        max_wall_time[config] = max(max_wall_time[config], record.wall_time)
+        if record.mistake:
+            mistake_count += 1
+            mistakes.setdefault(record.formula_hash, record)
+        if record.finding:
+            finding_counts[record.finding] += 1
+            if len(findings) < args.limit:
+                findings.append(record)
+        if record.timed_out:
+            # a formula can time out with several timeouts (e.g. in both passes of --adaptive), the longest one is reported
+            known = timeouts.get(record.formula_hash)
+            if known is None or record.timeout > known.timeout:
+                timeouts[record.formula_hash] = record
+        elif record.verdict in ("sat", "unsat"):
+            timeouts.pop(record.formula_hash, None)
+
+    print_title("results")
+    if len(tests) == 0:
+        print_content("no tests recorded")
+    for config in sorted(tests):
+        solver, mode = config
+        counts = ", ".join(f"{verdict}: {count}" for verdict, count in verdicts[config].most_common())
+        print_content(f"solver: {solver:7}, mode: {mode:5}, tests: {tests[config]:7}, {counts}")
+        print_content(f"    wall time mean: {wall_time[config] / tests[config]:8.3f}s, max: {max_wall_time[config]:8.3f}s")
+
+    if len(timeouts) > 0:
+        print_title("timeouts")
+        print_warning(f"Z3 timed out on {len(timeouts)} formulas")
+        for record in list(timeouts.values())[:args.limit]:
+            print_content(f"words: {record.word1}, {record.word2}, solver: {record.solver}, mode: {record.mode}, "
+                          f"seed: {record.seed}, timeout: {record.timeout}s, formula: {record.formula_hash[:12]}")
+        if len(timeouts) > args.limit:
+            print_content(f"... and {len(timeouts) - args.limit} more")
+
+    if len(finding_counts) > 0:
+        print_title("differential findings")
+        print_warning(", ".join(f"{count} {finding}s" for finding, count in finding_counts.most_common()))
+        for record in findings:
+            print_content(f"words: {record.word1}, {record.word2}, z3: {record.z3}, solver: {record.solver}, "
+                          f"mode: {record.mode}, seed: {record.seed}, {record.finding}: {record.verdict} "
+                          f"after {record.wall_time:.3f}s, formula: {record.formula_hash[:12]}")
+        if sum(finding_counts.values()) > args.limit:
+            print_content(f"... and {sum(finding_counts.values()) - args.limit} more")
+
+    print_title("mistakes")
+    if mistake_count == 0:
+        print_success("Z3 made no mistakes")
+        return
+    print_warning(f"Z3 made {mistake_count} mistakes, {len(mistakes)} of them unique")
+    for record in list(mistakes.values())[:args.limit]:
+        print_content(f"words: {record.word1}, {record.word2}, solver: {record.solver}, mode: {record.mode}, "
+                      f"seed: {record.seed}, verdict: {record.verdict}, formula: {record.formula_hash[:12]}")
+    if len(mistakes) > args.limit:
+        print_content(f"... and {len(mistakes) - args.limit} more")
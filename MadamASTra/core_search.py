@@ -5,23 +5,551 @@ bugs in Z3 by trying random words and configurations on Z3.
 """
 
 import argparse
+import asyncio
+import cProfile
+import os
+import random
+import secrets
+import signal
+import string
+import threading
+from functools import partial
+from itertools import islice
 import alive_progress
-from multiprocessing import Pool
+from multiprocessing import AuthenticationError, Pool
 from multiprocessing.dummy import Pool as ThreadPool
-from random import randint
-from random_word import WordGenerator
-from c_printer import print_content, print_title
-from z3_tester import Z3Tester
+from random_word import LENGTH_DISTRIBUTIONS, SOURCES, WordGenerator, local_word_list, make_source, test_seed
+from arguments import check_source_args, non_negative_int, positive_int
+from c_printer import print_content, print_title, print_warning
+from z3_tester import SOLVERS, Z3Tester
+from differential_tester import DifferentialTester
+from z3_driver import AsyncZ3Driver, BACKENDS
+from formula_generator import FORMULA_STYLES
+from result_cache import CACHE_PATH, SmtHash
+from result_log import RESULTS_PATH
+import stage_timer
+from stage_timer import StageTimings, labels, record_duration, stage
+from timeout_scheduler import TimeoutScheduler
+from corpus import CORPUS_PATH, Corpus, GuidedSource
+from work_queue import Coordinator, WorkerConnection, WorkQueue, parse_address
+from campaign import CAMPAIGN_ARGS, FINGERPRINT, RESULTS as CAMPAIGN_RESULTS, Campaign
+
+EXECUTORS = ["process", "thread", "async"]
+# the (mode, solver) configurations that the search cycles through
+CONFIGS = [
+    ("sat", "seq"),
+    ("unsat", "seq"),
+    ("sat", "z3str3"),
+    ("unsat", "z3str3")]
+# with --differential, every formula is tried on all solvers
+DIFFERENTIAL_CONFIGS = [
+    ("sat", "differential"),
+    ("unsat", "differential")]
+
+# the tester of a worker of the pool. Threads share the tester of the search,
+# every process builds its own
+_tester = None
+
 
 def add_parser(parser: argparse.ArgumentParser) -> None:
     '''adds the arguments to the parser used for searching new bugs'''
     parser.set_defaults(run_mode="search")
     parser.set_defaults(run_method=run)
-    parser.add_argument("-r", "--runs", type=int, default=5, help="number of times Z3 should be tested")
+    parser.set_defaults(check_method=partial(check_source_args, parser))
+    parser.add_argument("-r", "--runs", type=non_negative_int, default=5, help="number of times Z3 should be tested. 0 runs until stopped (ctrl-c)")
     parser.add_argument("-t", "--timeout", type=int, default=30, help="Z3 timeout [seconds]. default: 30")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="run the tests with --first-timeout first, and only retry the ones that timed out "
+                        "with --timeout after all other tests")
+    parser.add_argument("--first-timeout", type=int, default=2,
+                        help="Z3 timeout [seconds] of the first pass of --adaptive. Buckets whose solve times call for more "
+                        "get a multiple of their p95 solve time, up to --timeout. default: 2")
+    parser.add_argument("--hopeless-after", type=int, default=5,
+                        help="number of retried tests of a bucket (mode, solver, edit distance, word length) "
+                        "that time out again, after which the bucket is not retried anymore. default: 5")
+    parser.add_argument("--serve", nargs="?", const="localhost:7878", metavar="HOST:PORT",
+                        help="coordinate the search: hand out the tests to the workers that --join, "
+                        "and collect their results. default HOST:PORT: localhost:7878")
+    parser.add_argument("--join", type=str, metavar="HOST:PORT",
+                        help="work for the search that is served at HOST:PORT, until it is done or stopped. "
+                        "the timeout and the kind of tests are the ones of the coordinator")
+    parser.add_argument("--authkey", type=str,
+                        help="the key that workers authenticate with. default: $MADAMASTRA_AUTHKEY, "
+                        "or a random key that --serve prints")
+    parser.add_argument("--lease-timeout", type=float, default=300,
+                        help="time [seconds] after which the tests of a worker that did not report are handed out again. "
+                        "default: 300")
+    parser.add_argument("--differential", action="store_true",
+                        help="try every formula on both solvers and every --z3 binary at the same time, "
+                        "and flag disagreements and slowdowns between them")
+    parser.add_argument("--z3", type=str, action="append", metavar="PATH",
+                        help="the z3 binary to test. can be repeated with --differential to compare binaries. default: z3")
+    parser.add_argument("--slowdown", type=float, default=100,
+                        help="how many times slower than the fastest solver a solver must be to be flagged "
+                        "by --differential. default: 100")
     parser.add_argument("-v", "--verbose", action="store_true", help="makes the command line output more verbose")
-    parser.add_argument("--seed", type=int, help="the seed to use for the unsat mode")
-    parser.add_argument("-p", "--processes", type=int, default=32, help="number of processes to use. default: 32")
+    parser.add_argument("--seed", type=int,
+                        help="the seed of every unsat formula. default: a seed per test, derived from the campaign seed")
+    parser.add_argument("--deficit", type=positive_int, default=1,
+                        help="how many operations less than the edit distance the unsat formulas use. default: 1")
+    parser.add_argument("-e", "--executor", choices=EXECUTORS, default="process",
+                        help="run the tests in a pool of processes, of threads or from an asyncio event loop. default: process")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="number of processes (threads, Z3 runs in flight for async) to use. default: 0 (one process or four threads per CPU)")
+    parser.add_argument("-c", "--chunksize", type=int, default=0,
+                        help="number of tests handed to a worker at once. default: 0 (chosen from runs and processes)")
+    parser.add_argument("-b", "--batch", type=positive_int, default=1,
+                        help="number of tests that are solved by a single Z3 script. default: 1")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="number of persistent Z3 processes (or api worker processes) to use per process. default: 0 (spawn one Z3 per formula)")
+    parser.add_argument("--worker-reset", action="store_true",
+                        help="(reset) persistent Z3 processes between formulas instead of using (push)/(pop)")
+    parser.add_argument("--backend", choices=BACKENDS, default="subprocess",
+                        help="how Z3 is run: the z3 binary or the z3 python bindings. default: subprocess")
+    parser.add_argument("--style", choices=FORMULA_STYLES, default="nested",
+                        help="how the chain of operations is written in SMT. default: nested")
+    parser.add_argument("--source", choices=SOURCES, default="local",
+                        help="where the words come from. local uses the cache of words fetched online, "
+                        "or the offline words if there is none. default: local")
+    parser.add_argument("--campaign-seed", type=int,
+                        help="the seed of the stream of words and of the seeds of the tests. default: random")
+    parser.add_argument("--dictionary", type=str, help="word list (one word per line) for the dictionary and mutation sources")
+    parser.add_argument("--alphabet", type=str, default=string.ascii_lowercase,
+                        help="the characters of the alphabet and mutation sources. default: a-z")
+    parser.add_argument("--lengths", type=int, nargs=2, default=[1, 12], metavar=("MIN", "MAX"),
+                        help="word lengths of the alphabet source. default: 1 12")
+    parser.add_argument("--length-distribution", choices=LENGTH_DISTRIBUTIONS, default="uniform",
+                        help="how the word lengths of the alphabet source are distributed. default: uniform")
+    parser.add_argument("--mutations", type=positive_int, default=3,
+                        help="maximum number of edits between the words of the mutation source. default: 3")
+    parser.add_argument("--guided", action="store_true",
+                        help="draw most word pairs by mutating the pairs that made Z3 slow or wrong so far, "
+                        "instead of drawing them all from --source")
+    parser.add_argument("--corpus", type=str, default=CORPUS_PATH,
+                        help=f"where --guided keeps the most interesting word pairs between runs. default: {CORPUS_PATH}")
+    parser.add_argument("--corpus-size", type=int, default=1000,
+                        help="number of word pairs that --guided keeps. default: 1000")
+    parser.add_argument("--explore", type=float, default=0.2,
+                        help="share of the word pairs that --guided still draws from --source. default: 0.2")
+    parser.add_argument("--cache", nargs="?", const=CACHE_PATH, metavar="PATH",
+                        help=f"reuse the results of formulas that Z3 already solved, stored at PATH. default PATH: {CACHE_PATH}")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="run Z3 even for cached formulas and update the cache with the new results")
+    parser.add_argument("--results", type=str, default=RESULTS_PATH,
+                        help=f"JSON lines file that the outcome of every test is appended to, as soon as it completes. "
+                        f"an empty string disables it. default: {RESULTS_PATH}")
+    parser.add_argument("--campaign", type=str, metavar="DIR",
+                        help="checkpoint the campaign (its seed, completed tests, stats and results) to DIR, "
+                        "such that it can be continued with --resume DIR")
+    parser.add_argument("--resume", type=str, metavar="DIR",
+                        help="continue the campaign in DIR, skipping the tests that completed. "
+                        "The settings of the campaign override the ones given")
+    parser.add_argument("--checkpoint-interval", type=float, default=10,
+                        help="time [seconds] between the checkpoints of --campaign. default: 10")
+    parser.add_argument("--timings", action="store_true",
+                        help="time the stages of the tests (words, formula, wrap, z3, check) and report their percentiles")
+    parser.add_argument("--timings-json", type=str, metavar="PATH",
+                        help="like --timings, and writes the histograms of the stages to the JSON file at PATH")
+    parser.add_argument("--profile", type=str, metavar="PATH",
+                        help="profile the search process with cProfile and write the stats to PATH")
+
+
+def init_worker(tester, timings: bool = False) -> None:
+    '''sets the tester of a worker. tester is either a Z3Tester, a DifferentialTester or the arguments to build one
+    timings: if True, the worker times the stages of its tests
+    '''
+    global _tester
+    if timings:
+        stage_timer.enable()
+    if isinstance(tester, (Z3Tester, DifferentialTester)):
+        _tester = tester
+        return
+    # ctrl-c is handled by the search, which lets the running tests finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _tester = DifferentialTester(**tester) if "binaries" in tester else Z3Tester(**tester)
+
+
+def run_work_batch(work_items: list[tuple], timeout: int = None) -> tuple[list[tuple], dict | None]:
+    '''runs a batch of tests in a worker. The formulas are generated inside the worker
+    timeout: the timeout [seconds] of the tests, by default the one of the tester
+    returns: for every work item, the work item, the error_log entry if Z3 made a mistake (otherwise None)
+    and the record of the test. Also the stage timings that the worker recorded since its last batch, if any.
+    A DifferentialTester returns the results of every target of every work item
+    '''
+    if isinstance(_tester, DifferentialTester):
+        results = _tester.check_batch(work_items)
+    else:
+        results = [(work_item, error, record)
+                   for work_item, (error, record) in zip(work_items, _tester.check_batch(work_items, timeout))]
+    return results, stage_timer.timings().take().to_dict() if stage_timer.enabled() else None
+
+
+def run_timed_batch(timed: tuple[list[tuple], int]) -> tuple[list[tuple], dict | None]:
+    '''runs a batch of tests with its own timeout, see run_work_batch
+    returns: the results of run_work_batch
+    '''
+    return run_work_batch(*timed)
+
+
+def run_leased_batch(leased: list[tuple]) -> tuple[list[tuple], dict | None]:
+    '''runs a batch of (chunk id, index, work item) triples that a worker leased from the coordinator
+    returns: the chunk id, the index and the results of run_work_batch for every work item, and the stage timings
+    '''
+    results, timings = run_work_batch([work_item for _, _, work_item in leased])
+    # a differential tester returns the results of every target, in the order of the work items
+    per_item = len(results) // len(leased)
+    return [(chunk_id, index, results[n * per_item:(n + 1) * per_item])
+            for n, (chunk_id, index, _) in enumerate(leased)], timings
+
+
+def get_pool_size(args: argparse.Namespace) -> int:
+    '''returns the number of processes or threads that run the tests'''
+    if args.processes > 0:
+        return args.processes
+    if args.executor in ("thread", "async"):
+        # the tests mostly wait for Z3, so several tests per CPU can overlap
+        return 4 * os.cpu_count()
+    return os.cpu_count()
+
+
+def make_pool(args: argparse.Namespace, z3_tester: Z3Tester | DifferentialTester):
+    '''returns the pool of processes or threads that runs the tests'''
+    if args.executor == "thread":
+        return ThreadPool(get_pool_size(args), initializer=init_worker, initargs=(z3_tester, stage_timer.enabled()))
+    tester_args = {
+        "verbose": args.verbose,
+        "timeout": args.timeout,
+        "workers": args.workers,
+        "worker_reset": args.worker_reset,
+        "backend": args.backend,
+        "formula_style": args.style,
+        "deficit": args.deficit,
+        "sanity_check": False,
+        "cache": args.cache,
+        "cache_refresh": args.refresh_cache}
+    if getattr(args, "differential", False):
+        tester_args.update(binaries=get_binaries(args), slowdown=args.slowdown)
+    else:
+        tester_args["z3"] = get_binaries(args)[0]
+    return Pool(get_pool_size(args), initializer=init_worker, initargs=(tester_args, stage_timer.enabled()))
+
+
+def get_binaries(args: argparse.Namespace) -> list[str]:
+    '''returns the z3 binaries to test'''
+    return getattr(args, "z3", None) or ["z3"]
+
+
+def get_chunksize(args: argparse.Namespace) -> int:
+    '''returns the number of tests that are handed to a worker at once'''
+    if args.chunksize > 0:
+        return args.chunksize
+    if args.runs == 0:
+        return 1
+    # big enough to amortize the dispatch, small enough that no worker is left with a long tail
+    return max(1, min(16, args.runs // (get_pool_size(args) * 8 * args.batch)))
+
+
+def generate_work(args: argparse.Namespace, configs: list[tuple[str, str]], source=None):
+    '''lazily generates the work items of the search, endlessly if args.runs is 0
+    source: where the words come from, by default the source given by args
+    '''
+    if source is None:
+        source = make_source(args.source, args.dictionary, args.alphabet, args.lengths,
+                             args.length_distribution, args.mutations)
+    pairs = WordGenerator(source).pairs(args.campaign_seed)
+    if args.runs > 0:
+        pairs = islice(pairs, args.runs)
+    for run_no, (word1, word2) in enumerate(pairs):
+        mode_config, solver_config = configs[run_no % len(configs)]
+        # every test has its own seed, such that the campaign can be replayed no matter in which order the tests ran
+        seed = args.seed
+        if seed is None and args.campaign_seed is not None:
+            seed = test_seed(args.campaign_seed, run_no)
+        yield (word1, word2, mode_config, solver_config, seed)
+
+
+def throttle(work, stop: threading.Event, in_flight: threading.Semaphore = None):
+    '''hands out work items until stop is set.
+    in_flight: if given, a work item is only handed out once the semaphore could be acquired
+    '''
+    for work_item in work:
+        if in_flight is not None:
+            in_flight.acquire()
+        if stop.is_set():
+            return
+        yield work_item
+
+
+def batched(work, size: int):
+    '''groups the work items into lists of up to size items'''
+    batch = []
+    for work_item in work:
+        batch.append(work_item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+async def run_async(args: argparse.Namespace, z3_tester: Z3Tester, work, handle_result, timeout_of=None) -> None:
+    '''runs the tests from an asyncio event loop, keeping up to the pool size of Z3 processes in flight.
+    The formulas are generated on the loop, handle_result(work_item, error, record) is called as soon as a test completes.
+    timeout_of(work_item): the timeout [seconds] of a test, by default the one of args
+    '''
+    driver = AsyncZ3Driver(args.verbose, args.timeout, get_pool_size(args),
+                           cache=args.cache, cache_refresh=args.refresh_cache)
+
+    async def run_one(work_item):
+        word1, word2, mode_config, solver_config, seed = work_item
+        # labels are per thread, so they must not be held across an await
+        with labels(solver_config, mode_config):
+            pieces, preamble, seed = z3_tester.prepare_pieces(word1, word2, mode_config, solver_config, seed)
+        timeout = args.timeout if timeout_of is None else timeout_of(work_item)
+        smt_hash = SmtHash.after(preamble)
+        z3_result, wall_time = await driver.solve(pieces, preamble, timeout, smt_hash)
+        record_duration("z3", wall_time, solver_config, mode_config)
+        with labels(solver_config, mode_config), stage("check"):
+            error = z3_tester.evaluate(z3_result.output, word1, word2, mode_config, solver_config, seed)
+            record = z3_tester.record(z3_result, wall_time, smt_hash.hexdigest(), word1, word2, mode_config, solver_config,
+                                      seed, timeout)
+        return work_item, error, record
+
+    # only a bounded number of tests is scheduled ahead of the running ones
+    pending = set()
+    try:
+        for work_item in work:
+            pending.add(asyncio.ensure_future(run_one(work_item)))
+            if len(pending) >= 2 * get_pool_size(args):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    handle_result(*task.result())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                handle_result(*task.result())
+    finally:
+        driver.close()
+
+
+def run_pass(args: argparse.Namespace, z3_tester: Z3Tester | DifferentialTester, work, stop: threading.Event, handle_result,
+             timeout_of=None) -> None:
+    '''runs the work items with the executor and timeout of args until the work runs out or stop is set.
+    handle_result(work_item, error, record) is called as soon as a test completes
+    timeout_of(work_item): the timeout [seconds] of a test instead of the one of args. It is asked when the test is
+    handed to a worker, and a batch gets the longest timeout of its tests
+    '''
+    z3_tester.set_timeout(args.timeout)
+    if args.executor == "async":
+        asyncio.run(run_async(args, z3_tester, throttle(work, stop), handle_result, timeout_of))
+        return
+
+    # the pools consume work items eagerly, so they only get a bounded number ahead of the results
+    in_flight = threading.Semaphore(4 * get_pool_size(args) * get_chunksize(args) * args.batch)
+    pool = make_pool(args, z3_tester)
+    work = batched(throttle(work, stop, in_flight), args.batch)
+    run_batch = run_work_batch
+    if timeout_of is not None:
+        work = ((batch, max(timeout_of(work_item) for work_item in batch)) for batch in work)
+        run_batch = run_timed_batch
+    try:
+        for results, timings in pool.imap_unordered(run_batch, work, chunksize=get_chunksize(args)):
+            if timings is not None:
+                stage_timer.timings().merge(StageTimings.from_dict(timings))
+            for result in results:
+                handle_result(*result)
+                in_flight.release()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def get_authkey(args: argparse.Namespace) -> bytes | None:
+    '''returns the key that workers authenticate with, None if there is none'''
+    authkey = args.authkey or os.environ.get("MADAMASTRA_AUTHKEY")
+    return None if authkey is None else authkey.encode('utf-8')
+
+
+def serve_pass(args: argparse.Namespace, work, stop: threading.Event, handle_result) -> None:
+    '''hands out the work items to the workers that join at args.serve until the work runs out or stop is set,
+    and waits for their results. handle_result(work_item, error, record) is called as soon as a test completes
+    '''
+    authkey = get_authkey(args)
+    if authkey is None:
+        authkey = secrets.token_hex(16).encode('utf-8')
+        print_content(f"workers join with --authkey {authkey.decode('utf-8')}")
+    queue = WorkQueue(work, args.lease_timeout)
+    # the workers run the same kind of tests with their own executor and processes. They run the z3 binaries
+    # of the coordinator, such that every work item gets the results of the same targets
+    settings = {
+        "z3": args.z3,
+        "timeout": args.timeout,
+        "style": args.style,
+        "deficit": args.deficit,
+        "batch": args.batch,
+        "differential": args.differential,
+        "slowdown": args.slowdown,
+        "timings": stage_timer.enabled()}
+
+    def handle_results(results, timings):
+        if timings is not None:
+            stage_timer.timings().merge(StageTimings.from_dict(timings))
+        for chunk_id, index, item_results in results:
+            # a work item that was leased out again can come back twice
+            if queue.complete(chunk_id, index):
+                for result in item_results:
+                    handle_result(*result)
+
+    coordinator = Coordinator(parse_address(args.serve), authkey, queue, settings, handle_results)
+    print_content(f"serving at {args.serve}, waiting for workers")
+    try:
+        while not queue.wait(1.0):
+            if stop.is_set():
+                queue.stop()
+        # the workers that are still connected are told that the search is done the next time they ask for tests
+        coordinator.wait_for_workers(2 * WorkerConnection.POLL_INTERVAL + 1)
+    finally:
+        coordinator.close()
+
+
+def join(args: argparse.Namespace) -> None:
+    '''runs the tests that the coordinator at args.join hands out, with the executor and processes of args,
+    until the coordinator is done or the worker is stopped (ctrl-c)
+    '''
+    authkey = get_authkey(args)
+    if authkey is None:
+        print_warning("--join needs the --authkey that the coordinator printed")
+        return
+    try:
+        connection = WorkerConnection(parse_address(args.join), authkey)
+    except (OSError, EOFError, AuthenticationError) as e:
+        print_warning(f"could not join the search at {args.join}")
+        print_content(str(e) or "the coordinator rejected the --authkey")
+        return
+    print_content(f"joined the search at {args.join}")
+    timings = connection.settings.pop("timings")
+    if timings:
+        stage_timer.enable()
+    if args.z3 and args.z3 != connection.settings["z3"]:
+        print_warning("the coordinator names the z3 binaries, --z3 is ignored")
+    for name, value in connection.settings.items():
+        setattr(args, name, value)
+    if args.backend == "api" and args.z3:
+        print_warning("--backend api runs the z3 python bindings, it cannot run the z3 binaries of the coordinator")
+        connection.close()
+        return
+    if args.executor == "async":
+        print_warning("workers run on the process executor instead of async")
+        args.executor = "process"
+
+    binaries = get_binaries(args)
+    if args.differential:
+        tester = DifferentialTester(binaries, SOLVERS, args.verbose, args.timeout, args.workers, args.worker_reset,
+                                    args.backend, args.style, cache=args.cache, cache_refresh=args.refresh_cache,
+                                    slowdown=args.slowdown, deficit=args.deficit)
+    else:
+        tester = Z3Tester(args.verbose, args.timeout, args.workers, args.worker_reset, args.backend, args.style,
+                          cache=args.cache, cache_refresh=args.refresh_cache, z3=binaries[0], deficit=args.deficit)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+        print_warning("leaving")
+        print_content("waiting for the running tests, press ctrl-c again to abort")
+
+    previous_handler = signal.signal(signal.SIGINT, request_stop)
+    # only a bounded number of tests is leased ahead of the running ones, the rest stays with the coordinator
+    in_flight = threading.Semaphore(2 * get_pool_size(args) * args.batch)
+    leased = throttle(connection.leases(get_pool_size(args) * args.batch, stop), stop, in_flight)
+    pool = make_pool(args, tester)
+    tests = 0
+    try:
+        for results, timings in pool.imap_unordered(run_leased_batch, batched(leased, args.batch)):
+            if not connection.report(results, timings):
+                print_warning("lost the connection to the coordinator")
+                stop.set()
+                break
+            tests += len(results)
+            for _ in results:
+                in_flight.release()
+        pool.close()
+    except KeyboardInterrupt:
+        print_warning("aborted")
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        pool.terminate()
+        pool.join()
+        tester.close()
+        connection.close()
+    print_title("done")
+    print_content(f"ran {tests} tests")
+
+
+def start_campaign(args: argparse.Namespace) -> bool:
+    '''starts the campaign of --campaign or loads the one of --resume, whose settings override args.
+    The results of the search and a copy of its word list are kept in the directory of the campaign,
+    which is only resumed with the same words
+    returns: False if there is no campaign to resume, its words changed, or the directory already holds one
+    '''
+    if args.guided:
+        print_warning("--campaign ignores --guided, its word pairs depend on the results and cannot be replayed")
+        args.guided = False
+    if args.resume:
+        try:
+            settings = Campaign.settings(args.resume)
+        except (OSError, ValueError):
+            print_warning(f"there is no campaign to resume in {args.resume}")
+            return False
+        fingerprint = settings.pop(FINGERPRINT, None)
+        for name, value in settings.items():
+            setattr(args, name, value)
+        if args.dictionary is not None:
+            args.dictionary = os.path.join(args.resume, args.dictionary)
+        args.campaign = args.resume
+        try:
+            words = make_source(args.source, args.dictionary, args.alphabet, args.lengths,
+                                args.length_distribution, args.mutations).fingerprint()
+        except (OSError, ValueError):
+            words = None
+        if fingerprint is None or words != fingerprint:
+            print_warning(f"the words of the campaign in {args.campaign} changed since it started, it cannot be resumed")
+            return False
+        print_content(f"resuming the campaign in {args.campaign}")
+    else:
+        if args.source == "online":
+            print_warning("the words of the online source cannot be replayed, use another --source for campaigns")
+            return False
+        if args.campaign_seed is None:
+            args.campaign_seed = random.randrange(2**32)
+        # the local source changes with the cache of words, so the campaign keeps the words that it resolves to
+        if args.source == "local" or (args.source == "mutation" and args.dictionary is None):
+            args.dictionary = local_word_list()
+            if args.source == "local":
+                args.source = "offline" if args.dictionary is None else "dictionary"
+        if args.source not in ("dictionary", "mutation"):
+            args.dictionary = None
+        try:
+            if args.dictionary is not None:
+                args.dictionary = Campaign.snapshot(args.campaign, args.dictionary)
+            settings = {name: getattr(args, name) for name in CAMPAIGN_ARGS}
+            if args.dictionary is not None:
+                settings["dictionary"] = os.path.relpath(args.dictionary, args.campaign)
+            settings[FINGERPRINT] = make_source(args.source, args.dictionary, args.alphabet, args.lengths,
+                                                args.length_distribution, args.mutations).fingerprint()
+            Campaign.create(args.campaign, settings)
+        except FileExistsError:
+            print_warning(f"{args.campaign} already holds a campaign, continue it with --resume")
+            return False
+        except (OSError, ValueError) as error:
+            print_warning(f"cannot start the campaign: {error}")
+            return False
+    args.results = os.path.join(args.campaign, CAMPAIGN_RESULTS)
+    return True
+
 
 def run(args: argparse.Namespace) -> None:
     '''runs the search for bugs
@@ -31,46 +559,192 @@ def run(args: argparse.Namespace) -> None:
     4. saving the errors to a file
     args: the parsed arguments from the CLI
     '''
-    # setup word generator
-    wordgenerator = WordGenerator()
+    if args.join:
+        join(args)
+        return
+    if (args.campaign or args.resume) and not start_campaign(args):
+        return
+    if args.timings or args.timings_json:
+        stage_timer.enable()
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    # setup Z3 tester
-    z3_tester = Z3Tester(args.verbose, args.timeout)
+    binaries = get_binaries(args)
+    if args.backend == "api" and getattr(args, "z3", None):
+        # the bindings would be labeled as the binaries, and several of them would all be the same z3
+        if len(binaries) > 1:
+            print_warning("--backend api runs the z3 python bindings, it cannot compare several --z3 binaries")
+            return
+        print_warning("--backend api runs the z3 python bindings and ignores --z3")
+        args.z3 = None
+        binaries = get_binaries(args)
+    if len(binaries) > 1 and not args.differential:
+        print_warning("several --z3 binaries need --differential, only the first one is tested")
+    if args.differential:
+        if args.executor == "async":
+            print_warning("--differential runs on the thread executor instead of async")
+            args.executor = "thread"
+        if args.adaptive:
+            print_warning("--differential ignores --adaptive, every formula gets the full timeout")
+            args.adaptive = False
+    if args.serve and args.adaptive:
+        print_warning("--serve ignores --adaptive, every test gets the full timeout")
+        args.adaptive = False
+    if args.adaptive and args.runs == 0:
+        # the timeouts are only retried once all other tests are done, which never happens
+        print_warning("--adaptive needs a number of runs, it cannot run until stopped (-r 0)")
+        return
 
-    configs = [
-        ("sat", "seq"),
-        ("unsat", "seq"),
-        ("sat", "z3str3"),
-        ("unsat", "z3str3")]
+    # setup Z3 tester. With --differential it only logs, the differential tester does the sanity checks.
+    # A coordinator does not run Z3 at all, its workers check their own
+    z3_tester = Z3Tester(args.verbose, args.timeout, args.workers, args.worker_reset, args.backend, args.style,
+                         sanity_check=not args.differential and not args.serve, cache=args.cache, cache_refresh=args.refresh_cache,
+                         results=args.results or None, z3=binaries[0], deficit=args.deficit)
+    differential = None
+    configs = CONFIGS
+    # the number of results per work item
+    targets = 1
+    if args.differential:
+        configs = DIFFERENTIAL_CONFIGS
+        targets = len(binaries) * len(SOLVERS)
+    if args.differential and not args.serve:
+        differential = DifferentialTester(binaries, SOLVERS, args.verbose, args.timeout, args.workers,
+                                          args.worker_reset, args.backend, args.style, cache=args.cache,
+                                          cache_refresh=args.refresh_cache, slowdown=args.slowdown,
+                                          deficit=args.deficit)
 
-    threads = args.processes
+    # with --campaign, the completed work items are checkpointed and skipped on resume
+    campaign = None
+    runs = args.runs
+    if args.campaign:
+        campaign = Campaign(args.campaign, targets, args.checkpoint_interval)
+        if args.runs > 0:
+            runs = max(0, args.runs - campaign.completed_before())
+        print_content(f"{campaign.completed_before()} tests of the campaign completed before")
 
-    # define work for multiprocessing
-    words = wordgenerator.generate(number=args.runs * 2)
+    # with --adaptive, the first pass gets the short timeout and the tests that timed out are retried afterwards
+    scheduler = None
+    first_args = args
+    if args.adaptive:
+        if args.first_timeout >= args.timeout:
+            print_warning("--first-timeout is not shorter than --timeout, nothing to adapt")
+        else:
+            scheduler = TimeoutScheduler(args.first_timeout, args.timeout, args.hopeless_after)
+            first_args = argparse.Namespace(**vars(args))
+            first_args.timeout = args.first_timeout
 
-    work = []
-    for run_no in range(args.runs):
-        mode_config, solver_config = configs[run_no % len(configs)]
-        word1 = words[run_no * 2]
-        word2 = words[run_no * 2 + 1]
-        work.append((word1, word2, mode_config, solver_config, args.seed))
+    # with --guided, the outcome of every test ranks its word pair in the corpus
+    corpus = None
+    source = make_source(args.source, args.dictionary, args.alphabet, args.lengths,
+                         args.length_distribution, args.mutations)
+    if args.guided:
+        corpus = Corpus(args.corpus, args.corpus_size)
+        print_content(f"corpus of {len(corpus)} word pairs")
+        source = GuidedSource(source, corpus, args.explore, args.alphabet)
 
-    def worker(work_item):
-        # define worker function
-        word1, word2, mode_config, solver_config, seed = work_item
-        z3_tester.test(mode_config, solver_config, seed=seed)
+    # words are only generated once a worker is ready for them
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+        print_warning("stopping")
+        print_content("waiting for the running tests, press ctrl-c again to abort")
+
+    previous_handler = signal.signal(signal.SIGINT, request_stop)
+
+    # the campaign seed is reported, such that the words and formulas of the search can be replayed
+    if args.campaign_seed is None:
+        args.campaign_seed = random.randrange(2**32)
+    print_content(f"running {runs} times" if args.runs > 0 else "running until stopped")
+    print_content(f"campaign seed: {args.campaign_seed}")
+    fingerprint = source.fingerprint()
+    if fingerprint is None:
+        print_warning(f"the words of the {'guided' if args.guided else args.source} source cannot be replayed")
+    else:
+        print_content(f"word list: {fingerprint[:12]}")
+
+    work = generate_work(args, configs, source)
+    if campaign is not None:
+        work = campaign.track(work)
+
+    def handle_result(work_item, error, record, progress, escalated=False):
+        word1, word2, mode_config, solver_config, _ = work_item
         print_content(f"words: {word1:10}, {word2:10}, mode: {mode_config:5}, solver: {solver_config:7}")
+        z3_tester.log_result(error, record)
+        if corpus is not None:
+            corpus.add(record)
+        if scheduler is not None:
+            scheduler.record(work_item, record, escalated)
+        # timeouts of the first pass only count once they are not retried
+        retried = record.timed_out and not escalated and scheduler is not None and scheduler.escalate(work_item, record)
+        if record.timed_out and not retried:
+            z3_tester.log_timeout(record)
+        if campaign is not None and not retried:
+            # the results of a differential test carry the label of their target instead of the solver
+            campaign.complete(work_item[:3] + ("differential",) + work_item[4:] if args.differential else work_item, record)
+        progress()
 
-    print_content(f"running {args.runs} times")
+    if args.executor == "async" and (args.backend != "subprocess" or args.workers > 0 or args.batch > 1):
+        print_warning("async ignores --backend, --workers and --batch")
 
-    pool = ThreadPool(threads)
     # define progress bar function
-    with alive_progress.alive_bar(args.runs) as progress:
-        for _ in pool.imap_unordered(worker, work):
-            progress()
+    try:
+        with alive_progress.alive_bar(runs * targets or None) as progress:
+            if args.serve:
+                serve_pass(args, work, stop, partial(handle_result, progress=progress))
+            else:
+                run_pass(first_args, differential or z3_tester, work, stop, partial(handle_result, progress=progress),
+                         None if scheduler is None else scheduler.first_timeout_of)
+        if scheduler is not None and len(scheduler.escalations) > 0 and not stop.is_set():
+            print_title("retrying timeouts")
+            print_content(f"retrying {len(scheduler.escalations)} tests with a timeout of {args.timeout}s")
+            with alive_progress.alive_bar(len(scheduler.escalations)) as progress:
+                run_pass(args, z3_tester, scheduler.escalation_work(z3_tester.log_timeout), stop,
+                         partial(handle_result, progress=progress, escalated=True))
+    except KeyboardInterrupt:
+        print_warning("aborted")
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+    if scheduler is not None:
+        # the tests that were not retried because the search was stopped
+        for _, record in scheduler.escalations:
+            z3_tester.log_timeout(record)
+
+    z3_tester.close()
+    if differential is not None:
+        differential.close()
+    if campaign is not None:
+        campaign.close()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print_content(f"profile written to {args.profile}")
+    if stage_timer.enabled():
+        stage_timer.timings().print_report()
+        if args.timings_json:
+            stage_timer.timings().write_json(args.timings_json)
+            print_content(f"stage timings written to {args.timings_json}")
+    if scheduler is not None:
+        scheduler.print_report()
+    if corpus is not None:
+        corpus.save()
+        print_title("corpus")
+        print_content(f"{corpus.added} new word pairs, {len(corpus)} in the corpus at {args.corpus}")
+        for entry in corpus.best(5):
+            print_content(f"words: {entry.word1:10}, {entry.word2:10}, score: {entry.score:7.2f}, mutated: {entry.picks} times")
 
-    pool.close()
-    pool.join()
+    if campaign is not None:
+        stats = campaign.stats
+        print_title("campaign")
+        print_content(f"{stats['tests']} tests, {stats['mistakes']} mistakes, {stats['timeouts']} timeouts "
+                      f"and {stats['findings']} findings in {stats['elapsed']:.0f}s so far")
+        print_content(f"the results are in {args.results}, continue with --resume {args.campaign}")
 
     # print errors
     print_title("done")
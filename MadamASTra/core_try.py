@@ -8,8 +8,12 @@ This module tries to find such cases.
 
 import argparse
 from itertools import product
+from arguments import positive_int
 from c_printer import print_content, print_title
 from z3_tester import Z3Tester
+from z3_driver import BACKENDS
+from formula_generator import FORMULA_STYLES
+from result_cache import CACHE_PATH
 
 
 def add_parser(parser: argparse.ArgumentParser) -> None:
@@ -43,6 +47,38 @@ def add_parser(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--seed",
                         type=int,
                         help="the seed to use for the unsat mode")
+    parser.add_argument("--deficit",
+                        type=positive_int,
+                        default=1,
+                        help="how many operations less than the edit distance the unsat formulas use. default: 1")
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=0,
+                        help="number of persistent Z3 processes (or api worker processes) to use. default: 0 (spawn one Z3 per formula)")
+    parser.add_argument("--worker-reset",
+                        action="store_true",
+                        default=False,
+                        help="(reset) persistent Z3 processes between formulas instead of using (push)/(pop)")
+    parser.add_argument("--backend",
+                        choices=BACKENDS,
+                        default="subprocess",
+                        help="how Z3 is run: the z3 binary or the z3 python bindings. default: subprocess")
+    parser.add_argument("--style",
+                        choices=FORMULA_STYLES,
+                        default="nested",
+                        help="how the chain of operations is written in SMT. default: nested")
+    parser.add_argument("--cache",
+                        nargs="?",
+                        const=CACHE_PATH,
+                        metavar="PATH",
+                        help=f"reuse the results of formulas that Z3 already solved, stored at PATH. default PATH: {CACHE_PATH}")
+    parser.add_argument("--refresh-cache",
+                        action="store_true",
+                        default=False,
+                        help="run Z3 even for cached formulas and update the cache with the new results. implied by --retry")
+    parser.add_argument("--results",
+                        type=str,
+                        help="JSON lines file that the outcome of every try is appended to")
 
 
 def run(args: argparse.Namespace) -> None:
@@ -50,8 +86,10 @@ def run(args: argparse.Namespace) -> None:
     args: the parsed arguments from the CLI
     '''
 
-    # setup Z3 tester
-    z3_tester = Z3Tester(args.verbose, args.timeout)
+    # setup Z3 tester. retrying only makes sense if Z3 is actually run again
+    z3_tester = Z3Tester(args.verbose, args.timeout, args.workers, args.worker_reset, args.backend, args.style,
+                         cache=args.cache, cache_refresh=args.refresh_cache or args.retry,
+                         results=args.results, deficit=args.deficit)
 
     print_content(f"words: {args.word1}, {args.word2}")
 
@@ -94,5 +132,6 @@ def run(args: argparse.Namespace) -> None:
         for mode, solver in configs:
             z3_tester.test(args.word1, args.word2, mode, solver, seed=args.seed)
 
+    z3_tester.close()
     print_title("done")
     z3_tester.print_errors()
@@ -0,0 +1,187 @@
+'''
+Steers the search toward the word pairs that make Z3 slow or wrong.
+The corpus keeps the most interesting word pairs that were tested so far, ranked by a score:
+mistakes of Z3 score highest, then disagreements and slowdowns between solvers, timeouts and unknown answers,
+and otherwise the share of the timeout that Z3 needed.
+The guided source draws new pairs by mutating pairs of the corpus (character edits, growing a word,
+moving the words to another alphabet), preferring high scores and pairs that were not mutated often.
+The corpus is saved between runs, such that later searches resume from the best pairs.
+'''
+
+import json
+import os
+import random
+import string
+import threading
+from typing import NamedTuple
+from random_word import WordSource, mutate
+from result_log import TestRecord
+
+CORPUS_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "madamastra", "corpus.json")
+# the alphabets that pairs are moved to. Quotes and backslashes are left out, they would need escaping in SMT
+ALPHABETS = [string.ascii_lowercase, string.ascii_uppercase, string.digits, "ab"]
+MUTATIONS = ["edit", "grow", "alphabet"]
+# grown words are not grown beyond this length
+MAX_LENGTH = 256
+
+
+class CorpusEntry(NamedTuple):
+    '''
+    a word pair of the corpus
+    score: how interesting the tests of the pair were, the best of its tests
+    picks: how often the pair was mutated
+    '''
+    word1: str
+    word2: str
+    score: float
+    picks: int = 0
+
+
+def score(record: TestRecord) -> float:
+    '''
+    returns how interesting a test was. 0 for a test that Z3 solved right away
+    '''
+    if record.mistake:
+        return 100.0
+    if record.finding == "disagreement":
+        return 20.0
+    if record.finding == "slowdown" or record.timed_out:
+        return 10.0
+    if record.verdict != record.expected:
+        # unknown or an error
+        return 5.0
+    return 10.0 * record.wall_time / record.timeout if record.timeout > 0 else record.wall_time
+
+
+class Corpus():
+    '''
+    The size best word pairs, stored as JSON at path.
+    Can be shared between threads: the search adds the outcome of tests while the source draws from it
+    '''
+
+    def __init__(self, path: str = CORPUS_PATH, size: int = 1000) -> None:
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.added = 0
+        if os.path.isfile(path):
+            with open(path, "r", encoding='utf-8') as f:
+                for entry in json.load(f):
+                    entry = CorpusEntry(**entry)
+                    self.entries[(entry.word1, entry.word2)] = entry
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, record: TestRecord) -> None:
+        '''
+        ranks the word pair of record by the outcome of its test. The worst pairs are dropped once the corpus is full
+        '''
+        value = score(record)
+        if value <= 0:
+            return
+        key = (record.word1, record.word2)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = CorpusEntry(record.word1, record.word2, value)
+                self.added += 1
+            elif value > entry.score:
+                self.entries[key] = entry._replace(score=value)
+            # evictions are batched, to keep them off the path of every test
+            if len(self.entries) > 2 * self.size:
+                self.__evict()
+
+    def choose(self, rng: random.Random) -> CorpusEntry | None:
+        '''
+        returns an entry to mutate, weighted by its score and fading with the number of times it was chosen
+        '''
+        with self.lock:
+            if len(self.entries) == 0:
+                return None
+            entries = list(self.entries.values())
+            entry = rng.choices(entries, weights=[entry.score / (1 + entry.picks) for entry in entries])[0]
+            self.entries[(entry.word1, entry.word2)] = entry._replace(picks=entry.picks + 1)
+            return entry
+
+    def best(self, number: int) -> list[CorpusEntry]:
+        '''
+        returns the number entries with the highest scores
+        '''
+        with self.lock:
+            return sorted(self.entries.values(), key=lambda entry: entry.score, reverse=True)[:number]
+
+    def save(self) -> None:
+        '''
+        writes the corpus to its path. The file is replaced at once, so a crash leaves the previous corpus intact
+        '''
+        with self.lock:
+            self.__evict()
+            entries = [entry._asdict() for entry in self.entries.values()]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def __evict(self) -> None:
+        if len(self.entries) > self.size:
+            kept = sorted(self.entries.values(), key=lambda entry: entry.score, reverse=True)[:self.size]
+            self.entries = {(entry.word1, entry.word2): entry for entry in kept}
+
+
+def grow(word: str, rng: random.Random, alphabet: str = string.ascii_lowercase) -> str:
+    '''
+    inserts a copy of a slice of word (or a random character if it is empty) at a random position
+    '''
+    if len(word) == 0:
+        return rng.choice(alphabet)
+    start = rng.randrange(len(word))
+    piece = word[start:rng.randint(start + 1, len(word))]
+    position = rng.randint(0, len(word))
+    return (word[:position] + piece + word[position:])[:MAX_LENGTH]
+
+
+def translate(word1: str, word2: str, rng: random.Random) -> tuple[str, str]:
+    '''
+    moves both words to a random alphabet. Every character is mapped to the same character in both words,
+    so characters that were equal stay equal (unless the alphabet is smaller)
+    '''
+    alphabet = rng.choice(ALPHABETS)
+    mapping = {char: rng.choice(alphabet) for char in sorted(set(word1 + word2))}
+    return "".join(mapping[char] for char in word1), "".join(mapping[char] for char in word2)
+
+
+class GuidedSource(WordSource):
+    '''
+    Draws pairs by mutating the pairs of the corpus.
+    explore: share of the pairs that are drawn from the base source instead, such that new regions are found
+    '''
+
+    def __init__(self, base: WordSource, corpus: Corpus, explore: float = 0.2,
+                 alphabet: str = string.ascii_lowercase) -> None:
+        self.base = base
+        self.corpus = corpus
+        self.explore = explore
+        self.alphabet = alphabet
+
+    def word(self, rng: random.Random) -> str:
+        return self.base.word(rng)
+
+    def pair(self, rng: random.Random) -> tuple[str, str]:
+        entry = None if rng.random() < self.explore else self.corpus.choose(rng)
+        if entry is None:
+            return self.base.pair(rng)
+        word1, word2 = entry.word1, entry.word2
+        mutation = rng.choice(MUTATIONS)
+        if mutation == "alphabet":
+            return translate(word1, word2, rng)
+        # only one of the words is changed, the other one keeps what made the pair interesting
+        if rng.random() < 0.5:
+            return self.__mutate(word1, mutation, rng), word2
+        return word1, self.__mutate(word2, mutation, rng)
+
+    def __mutate(self, word: str, mutation: str, rng: random.Random) -> str:
+        if mutation == "grow":
+            return grow(word, rng, self.alphabet)
+        return mutate(word, rng.randint(1, 3), rng, self.alphabet)
@@ -0,0 +1,135 @@
+"""
+This module tests Z3 against itself. Every formula is generated once and tried on every target,
+a combination of a z3 binary and a string solver, in parallel.
+Since the verdict of every formula is known, a target that answers wrong is a mistake like in any other test.
+On top of that, the targets are compared with each other:
+- disagreement: a target does not find the verdict (e.g. answers unknown) that another target found
+- slowdown: a target takes at least slowdown times as long as the fastest target that found the verdict
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from c_printer import print_warning
+from formula_generator import wrap_preamble
+from result_cache import SmtHash
+from result_log import TestRecord
+from stage_timer import labels, record_duration, stage
+from sanity_check import run_sanity_checks
+from z3_tester import SOLVERS, Z3Tester
+# slowdowns of tests that took less than this [seconds] are mostly noise, so they are not flagged
+SLOWDOWN_FLOOR = 0.1
+
+
+class DifferentialTester(object):
+    '''
+    Given two words, this class generates a SMT formula for them once and tries it on every target.
+    binaries: the z3 binaries to compare, e.g. two versions of Z3
+    solvers: the string solvers to compare
+    slowdown: how many times slower than the fastest target a target must be to be flagged
+    The other arguments are like for Z3Tester
+    raises: ValueError if several binaries are compared with the api backend, which runs the z3 bindings instead
+    '''
+    def __init__(self, binaries: list[str], solvers: list[str] = None, verbose=False, timeout=5, workers=0,
+                 worker_reset=False, backend="subprocess", formula_style="nested", sanity_check=True,
+                 cache=None, cache_refresh=False, slowdown=100, deficit=1) -> None:
+        if backend == "api" and len(binaries) > 1:
+            raise ValueError("the api backend runs the z3 bindings, it cannot compare several z3 binaries")
+        self.testers = [Z3Tester(verbose, timeout, workers, worker_reset, backend, formula_style, False,
+                                 cache, cache_refresh, z3=binary, deficit=deficit) for binary in binaries]
+        self.targets = [(tester, solver) for tester in self.testers for solver in (solvers or SOLVERS)]
+        if sanity_check:
+            # the checks of all binaries and solvers run at the same time
+            run_sanity_checks([(tester.z3_driver, tester.z3, solver) for tester, solver in self.targets])
+        self.slowdown = slowdown
+        # the targets of a formula run at the same time, they mostly wait for Z3
+        self.executor = ThreadPoolExecutor(len(self.targets))
+
+    def label(self, tester: Z3Tester, solver_config: str) -> str:
+        '''
+        returns the name of a target. With a single binary, the targets are named after their solver
+        '''
+        return solver_config if len(self.testers) == 1 else f"{tester.z3}:{solver_config}"
+
+    def check(self, word1, word2, mode_config="sat", seed=None) -> list[tuple]:
+        '''
+        computes a SMT formula for word1 and word2 and tries it on every target. Does not log anything.
+        returns: for every target, its work item (named after the target), the entry for error_log
+        if the target made a mistake or a finding (None otherwise) and the record of the test
+        '''
+        first_tester, first_solver = self.targets[0]
+        # the query does not depend on the solver, only the preamble does
+        with labels("differential", mode_config):
+            query, _, seed = first_tester.prepare(word1, word2, mode_config, first_solver, seed)
+        # so it is joined once for all targets, and hashed after the preamble of each of them on its way into Z3
+        smt_hashes = [SmtHash.after(wrap_preamble(solver_config)) for _, solver_config in self.targets]
+        futures = [self.executor.submit(tester.z3_driver.solve, query, wrap_preamble(solver_config), None, smt_hash)
+                   for (tester, solver_config), smt_hash in zip(self.targets, smt_hashes)]
+
+        outcomes = []
+        for (tester, solver_config), future, smt_hash in zip(self.targets, futures, smt_hashes):
+            z3_result, wall_time = future.result()
+            record_duration("z3", wall_time, solver_config, mode_config)
+            with labels(solver_config, mode_config), stage("check"):
+                error = tester.evaluate(z3_result.output, word1, word2, mode_config, solver_config, seed)
+                record = tester.record(z3_result, wall_time, smt_hash.hexdigest(), word1, word2, mode_config,
+                                       solver_config, seed)
+            outcomes.append(((word1, word2, mode_config, self.label(tester, solver_config), seed), error, record))
+        return self.compare(outcomes)
+
+    def check_batch(self, work_items: list[tuple]) -> list[tuple]:
+        '''
+        like check, but for a list of (word1, word2, mode_config, solver_config, seed) tuples.
+        The solver_config of the work items is ignored, every formula is tried on every target
+        '''
+        checked = []
+        for word1, word2, mode_config, _, seed in work_items:
+            checked += self.check(word1, word2, mode_config, seed)
+        return checked
+
+    def compare(self, outcomes: list[tuple]) -> list[tuple]:
+        '''
+        flags the disagreements and slowdowns between the outcomes of the targets for the same formula
+        '''
+        solved = [record.wall_time for _, _, record in outcomes if record.verdict == record.expected]
+        if len(solved) == 0:
+            return outcomes
+        fastest = min(solved)
+        compared = []
+        for work_item, error, record in outcomes:
+            finding = self.finding(record, fastest)
+            if finding:
+                print_warning(f"{finding} of {work_item[3]}")
+                record = record._replace(finding=finding)
+                if error is None:
+                    error = work_item[:2] + ("solver: " + work_item[3], "mode: " + record.mode, "seed: " + str(record.seed),
+                                             f"{finding}: {record.verdict or 'error'} after {record.wall_time:.3f}s, "
+                                             f"others found {record.expected} after {fastest:.3f}s")
+            compared.append((work_item, error, record))
+        return compared
+
+    def finding(self, record: TestRecord, fastest: float) -> str:
+        '''
+        returns what is wrong with record, given the time [seconds] of the fastest target that found the verdict
+        '''
+        if record.mistake:
+            return ""
+        if (record.verdict == record.expected or record.timed_out) \
+                and record.wall_time >= SLOWDOWN_FLOOR and record.wall_time >= self.slowdown * fastest:
+            return "slowdown"
+        if record.verdict != record.expected and not record.timed_out:
+            return "disagreement"
+        return ""
+
+    def set_timeout(self, value: int) -> None:
+        '''
+        sets the timeout [seconds] of the following tests
+        '''
+        for tester in self.testers:
+            tester.set_timeout(value)
+
+    def close(self) -> None:
+        '''
+        stops the Z3 processes of every target
+        '''
+        self.executor.shutdown()
+        for tester in self.testers:
+            tester.close()
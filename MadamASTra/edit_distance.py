@@ -0,0 +1,230 @@
+'''
+Edit distance engines.
+The edit distance between two words is the heart of every generated formula, so for long words
+(thousands of characters) the way it is computed decides how fast MadamASTra can generate formulas.
+- distances: Myers' bit-parallel algorithm, an Ukkonen band if a bound is known,
+  and a row-vectorized NumPy DP (a pure python DP is used if NumPy is not installed)
+- edit scripts: Hirschberg's linear-space divide and conquer,
+  with a full table of back-pointers for the small subproblems
+'''
+
+from typing import List, NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the python DP is used instead
+    np = None
+
+# Operations of an edit script. MATCH is only used inside the DP table.
+MATCH, INSERT, REMOVE, REPLACE = 0, 1, 2, 3
+
+
+class EditOp(NamedTuple):
+    '''
+    One operation of an edit script.
+    kind: INSERT, REMOVE or REPLACE
+    char: the inserted or replacing character ("" for REMOVE)
+    index: the position in the string the operation is applied to (after all previous operations)
+    '''
+    kind: int
+    char: str
+    index: int
+
+
+ENGINES = ["auto", "python", "numpy", "myers"]
+
+# Up to this many DP cells (one byte each) an edit script is computed from the full table
+TABLE_CELLS = 4096
+
+
+def compute_edit_distance(s1: str, s2: str, engine: str = "auto", bound: int = None) -> int:
+    '''
+    Computes the minimum edit distance to transform s1 into s2.
+    engine: python, numpy or myers. auto uses myers, which is the fastest
+    bound: if given, only the band of the DP table within the bound is computed (Ukkonen)
+    and bound + 1 is returned if the distance is larger than the bound
+    '''
+    if bound is not None:
+        return banded_edit_distance(s1, s2, bound)
+    if engine in ("auto", "myers"):
+        return myers_edit_distance(s1, s2)
+    if engine == "numpy":
+        return int(last_row(s1, s2, use_numpy=True)[-1])
+    if engine == "python":
+        return last_row(s1, s2, use_numpy=False)[-1]
+    raise ValueError(f"Invalid edit distance engine. Only {', '.join(ENGINES)} are supported.")
+
+
+def compute_edit_script(s1: str, s2: str) -> List[EditOp]:
+    '''
+    Computes a minimal edit script that transforms s1 into s2.
+    The script does not depend on whether NumPy is installed, only the speed does
+    '''
+    return hirschberg_edit_script(s1, s2)
+
+
+def myers_edit_distance(s1: str, s2: str) -> int:
+    '''
+    Myers' bit-parallel edit distance (in Hyyrö's formulation for the global distance).
+    Every column of the DP table is encoded as the bit vectors of its +1/-1 vertical deltas,
+    python integers serve as arbitrarily long bit vectors.
+    '''
+    if len(s1) == 0:
+        return len(s2)
+    mask = (1 << len(s1)) - 1
+    high_bit = 1 << (len(s1) - 1)
+    peq = {}
+    for i, char in enumerate(s1):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    positive, negative, score = mask, 0, len(s1)
+    for char in s2:
+        eq = peq.get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | (~(xh | positive) & mask)
+        horizontal_negative = positive & xh
+        if horizontal_positive & high_bit:
+            score += 1
+        elif horizontal_negative & high_bit:
+            score -= 1
+        # the first row of the table increases by one per character of s2
+        horizontal_positive = ((horizontal_positive << 1) | 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive = horizontal_negative | (~(xv | horizontal_positive) & mask)
+        negative = horizontal_positive & xv
+    return score
+
+
+def banded_edit_distance(s1: str, s2: str, bound: int) -> int:
+    '''
+    Ukkonen's banded DP: only cells within bound of the diagonal can be part of a path
+    that costs at most bound. Returns bound + 1 if the distance is larger than bound.
+    '''
+    if abs(len(s1) - len(s2)) > bound:
+        return bound + 1
+    out_of_band = bound + 1
+    previous = [i if i <= bound else out_of_band for i in range(len(s1) + 1)]
+    for j in range(1, len(s2) + 1):
+        low, high = max(1, j - bound), min(len(s1), j + bound)
+        current = [out_of_band] * (len(s1) + 1)
+        current[0] = j if j <= bound else out_of_band
+        for i in range(low, high + 1):
+            if s1[i - 1] == s2[j - 1]:
+                current[i] = previous[i - 1]
+            else:
+                current[i] = min(current[i - 1], previous[i], previous[i - 1]) + 1
+        previous = current
+    return min(previous[len(s1)], out_of_band)
+
+
+def last_row(s1: str, s2: str, use_numpy: bool = True) -> list:
+    '''
+    Computes the last row of the DP table, i.e. the edit distances from every prefix of s1 to s2,
+    while only keeping two rows in memory. Vectorized with NumPy if it is available.
+    '''
+    if use_numpy and np is not None:
+        return _numpy_last_row(s1, s2)
+    previous = list(range(len(s1) + 1))
+    for j in range(1, len(s2) + 1):
+        current = [j] + [0] * len(s1)
+        for i in range(1, len(s1) + 1):
+            if s1[i - 1] == s2[j - 1]:
+                current[i] = previous[i - 1]
+            else:
+                current[i] = min(current[i - 1], previous[i], previous[i - 1]) + 1
+        previous = current
+    return previous
+
+
+def _numpy_last_row(s1: str, s2: str):
+    # The left neighbour dependency current[i] = current[i - 1] + 1 is resolved with a running minimum:
+    # current[i] - i = min over k <= i of (candidate[k] - k)
+    codes = np.fromiter((ord(char) for char in s1), dtype=np.int64, count=len(s1))
+    offsets = np.arange(len(s1) + 1, dtype=np.int64)
+    previous = offsets.copy()
+    current = np.empty_like(previous)
+    for j, char in enumerate(s2, start=1):
+        current[0] = j
+        np.minimum(previous[1:] + 1, previous[:-1] + (codes != ord(char)), out=current[1:])
+        current -= offsets
+        np.minimum.accumulate(current, out=current)
+        current += offsets
+        previous, current = current, previous
+    return previous
+
+
+def hirschberg_edit_script(s1: str, s2: str, table_cells: int = TABLE_CELLS) -> List[EditOp]:
+    '''
+    Hirschberg's algorithm: splits s2 in half, finds the column where a minimal path crosses the middle row
+    with one forward and one backward pass, and recurses on both halves.
+    Needs memory linear in the word lengths, no DP cell is kept beyond its row.
+    table_cells: subproblems up to this many DP cells are solved with the full table
+    '''
+    if len(s2) <= 1 or (len(s1) + 1) * (len(s2) + 1) <= table_cells:
+        return table_edit_script(s1, s2)
+    middle = len(s2) // 2
+    forward = last_row(s1, s2[:middle])
+    backward = last_row(s1[::-1], s2[middle:][::-1])
+    split = min(range(len(s1) + 1), key=lambda i: forward[i] + backward[len(s1) - i])
+    # after the left half was applied, the string starts with s2[:middle]
+    # so the operations of the right half are shifted by middle
+    script = hirschberg_edit_script(s1[:split], s2[:middle], table_cells)
+    for op in hirschberg_edit_script(s1[split:], s2[middle:], table_cells):
+        script.append(EditOp(op.kind, op.char, op.index + middle))
+    return script
+
+
+# Computes a minimal edit script that transforms s1 into s2 from the full DP table.
+# The DP only keeps two rows of distances and one back-pointer (the chosen operation) per cell,
+# the operations are then reconstructed along a single backtrace path.
+def table_edit_script(s1: str, s2: str) -> List[EditOp]:
+    ops = [bytearray([REMOVE]) * (len(s1) + 1)]
+    ops[0][0] = MATCH
+    previous = list(range(len(s1) + 1))
+    for j in range(1, len(s2) + 1):
+        current = [j] + [0] * len(s1)
+        row = bytearray(len(s1) + 1)
+        row[0] = INSERT
+        for i in range(1, len(s1) + 1):
+            if s1[i - 1] == s2[j - 1]:  # do nothing
+                current[i] = previous[i - 1]
+                row[i] = MATCH
+            else:
+                min_dist = min(current[i - 1], previous[i], previous[i - 1])
+                current[i] = min_dist + 1
+                if min_dist == previous[i]:
+                    row[i] = INSERT
+                elif min_dist == current[i - 1]:
+                    row[i] = REMOVE
+                else:
+                    row[i] = REPLACE
+        ops.append(row)
+        previous = current
+
+    # Backtrace from the last cell, recording the position in s1 of every operation
+    path = []
+    i, j = len(s1), len(s2)
+    while i > 0 or j > 0:
+        op = ops[j][i]
+        if op == MATCH:
+            i, j = i - 1, j - 1
+        elif op == INSERT:
+            path.append((INSERT, s2[j - 1], i))
+            j -= 1
+        elif op == REMOVE:
+            path.append((REMOVE, "", i - 1))
+            i -= 1
+        else:
+            path.append((REPLACE, s2[j - 1], i - 1))
+            i, j = i - 1, j - 1
+
+    # Positions in s1 are shifted by the inserts and removes that happened before
+    script, shift = [], 0
+    for kind, char, position in reversed(path):
+        script.append(EditOp(kind, char, position + shift))
+        if kind == INSERT:
+            shift += 1
+        elif kind == REMOVE:
+            shift -= 1
+    return script
@@ -0,0 +1,35 @@
+"""
+This script is a stand-in for the z3 binary, used to benchmark the overhead of MadamASTra without solving anything.
+It speaks just enough of the protocol of `z3 -in`: every (check-sat) is answered with unknown,
+every (echo "...") is echoed and everything else is ignored. Lines are answered as soon as they are read,
+such that it also works as a persistent process.
+FAKE_Z3_DELAY: the time [seconds] that every (check-sat) takes. default: 0
+"""
+
+import os
+import re
+import sys
+import time
+
+ECHO = re.compile(r'\(echo "(.*)"\)')
+
+
+def main() -> None:
+    '''answers the SMT script on stdin'''
+    if "--version" in sys.argv:
+        print("Z3 version 0.0.0 - fake")
+        return
+    delay = float(os.environ.get("FAKE_Z3_DELAY", "0"))
+    for line in sys.stdin:
+        if "(check-sat)" in line:
+            if delay > 0:
+                time.sleep(delay)
+            sys.stdout.write("unknown\n")
+            sys.stdout.flush()
+        for echo in ECHO.findall(line):
+            sys.stdout.write(echo + "\n")
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
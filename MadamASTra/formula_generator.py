@@ -2,9 +2,12 @@ import random
 import re
 import os
 import sys
-from typing import Tuple
-# Bookkeeping over multiple calls of compute_edit_distance:
-n_int_consts, n_str_consts, consts_to_vals = 0, 0, {}
+from functools import lru_cache
+from itertools import chain
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+from edit_distance import INSERT, REMOVE, compute_edit_distance, compute_edit_script
+from smt_writer import SmtWriter, encoded
+from stage_timer import stage
 
 insert_in_smt = "(define-fun insert ((to_insert String) (index Int) (source String)) String\
                     (ite\
@@ -38,7 +41,12 @@ replace_in_smt = "(define-fun replace ((to_insert String) (index Int) (source St
 
 # You can also debug via (simplify (replace r 2 (replace a 1 (replace b 0 "foo"))))
 
-def get_formula_for_checking_operator_definitions():
+def get_formula_for_checking_operator_definitions(string_solver: str = "seq"):
+    return wrap_preamble(string_solver) + get_query_for_checking_operator_definitions()
+
+
+# The asserts of the sanity check, which hold for the definitions of insert, remove and replace, so the query is SAT
+def get_query_for_checking_operator_definitions():
     formulas = [
         "(assert (= (insert \"a\" 0 \"\") \"a\"))",
         "(assert (= (insert \"a\" 1 \"\") \"\"))",
@@ -77,11 +85,11 @@ def get_formula_for_checking_operator_definitions():
         "(assert (= (replace \"b\" 1 \"foo\") \"fbo\"))",
         "(assert (= (replace \"b\" 2 \"foo\") \"fob\"))"
     ]
-    full_input = wrap_formula("\n".join(formulas))
-    return full_input
+    return wrap_query("\n".join(formulas))
 
 
 # Basic DP algorithm that computes the minimum edit distance to transform s1 into s2
+# (the reference for the faster engines in edit_distance)
 def just_compute_edit_distance(s1: str, s2: str) -> int:
     dp = [[0 for x in range(len(s1) + 1)] for x in range(len(s2) + 1)]
 
@@ -102,72 +110,134 @@ def just_compute_edit_distance(s1: str, s2: str) -> int:
 
     return dp[len(s2)][len(s1)]
 
-# Basic DP algorithm that computes the minimum edit distance to transform s1 into s2,
-# while building a corresponding SMT-formula on the go.
-def compute_edit_distance_and_generate_formula(s1: str, s2: str) -> str:
-    global n_int_consts, n_str_consts, consts_to_vals
-    # Replaces constant values (e.g. 0, "a") in the formula with unique variables (e.g. int_const_0, str_const_0),
-    # stores this information in consts_to_vals.
+# The ways a chain of operations can be written down in SMT:
+# nested: (assert (= (replace .. (insert .. "foo")) "bar")), nests as deep as the edit distance
+# let:    (assert (let ((step_0 (insert .. "foo"))) (let ((step_1 (replace .. step_0))) (= step_1 "bar"))))
+# steps:  one (declare-const step_i String) and (assert (= step_i (replace .. step_i-1))) per operation
+FORMULA_STYLES = ["nested", "let", "steps"]
 
-    dp = [[0 for x in range(len(s1) + 1)] for x in range(len(s2) + 1)]
-    formulas = [["" for x in range(len(s1) + 1)] for x in range(len(s2) + 1)]
-    n_removals = [[0 for x in range(len(s1) + 1)] for x in range(len(s2) + 1)]  # needed for computing indeces
-    n_insertions = [[0 for x in range(len(s1) + 1)] for x in range(len(s2) + 1)]  # needed for computing indeces
 
-    # Initialization:
-    formulas[0][0] = "\"" + s1 + "\""
-    for i in range(len(s1) + 1):
-        dp[0][i] = i
-        if i > 0:
-            formulas[0][i] = "(remove int_const_" + str(n_int_consts) + " " + formulas[0][i - 1] + ")"
-            consts_to_vals["int_const_" + str(n_int_consts)] = "0"
-            n_int_consts += 1
-            n_removals[0][i] = n_removals[0][i - 1] + 1
-    for j in range(len(s2) + 1):
-        dp[j][0] = j
-        if j > 0:
-            formulas[j][0] = "(insert str_const_" + str(n_str_consts) + " int_const_" + str(n_str_consts) + " " + formulas[j - 1][0] + ")"
-            consts_to_vals["str_const_" + str(n_str_consts)] = s2[j - 1]
-            n_str_consts += 1
-            consts_to_vals["int_const_" + str(n_int_consts)] = str(j - 1)
-            n_int_consts += 1
-            n_insertions[j][0] = n_insertions[j - 1][0] + 1
+# Chains the operations given by prefixes (e.g. "(remove int_const_0 ") onto s1 and asserts that the result is s2.
+# The operations are applied in the order of the list, the formula is written in the given style.
+def chain_operations(s1: str, s2: str, prefixes: List[str], style: str = "nested") -> str:
+    return "".join(iter_chain_operations(s1, s2, prefixes, style))
 
-    # Recursion:
-    for i in range(1, len(s1) + 1):
-        for j in range(1, len(s2) + 1):
-            if s1[i - 1] == s2[j - 1]:  # do nothing
-                dp[j][i] = dp[j - 1][i - 1]
-                formulas[j][i] = formulas[j - 1][i - 1]
-                n_removals[j][i] = n_removals[j - 1][i - 1]
-                n_insertions[j][i] = n_insertions[j - 1][i - 1]
-            else:
-                min_dist = min([dp[j][i - 1], dp[j - 1][i], dp[j - 1][i - 1]])
-                dp[j][i] = min_dist + 1
-                if min_dist == dp[j - 1][i]:  # insert
-                    formulas[j][i] = "(insert str_const_" + str(n_str_consts) + " int_const_" + str(n_int_consts) + " " + formulas[j - 1][i] + ")"
-                    consts_to_vals["str_const_" + str(n_str_consts)] = s2[j - 1]
-                    n_str_consts += 1
-                    consts_to_vals["int_const_" + str(n_int_consts)] = str(i - n_removals[j - 1][i] + n_insertions[j - 1][i])
-                    n_int_consts += 1
-                    n_removals[j][i] = n_removals[j - 1][i]
-                    n_insertions[j][i] = n_insertions[j - 1][i] + 1
-                elif min_dist == dp[j][i - 1]:  # remove
-                    formulas[j][i] = "(remove int_const_" + str(n_int_consts) + " " + formulas[j][i - 1] + ")"
-                    consts_to_vals["int_const_" + str(n_int_consts)] = str(i - n_removals[j][i - 1] + n_insertions[j][i - 1] - 1)
-                    n_int_consts += 1
-                    n_removals[j][i] = n_removals[j][i - 1] + 1
-                    n_insertions[j][i] = n_insertions[j][i - 1]
-                else:  # replace
-                    formulas[j][i] = "(replace str_const_" + str(n_str_consts) + " int_const_" + str(n_int_consts) + " " + formulas[j - 1][i - 1] + ")"
-                    consts_to_vals["str_const_" + str(n_str_consts)] = s2[j - 1]
-                    n_str_consts += 1
-                    consts_to_vals["int_const_" + str(n_int_consts)] = str(i - n_removals[j - 1][i] + n_insertions[j - 1][i])
-                    n_int_consts += 1
-                    n_removals[j][i] = n_removals[j - 1][i - 1]
-                    n_insertions[j][i] = n_insertions[j - 1][i - 1]
-
-    return "(assert (= " + formulas[len(s2)][len(s1)] + " \"" + s2 + "\"))"
+
+# Like chain_operations, but yields the formula in small pieces instead of building it as a whole
+def iter_chain_operations(s1: str, s2: str, prefixes: List[str], style: str = "nested") -> Iterator[str]:
+    if style not in FORMULA_STYLES:
+        raise ValueError(f"Invalid formula style. Only {', '.join(FORMULA_STYLES)} are supported.")
+    return _chain_pieces(s1, s2, prefixes, style)
+
+
+def _chain_pieces(s1: str, s2: str, prefixes: List[str], style: str) -> Iterator[str]:
+    source, target = "\"" + s1 + "\"", "\"" + s2 + "\""
+    if style == "nested" or len(prefixes) == 0:
+        yield "(assert (= "
+        yield from reversed(prefixes)
+        yield source
+        yield ")" * len(prefixes) + " " + target + "))"
+    elif style == "let":
+        yield "(assert "
+        for n, prefix in enumerate(prefixes):
+            yield "(let ((step_" + str(n) + " " + prefix + source + "))) "
+            source = "step_" + str(n)
+        yield "(= " + source + " " + target + ")" + ")" * len(prefixes) + ")"
+    else:
+        for n, prefix in enumerate(prefixes):
+            yield "(declare-const step_" + str(n) + " String)\n"
+            yield "(assert (= step_" + str(n) + " " + prefix + source + ")))\n"
+            source = "step_" + str(n)
+        yield "(assert (= " + source + " " + target + "))"
+
+
+CONST_PATTERN = re.compile(r"(int|str)_const_\d+")
+
+
+class FormulaBuilder():
+    '''
+    Bookkeeping of the constants of a single formula.
+    Replaces constant values (e.g. 0, "a") in the formula with unique variables (e.g. int_const_0, str_const_0)
+    and stores this information in consts_to_vals.
+    Every formula gets its own builder, so builders can be used from any number of threads or processes.
+    '''
+
+    def __init__(self) -> None:
+        self.int_consts = []
+        self.str_consts = []
+        self.consts_to_vals = {}
+
+    def int_const(self, value: int) -> str:
+        '''
+        Returns a fresh integer constant that stands for value
+        '''
+        const = "int_const_" + str(len(self.int_consts))
+        self.consts_to_vals[const] = str(value)
+        self.int_consts.append(const)
+        return const
+
+    def str_const(self, value: str) -> str:
+        '''
+        Returns a fresh string constant that stands for value
+        '''
+        const = "str_const_" + str(len(self.str_consts))
+        self.consts_to_vals[const] = value
+        self.str_consts.append(const)
+        return const
+
+    def declarations(self) -> str:
+        '''
+        Returns the declarations of all constants, string constants are constrained to length 1
+        '''
+        return "".join(self.iter_declarations())
+
+    def iter_declarations(self) -> Iterator[str]:
+        '''
+        Yields the declarations of all constants line by line
+        '''
+        for const in self.str_consts:
+            yield "(declare-const " + const + " String)\n"
+            yield "(assert (= (str.len " + const + ") 1))\n"  # enforce that the string has length 1
+        for const in self.int_consts:
+            yield "(declare-const " + const + " Int)\n"
+
+    def substitute(self, z3_expression: str) -> str:
+        '''
+        Replaces all constants in z3_expression with their values in a single pass.
+        Only whole names are replaced, int_const_1 must not match the prefix of int_const_12
+        '''
+        return CONST_PATTERN.sub(self.__value, z3_expression)
+
+    def __value(self, match: re.Match) -> str:
+        value = self.consts_to_vals[match.group(0)]
+        if match.group(1) == "str":
+            return "\"" + value + "\""  # surround string with " "
+        return value
+
+
+# Computes the minimum edit distance to transform s1 into s2 and builds the corresponding SMT-formula
+# from the operations along the backtrace path. The constants are registered in builder.
+def compute_edit_distance_and_generate_formula(s1: str, s2: str, style: str = "nested", builder: FormulaBuilder = None) -> str:
+    if builder is None:
+        builder = FormulaBuilder()
+    return chain_operations(s1, s2, edit_prefixes(s1, s2, builder), style)
+
+
+# Returns the prefixes of the operations along the backtrace path of the minimum edit distance to transform s1 into s2.
+# The constants are registered in builder.
+def edit_prefixes(s1: str, s2: str, builder: FormulaBuilder) -> List[str]:
+    with stage("formula.distance"):
+        script = compute_edit_script(s1, s2)
+    prefixes = []
+    for op in script:
+        int_const = builder.int_const(op.index)
+        if op.kind == REMOVE:
+            prefixes.append("(remove " + int_const + " ")
+            continue
+        str_const = builder.str_const(op.char)
+        name = "insert" if op.kind == INSERT else "replace"
+        prefixes.append("(" + name + " " + str_const + " " + int_const + " ")
+    return prefixes
 
 # Returns SMT formulas using insert, remove and replace to get from s1 to s2.
 # generated_z3_formula is of the form "(assert (= (replace str_const_13 int_const_24 (replace str_const_11 int_const_20 (replace str_const_8 int_const_16 "foo"))) "bar"))"
@@ -176,59 +246,104 @@ def compute_edit_distance_and_generate_formula(s1: str, s2: str) -> str:
 # reference_z3_formula is of the form "(assert (= (replace r 2 (replace a 1 (replace b 0 "foo"))) "bar"))"
 # -> it is intended to check the correctness of the series of inserts/removes/replacements that we computed
 # Both formulas are SAT by construction.
-def get_sat_z3_formulas(s1: str, s2: str):
+def get_sat_z3_formulas(s1: str, s2: str, style: str = "nested"):
     #       in generated_z3_formula with their corresponding values from consts_to_vals,
     #       because otherwise Z3 may take veeeery long and eventually return unknown.
     #       => How much of our rewriting do we have to "expose" for Z3 to succeed?
-    z3_expression = compute_edit_distance_and_generate_formula(s1, s2)
-    generated_z3_formula = z3_expression
-    reference_z3_formula = z3_expression
-    for const in re.findall("int_const_\d*", z3_expression):
-        generated_z3_formula = "(declare-const " + const + " Int)\n" + generated_z3_formula
-        reference_z3_formula = reference_z3_formula.replace(const, consts_to_vals[const])
-    for const in re.findall("str_const_\d*", z3_expression):
-        generated_z3_formula = "(declare-const " + const + " String)\n" + "(assert (= (str.len " + const + ") 1))\n" + generated_z3_formula  # declare string constant and enforce that is has length 1
-        reference_z3_formula = reference_z3_formula.replace(const, "\"" + consts_to_vals[const] + "\"")  # surround string with " "
+    builder = FormulaBuilder()
+    z3_expression = compute_edit_distance_and_generate_formula(s1, s2, style, builder)
+    generated_z3_formula = builder.declarations() + z3_expression
+    reference_z3_formula = builder.substitute(z3_expression)
     return generated_z3_formula, reference_z3_formula
 
+# Like the generated_z3_formula of get_sat_z3_formulas, but yields it in small pieces instead of building it as a whole.
+# The operations are computed right away, only the cheap writing of the pieces is left to the consumer (e.g. Z3)
+def iter_sat_z3_formula(s1: str, s2: str, style: str = "nested") -> Iterator[str]:
+    if style not in FORMULA_STYLES:
+        raise ValueError(f"Invalid formula style. Only {', '.join(FORMULA_STYLES)} are supported.")
+    builder = FormulaBuilder()
+    prefixes = edit_prefixes(s1, s2, builder)
+    return chain(builder.iter_declarations(), _chain_pieces(s1, s2, prefixes, style))
+
 # Returns an SMT formula using insert, remove and replace that make it IMPOSSIBLE to get from s1 to s2.
 # generated_z3_formula is of the form "(assert (= (replace str_const_13 int_const_24 (replace str_const_11 int_const_20 "foo")) "bar"))"
 # -> it is intended to be used to stress-test Z3
 # (note that all the constant definitions are included as well)
 # The formula is UNSAT by construction, as it uses less insert/remove/replace operations than would be minimally needed to get from s1 to s2.
-# In addition to the formula this function also returns the seed that was used to generate the formula.
+# It uses deficit operations less than the edit distance, and the kind of every operation is drawn at random.
+# In addition to the formula this function also returns the seed that was used to generate the formula (a random one if seed is None).
 # This is useful to be able to reproduce the formula later on.
-def get_unsat_z3_formula(s1: str, s2: str, seed=None) -> Tuple[str, int | float | bytes | bytearray]:
-    edit_distance = just_compute_edit_distance(s1, s2)
-    formula = "\"" + s1 + "\""
-    declarations = ""
-    constraints = ""
-    for i in range(edit_distance - 1):  # by adding edit_distance - 1 insert/remove/replace operations we ensure that the formula will be UNSAT
-        if seed:
-            random.seed(seed)
-        random_number = random.randint(0, 2)
-        if random_number == 1:  # insert
-            formula = "(insert str_const_" + str(i) + " int_const_" + str(i) + " " + formula + ")"
-            declarations += "(declare-const int_const_" + str(i) + " Int)\n"
-            declarations += "(declare-const str_const_" + str(i) + " String)\n"
-            constraints += "(assert (= (str.len str_const_" + str(i) + ") 1))\n"
-        elif random_number == 0:  # remove
-            formula = "(remove int_const_" + str(i) + " " + formula + ")"
-            declarations += "(declare-const int_const_" + str(i) + " Int)\n"
-        else:  # replace
-            formula = "(replace str_const_" + str(i) + " int_const_" + str(i) + " " + formula + ")"
-            declarations += "(declare-const int_const_" + str(i) + " Int)\n"
-            declarations += "(declare-const str_const_" + str(i) + " String)\n"
-            constraints += "(assert (= (str.len str_const_" + str(i) + ") 1))\n"
-    formula = "(assert (= " + formula + " \"" + s2 + "\"))"
-    generated_z3_formula = declarations + "\n" + constraints + "\n" + formula
-    return generated_z3_formula, seed
+def get_unsat_z3_formula(s1: str, s2: str, seed=None, style: str = "nested", deficit: int = 1) -> Tuple[str, int | float | bytes | bytearray]:
+    if seed is None:
+        seed = random.randrange(2**32)
+    return "".join(iter_unsat_z3_formula(s1, s2, seed, style, deficit)), seed
+
+
+# Like get_unsat_z3_formula, but yields the formula for the given seed in small pieces instead of building it as a whole.
+# The operations are drawn right away, only the cheap writing of the pieces is left to the consumer (e.g. Z3)
+def iter_unsat_z3_formula(s1: str, s2: str, seed, style: str = "nested", deficit: int = 1) -> Iterator[str]:
+    if deficit < 1:
+        raise ValueError("the deficit must be at least 1, otherwise the formula can be SAT")
+    if style not in FORMULA_STYLES:
+        raise ValueError(f"Invalid formula style. Only {', '.join(FORMULA_STYLES)} are supported.")
+    # every formula draws from its own stream, the global one is shared by the threads of the search
+    rng = random.Random(seed)
+    with stage("formula.distance"):
+        edit_distance = compute_edit_distance(s1, s2)
+    if edit_distance == 0:
+        # no chain of operations turning s1 into itself is UNSAT, so the formula asserts that the words differ
+        return iter(("(assert (distinct \"" + s1 + "\" \"" + s2 + "\"))",))
+    # by adding less operations than edit_distance we ensure that the formula will be UNSAT
+    kinds = [rng.randint(0, 2) for _ in range(max(0, edit_distance - deficit))]  # 0: remove, 1: insert, 2: replace
+    return _unsat_pieces(s1, s2, kinds, style)
+
+
+def _unsat_pieces(s1: str, s2: str, kinds: List[int], style: str) -> Iterator[str]:
+    for i, kind in enumerate(kinds):
+        yield "(declare-const int_const_" + str(i) + " Int)\n"
+        if kind != 0:
+            yield "(declare-const str_const_" + str(i) + " String)\n"
+    yield "\n"
+    for i, kind in enumerate(kinds):
+        if kind != 0:
+            yield "(assert (= (str.len str_const_" + str(i) + ") 1))\n"
+    yield "\n"
+    prefixes = []
+    for i, kind in enumerate(kinds):
+        if kind == 0:
+            prefixes.append("(remove int_const_" + str(i) + " ")
+        else:
+            name = "insert" if kind == 1 else "replace"
+            prefixes.append("(" + name + " str_const_" + str(i) + " int_const_" + str(i) + " ")
+    yield from _chain_pieces(s1, s2, prefixes, style)
 
 
 def wrap_formula(formula: str, string_solver: str = "seq") -> str:
     '''
     Wraps a formula into the definitions for insert, remove and replace and adds check-sat at the end
     '''
+    return wrap_preamble(string_solver) + wrap_query(formula)
+
+
+def write_formula(sink: BinaryIO, pieces: Iterable[str], string_solver: str = "seq") -> int:
+    '''
+    Writes a formula, given as the pieces of a formula generator, wrapped like wrap_formula into the binary sink
+    (e.g. a file or a pipe) without building it as a whole. The preamble is written in its pre-encoded form.
+    Returns the number of bytes written
+    '''
+    with SmtWriter(sink) as writer:
+        writer.write_encoded(encoded(wrap_preamble(string_solver)))
+        writer.write_all(pieces)
+        writer.write("\n(check-sat)\n")
+    return writer.written
+
+
+@lru_cache(maxsize=None)
+def wrap_preamble(string_solver: str = "seq") -> str:
+    '''
+    Returns the part of a wrapped formula that is shared by all formulas:
+    the string solver option and the definitions for insert, remove and replace
+    '''
     full_input = ""
     if string_solver == "z3str3":
         full_input += "(set-option :smt.string_solver z3str3) ; set the string solver to be the z3str3 solver\n"
@@ -240,6 +355,11 @@ def wrap_formula(formula: str, string_solver: str = "seq") -> str:
     full_input += insert_in_smt + "\n"
     full_input += remove_in_smt + "\n"
     full_input += replace_in_smt + "\n"
-    full_input += formula + "\n"
-    full_input += "(check-sat)\n"
     return full_input
+
+
+def wrap_query(formula: str) -> str:
+    '''
+    Returns the part of a wrapped formula that is specific to formula, i.e. the formula and check-sat
+    '''
+    return formula + "\n" + "(check-sat)\n"
@@ -1,59 +1,363 @@
 '''
-Generates random words
+Generates random words.
+Words come from local sources first: a word list file, the on-disk cache of words
+that were fetched online before, or the static offline list. Fetching words online
+is opt-in and happens in the background, it never blocks the generation of words.
 '''
+import hashlib
+import mmap
+import os
+import queue
 import random
 import json
+import string
+import threading
+import time
+from array import array
+from typing import Iterator
 import requests
+from stage_timer import stage
+
+RANDOMWORDURL = "https://random-word-api.herokuapp.com/word"
+# words that were fetched online are added to this file, one word per line
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "madamastra", "words.txt")
+# the cache stops growing once it holds this many words
+CACHE_LIMIT = 100000
+
+OFFLINEWORDS = [
+    "which", "apple", "chemical", "beautiful", "fell",
+    "broken", "scientist", "party", "farm", "religious",
+    "sit", "likely", "basic", "solid", "mud",
+    "buried", "though", "diameter", "mad", "origin",
+    "elephant", "brush", "stiff", "environment", "chosen",
+    "tank", "stick", "amount", "development", "officer",
+    "offer", "fully", "poet", "water", "swim",
+    "aloud", "pond", "shape", "tales", "dirty",
+    "battle", "lunch", "sitting", "eager", "twelve",
+    "stone", "finger", "once", "bag", "short",
+    "hearing", "desk", "composition", "asleep", "rear",
+    "slowly", "hardly", "save", "quietly", "extra",
+    "mostly", "everything", "top", "different", "plane",
+    "vegetable", "helpful", "exactly", "trade", "diagram",
+    "tool", "fence", "rest", "sweet", "blank",
+    "everything", "live", "you", "age", "date",
+    "offer", "wolf", "wrote", "try", "football",
+    "box", "late", "war", "increase", "state",
+    "gulf", "once", "system", "after", "half",
+    "far", "worse", "his", "brass", "modern"
+]
+
+
+class WordSource():
+    '''
+    Interface of the sources of words. A source draws its words from the given random generator,
+    such that a seeded stream of words can be replayed.
+    '''
+
+    def word(self, rng: random.Random) -> str:
+        '''
+        Returns a single word
+        '''
+        raise NotImplementedError
+
+    def pair(self, rng: random.Random) -> tuple[str, str]:
+        '''
+        Returns a pair of words. By default, two independent words
+        '''
+        return self.word(rng), self.word(rng)
+
+    def fingerprint(self) -> str | None:
+        '''
+        Returns the sha256 of everything the words depend on besides the random generator,
+        e.g. the content of a word list. Sources with the same fingerprint generate the same stream of words
+        for the same seed. None if the words cannot be replayed (e.g. words fetched online)
+        '''
+        return None
+
+
+class OfflineSource(WordSource):
+    '''
+    Draws words from a static list of offline words
+    '''
+
+    def __init__(self, words: list[str] = None) -> None:
+        self.words = words or OFFLINEWORDS
+
+    def word(self, rng: random.Random) -> str:
+        return rng.choice(self.words)
+
+    def fingerprint(self) -> str | None:
+        return _sha256("offline", *self.words)
+
+
+class DictionarySource(WordSource):
+    '''
+    Draws words from a local word list file with one word per line.
+    The file is memory-mapped and indexed once, such that drawing a word takes O(1)
+    no matter how large the file is
+    '''
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"the dictionary {path} does not contain any words")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # start and end offsets of the non-empty lines
+        self.starts, self.ends = array("Q"), array("Q")
+        start = 0
+        while start < len(self.data):
+            end = self.data.find(b"\n", start)
+            if end == -1:
+                end = len(self.data)
+            if len(self.data[start:end].strip()) > 0:
+                self.starts.append(start)
+                self.ends.append(end)
+            start = end + 1
+        if len(self.starts) == 0:
+            raise ValueError(f"the dictionary {path} does not contain any words")
+
+    def word(self, rng: random.Random) -> str:
+        idx = rng.randrange(len(self.starts))
+        return self.data[self.starts[idx]:self.ends[idx]].decode('utf-8').strip()
+
+    def fingerprint(self) -> str | None:
+        # the mapping is a snapshot of the file, since the cache of words is replaced rather than changed in place
+        return hashlib.sha256(self.data).hexdigest()
+
+
+class AlphabetSource(WordSource):
+    '''
+    Generates random words over an alphabet.
+    distribution: how the lengths between min_length and max_length are distributed.
+    uniform: all lengths are equally likely, geometric: short words are more likely
+    '''
+
+    def __init__(self, alphabet: str = string.ascii_lowercase, min_length: int = 1, max_length: int = 12,
+                 distribution: str = "uniform") -> None:
+        if distribution not in LENGTH_DISTRIBUTIONS:
+            raise ValueError(f"unknown length distribution {distribution}. Only {', '.join(LENGTH_DISTRIBUTIONS)} are supported")
+        if len(alphabet) == 0:
+            raise ValueError("the alphabet source needs at least 1 character")
+        if min_length < 0 or min_length > max_length:
+            raise ValueError(f"invalid word lengths {min_length} to {max_length}")
+        self.alphabet = alphabet
+        self.min_length = min_length
+        self.max_length = max_length
+        self.distribution = distribution
+
+    def word(self, rng: random.Random) -> str:
+        if self.distribution == "uniform":
+            length = rng.randint(self.min_length, self.max_length)
+        else:
+            # expected length is a quarter of the way from min_length to max_length
+            mean = max(1, (self.max_length - self.min_length) / 4)
+            length = min(self.max_length, self.min_length + int(rng.expovariate(1 / mean)))
+        return "".join(rng.choice(self.alphabet) for _ in range(length))
+
+    def fingerprint(self) -> str | None:
+        return _sha256("alphabet", self.alphabet, self.min_length, self.max_length, self.distribution)
+
+
+class MutationSource(WordSource):
+    '''
+    Pairs a word of the base source with a mutated copy of it.
+    The copy differs by up to max_mutations inserted, removed or replaced characters,
+    so the pairs have small edit distances.
+    '''
+
+    def __init__(self, base: WordSource, max_mutations: int = 3, alphabet: str = string.ascii_lowercase) -> None:
+        if max_mutations < 1:
+            raise ValueError("the mutation source needs at least 1 mutation, otherwise the words of a pair are equal")
+        if len(alphabet) == 0:
+            raise ValueError("the mutation source needs at least 1 character to insert and replace")
+        self.base = base
+        self.max_mutations = max_mutations
+        self.alphabet = alphabet
+
+    def word(self, rng: random.Random) -> str:
+        return self.base.word(rng)
+
+    def pair(self, rng: random.Random) -> tuple[str, str]:
+        word = self.base.word(rng)
+        return word, mutate(word, rng.randint(1, self.max_mutations), rng, self.alphabet)
+
+    def fingerprint(self) -> str | None:
+        base = self.base.fingerprint()
+        return None if base is None else _sha256("mutation", base, self.max_mutations, self.alphabet)
+
+
+class OnlineSource(WordSource):
+    '''
+    Fetches random words online in a background thread and adds them to the cache.
+    Whenever no fetched word is ready, the word is drawn from the fallback source instead,
+    so a slow or missing network never holds up the generation of words
+    '''
+
+    def __init__(self, fallback: WordSource, batch_size: int = 100, timeout: float = 0.5,
+                 cache_path: str = CACHE_PATH) -> None:
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.words = queue.Queue(maxsize=4 * batch_size)
+        threading.Thread(target=self.__prefetch, daemon=True).start()
+
+    def word(self, rng: random.Random) -> str:
+        try:
+            return self.words.get_nowait()
+        except queue.Empty:
+            return self.fallback.word(rng)
+
+    def __prefetch(self) -> None:
+        backoff = 1
+        while True:
+            try:
+                response = requests.get(RANDOMWORDURL + f"?number={self.batch_size}", timeout=self.timeout)
+                response.raise_for_status()
+                words = json.loads(response.content.decode('utf-8'))
+            except (requests.RequestException, ValueError):
+                # the network is not available, retry later
+                time.sleep(backoff)
+                backoff = min(2 * backoff, 60)
+                continue
+            backoff = 1
+            append_to_cache(words, self.cache_path)
+            for word in words:
+                self.words.put(word)
+
+
+def append_to_cache(words: list[str], cache_path: str = CACHE_PATH, limit: int = CACHE_LIMIT) -> int:
+    '''
+    Adds the words that are not in the on-disk cache of words yet, until it holds limit words.
+    The cache is replaced at once instead of being appended to, such that a run that mapped it
+    (see DictionarySource) keeps a consistent snapshot, and concurrent runs do not corrupt it
+    returns: the number of words that were added
+    '''
+    try:
+        with open(cache_path, "r", encoding='utf-8') as f:
+            cached = list(dict.fromkeys(f.read().split()))[:limit]
+    except FileNotFoundError:
+        cached = []
+    known = set(cached)
+    added = []
+    for word in words:
+        word = word.strip()
+        if len(cached) + len(added) >= limit:
+            break
+        if len(word) > 0 and word not in known:
+            known.add(word)
+            added.append(word)
+    if len(added) == 0:
+        return 0
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    temporary = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding='utf-8') as f:
+        f.write("".join(word + "\n" for word in cached + added))
+    os.replace(temporary, cache_path)
+    return len(added)
+
+
+def _sha256(*parts) -> str:
+    return hashlib.sha256("\n".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def local_word_list(cache_path: str = CACHE_PATH) -> str | None:
+    '''
+    Returns the path of the on-disk cache of words that the local source uses, None if it uses the static offline list
+    '''
+    if os.path.isfile(cache_path) and os.path.getsize(cache_path) > 0:
+        return cache_path
+    return None
+
+
+def local_source(cache_path: str = CACHE_PATH) -> WordSource:
+    '''
+    Returns the on-disk cache of words if there is one, the static offline list otherwise
+    '''
+    path = local_word_list(cache_path)
+    if path is not None:
+        return DictionarySource(path)
+    return OfflineSource()
+
+
+def mutate(word: str, mutations: int, rng: random.Random, alphabet: str = string.ascii_lowercase) -> str:
+    '''
+    Applies the given number of random character inserts, removes and replaces to word
+    '''
+    chars = list(word)
+    for _ in range(mutations):
+        operation = rng.randrange(3) if len(chars) > 0 else 0
+        if operation == 0:  # insert
+            chars.insert(rng.randint(0, len(chars)), rng.choice(alphabet))
+        elif operation == 1:  # remove
+            del chars[rng.randrange(len(chars))]
+        else:  # replace
+            chars[rng.randrange(len(chars))] = rng.choice(alphabet)
+    return "".join(chars)
+
+
+SOURCES = ["local", "online", "offline", "dictionary", "alphabet", "mutation"]
+LENGTH_DISTRIBUTIONS = ["uniform", "geometric"]
+
 
 class WordGenerator():
     '''
-    Generates random words by either
-    1. getting them online
-    2. using a list of offline words
-    '''
-    RANDOMWORDURL = "https://random-word-api.herokuapp.com/word"
-    OFFLINEWORDS = [
-        "which", "apple", "chemical", "beautiful", "fell",
-        "broken", "scientist", "party", "farm", "religious",
-        "sit", "likely", "basic", "solid", "mud",
-        "buried", "though", "diameter", "mad", "origin",
-        "elephant", "brush", "stiff", "environment", "chosen",
-        "tank", "stick", "amount", "development", "officer",
-        "offer", "fully", "poet", "water", "swim",
-        "aloud", "pond", "shape", "tales", "dirty",
-        "battle", "lunch", "sitting", "eager", "twelve",
-        "stone", "finger", "once", "bag", "short",
-        "hearing", "desk", "composition", "asleep", "rear",
-        "slowly", "hardly", "save", "quietly", "extra",
-        "mostly", "everything", "top", "different", "plane",
-        "vegetable", "helpful", "exactly", "trade", "diagram",
-        "tool", "fence", "rest", "sweet", "blank",
-        "everything", "live", "you", "age", "date",
-        "offer", "wolf", "wrote", "try", "football",
-        "box", "late", "war", "increase", "state",
-        "gulf", "once", "system", "after", "half",
-        "far", "worse", "his", "brass", "modern"
-    ]
-
-    def __init__(self) -> None:
-        pass
-
-    def generate(self, number=1) -> list[str]:
-        '''
-        Tries to fetch a random word online.
-        If it fails, falls back to a static offline list
-        '''
-        request_url = self.RANDOMWORDURL
-        if number is not None:
-            request_url += f"?number={number}"
-        response = requests.get(request_url, timeout=1)
-        if response.ok:
-            return json.loads(response.content.decode('utf-8'))
-        return self.__generate_offline(number)
-
-    def __generate_offline(self, number) -> str:
-        result = []
-        for _ in range(number):
-            idx = random.randint(0, len(self.OFFLINEWORDS))
-            result.append(self.OFFLINEWORDS[idx])
-        return result
+    Generates random words from a WordSource, by default the local one
+    (the cache of words that were fetched online, or a list of offline words).
+    Words are either generated in a list or as an endless stream of word pairs
+    '''
+    RANDOMWORDURL = RANDOMWORDURL
+    OFFLINEWORDS = OFFLINEWORDS
+
+    def __init__(self, source: WordSource = None) -> None:
+        self.source = source or local_source()
+
+    def generate(self, number=1, seed=None) -> list[str]:
+        '''
+        Returns number random words from the source
+        '''
+        rng = random.Random(seed)
+        return [self.source.word(rng) for _ in range(number)]
+
+    def pairs(self, seed=None) -> Iterator[tuple[str, str]]:
+        '''
+        Returns an endless, lazily generated stream of word pairs.
+        Streams with the same seed (and source) are the same
+        '''
+        rng = random.Random(seed)
+        while True:
+            with stage("words"):
+                pair = self.source.pair(rng)
+            yield pair
+
+
+def test_seed(campaign_seed: int, index: int) -> int:
+    '''
+    Returns the seed of the test with the given index of a campaign.
+    The seeds of the tests are independent of each other and of the order in which the tests run
+    '''
+    return random.Random(f"{campaign_seed}/{index}").getrandbits(32)
+
+
+def make_source(name: str, dictionary: str = None, alphabet: str = string.ascii_lowercase,
+                lengths: tuple[int, int] = (1, 12), distribution: str = "uniform", max_mutations: int = 3) -> WordSource:
+    '''
+    Returns the word source with the given name
+    dictionary: the word list used by the dictionary source, and by the mutation source if given
+    '''
+    if name == "local":
+        return local_source()
+    if name == "online":
+        return OnlineSource(local_source())
+    if name == "offline":
+        return OfflineSource()
+    if name == "dictionary":
+        if dictionary is None:
+            raise ValueError("the dictionary source needs a dictionary file")
+        return DictionarySource(dictionary)
+    if name == "alphabet":
+        return AlphabetSource(alphabet, lengths[0], lengths[1], distribution)
+    if name == "mutation":
+        base = DictionarySource(dictionary) if dictionary is not None else local_source()
+        return MutationSource(base, max_mutations, alphabet)
+    raise ValueError(f"unknown word source {name}. Only {', '.join(SOURCES)} are supported")
@@ -0,0 +1,208 @@
+'''
+This module shrinks a test on which Z3 gives a wrong verdict, such that it can be triaged by hand.
+It works in two stages:
+1. the words are reduced with delta debugging. The formula is generated again for every candidate,
+   with the same mode and seed, so its verdict is still guaranteed by the edit distance of the candidate
+2. the SMT formula of the reduced words is reduced further, by peeling off insert, remove and replace
+   operations and by dropping top-level commands. Such formulas lose the guarantee, so a candidate is only kept
+   if a reference solver still finds the expected verdict
+The candidates of a step are tried in parallel, and the outcome of every formula is remembered
+(by the hash of the formula), such that the same candidate is never solved twice.
+'''
+
+import os
+import re
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+from typing import Callable
+from c_printer import print_content
+from formula_generator import wrap_preamble
+from result_log import formula_hash
+from z3_tester import Z3Tester
+
+# string literals, comments, parentheses and atoms of SMT-LIB
+SMT_TOKENS = re.compile(r'"(?:[^"]|"")*"|;[^\n]*|[()]|[^\s()";]+')
+OPERATIONS = ["insert", "remove", "replace"]
+
+
+def split_items(smt_expr: str) -> list[str]:
+    '''
+    returns the top-level items of smt_expr: atoms, string literals and parenthesized expressions. Comments are dropped
+    '''
+    items = []
+    depth = 0
+    start = 0
+    for token in SMT_TOKENS.finditer(smt_expr):
+        text = token.group()
+        if text.startswith(";"):
+            continue
+        if text == "(":
+            if depth == 0:
+                start = token.start()
+            depth += 1
+        elif text == ")":
+            depth -= 1
+            if depth == 0:
+                items.append(smt_expr[start:token.end()])
+        elif depth == 0:
+            items.append(text)
+    return items
+
+
+def operation_spans(smt_expr: str) -> list[tuple[int, int, str]]:
+    '''
+    returns the start, end and source argument of every application of insert, remove or replace in smt_expr
+    '''
+    spans = []
+    opened = []
+    for token in SMT_TOKENS.finditer(smt_expr):
+        if token.group() == "(":
+            opened.append(token.start())
+        elif token.group() == ")" and len(opened) > 0:
+            start = opened.pop()
+            items = split_items(smt_expr[start + 1:token.end() - 1])
+            if len(items) > 1 and items[0] in OPERATIONS:
+                spans.append((start, token.end(), items[-1]))
+    return spans
+
+
+def chunks(items: list, n: int) -> list[list]:
+    '''splits items into n chunks of (almost) the same size'''
+    size, rest = divmod(len(items), n)
+    result = []
+    start = 0
+    for index in range(n):
+        end = start + size + (1 if index < rest else 0)
+        result.append(items[start:end])
+        start = end
+    return result
+
+
+class Reducer():
+    '''
+    summary: reduces a test of the given mode, solver and seed on which Z3 answers verdict
+    tester: runs the candidates, it is shared by the threads of the pool
+    reference: the solver that has to confirm the expected verdict of formulas reduced on the SMT level,
+    None to skip that stage
+    processes: number of candidates that are tried at the same time
+    '''
+
+    def __init__(self, tester: Z3Tester, mode_config: str, solver_config: str, seed: int, verdict: str,
+                 reference: str = None, processes: int = 0) -> None:
+        self.tester = tester
+        self.mode_config = mode_config
+        self.solver_config = solver_config
+        self.seed = seed
+        self.verdict = verdict
+        self.reference = reference
+        self.pool = ThreadPool(processes if processes > 0 else 4 * os.cpu_count())
+        self.size = processes if processes > 0 else 4 * os.cpu_count()
+        self.lock = threading.Lock()
+        # formula hash -> whether the formula is interesting
+        self.outcomes = {}
+        self.tests = 0
+        self.hits = 0
+
+    def query(self, word1: str, word2: str) -> str:
+        '''
+        summary: returns the query that the search would generate for word1 and word2
+        '''
+        query, _, _ = self.tester.prepare(word1, word2, self.mode_config, self.solver_config, self.seed)
+        return query
+
+    def interesting(self, query: str, confirm: bool = False) -> bool:
+        '''
+        summary: returns True if Z3 answers verdict on query.
+        confirm: if True, the reference solver must also find the expected verdict
+        '''
+        key = formula_hash(query) + (" confirmed" if confirm else "")
+        with self.lock:
+            if key in self.outcomes:
+                self.hits += 1
+                return self.outcomes[key]
+            self.tests += 1
+        result, _ = self.tester.z3_driver.solve(query, wrap_preamble(self.solver_config))
+        outcome = result.output.strip() == self.verdict
+        if outcome and confirm:
+            reference_result, _ = self.tester.z3_driver.solve(query, wrap_preamble(self.reference))
+            outcome = reference_result.output.strip() == self.mode_config
+        with self.lock:
+            self.outcomes[key] = outcome
+        return outcome
+
+    def first_interesting(self, queries: list[str], confirm: bool = False) -> int | None:
+        '''
+        summary: tries queries in parallel and returns the index of the first interesting one, None if there is none.
+        Candidates are tried in rounds of the pool size, so later rounds are skipped once one is found
+        '''
+        for start in range(0, len(queries), self.size):
+            outcomes = self.pool.map(lambda query: self.interesting(query, confirm), queries[start:start + self.size])
+            for index, outcome in enumerate(outcomes):
+                if outcome:
+                    return start + index
+        return None
+
+    def ddmin(self, items: list, make: Callable[[list], str], confirm: bool = False) -> list:
+        '''
+        summary: delta debugging. returns a subsequence of items that is still interesting,
+        from which no single chunk of the final granularity can be removed.
+        make(items) returns the query of a candidate
+        '''
+        n = 2
+        while len(items) > 0:
+            n = min(n, len(items))
+            parts = chunks(items, n)
+            complements = [[item for other, part in enumerate(parts) if other != index for item in part]
+                           for index in range(n)]
+            candidates = [part for part in parts if len(part) < len(items)] + complements
+            index = self.first_interesting([make(candidate) for candidate in candidates], confirm)
+            if index is not None:
+                # a chunk on its own restarts with two chunks, a complement keeps the granularity
+                n = 2 if index < len(candidates) - n else max(n - 1, 2)
+                items = candidates[index]
+                continue
+            if n == len(items):
+                break
+            n = min(2 * n, len(items))
+        return items
+
+    def reduce_words(self, word1: str, word2: str) -> tuple[str, str]:
+        '''
+        summary: removes characters of both words until no character can be removed anymore
+        '''
+        while True:
+            reduced1 = "".join(self.ddmin(list(word1), lambda chars: self.query("".join(chars), word2)))
+            reduced2 = "".join(self.ddmin(list(word2), lambda chars: self.query(reduced1, "".join(chars))))
+            if (reduced1, reduced2) == (word1, word2):
+                return word1, word2
+            word1, word2 = reduced1, reduced2
+            print_content(f"words: {word1}, {word2}, lengths: {len(word1)}, {len(word2)}")
+
+    def reduce_smt(self, query: str) -> str:
+        '''
+        summary: peels off operations and drops top-level commands of query, as long as it stays interesting
+        and the reference solver confirms the expected verdict
+        '''
+        while True:
+            # replacing an operation by its source, e.g. (remove 1 "ab") by "ab"
+            candidates = [query[:start] + source + query[end:] for start, end, source in operation_spans(query)]
+            index = self.first_interesting(candidates, confirm=True)
+            if index is not None:
+                query = candidates[index]
+                print_content(f"peeled an operation, {len(operation_spans(query))} left")
+                continue
+            commands = split_items(query)
+            # (check-sat) always stays at the end
+            reduced = self.ddmin(commands[:-1], lambda kept: "\n".join(kept + commands[-1:]) + "\n", confirm=True)
+            reduced_query = "\n".join(reduced + commands[-1:]) + "\n"
+            if len(reduced) == len(commands) - 1:
+                return reduced_query
+            print_content(f"dropped {len(commands) - 1 - len(reduced)} commands")
+            query = reduced_query
+
+    def close(self) -> None:
+        '''
+        summary: stops the threads of the pool
+        '''
+        self.pool.close()
+        self.pool.join()
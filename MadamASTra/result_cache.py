@@ -0,0 +1,228 @@
+'''
+This module provides an on-disk cache of the results of Z3.
+Results are addressed by the hash of the normalized SMT script, the configuration of the
+driver, the timeout and the version of Z3, such that a formula that was already solved
+with the same setup does not need to be solved again.
+The cache is a sqlite database, which can be shared by any number of threads and processes.
+The least recently used entries are evicted once the cache holds more than max_entries results.
+Scripts that are generated in pieces are hashed piece by piece (see SmtHash), without joining them.
+'''
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Iterable, Iterator
+from z3_backend import Z3Result
+
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "madamastra", "results.sqlite")
+
+# string literals (kept as they are), comments (dropped) and whitespace (collapsed)
+SMT_TOKENS = re.compile(r'("(?:[^"]|"")*")|(;[^\n]*)|(\s+)')
+
+
+def normalize_smt(smt_expr: str) -> str:
+    '''
+    returns smt_expr without comments and with all whitespace outside of string literals collapsed
+    '''
+    def replace(match: re.Match) -> str:
+        if match.group(1) is not None:
+            return match.group(1)
+        return " "
+    return SMT_TOKENS.sub(replace, smt_expr).strip()
+
+
+class SmtHash():
+    '''
+    summary: hashes an SMT script piece by piece, such that it never has to be joined.
+    The pieces are normalized like normalize_smt on the way: hexdigest() is the formula_hash of the joined script
+    and key() its key in the ResultCache. Tokens that can go on in the next piece (whitespace, comments
+    and string literals at the end of a piece) are held back until the next piece comes.
+    '''
+
+    def __init__(self) -> None:
+        self.digest = hashlib.sha256()
+        self.carry = ""
+        # collapsed whitespace is only written once more than whitespace follows, like normalize_smt strips the script
+        self.spaces = 0
+        self.started = False
+
+    @staticmethod
+    def after(preamble: str) -> "SmtHash":
+        '''
+        returns a hash that already hashed preamble. The state after a preamble is computed once per process
+        '''
+        return _after(preamble).copy()
+
+    def update(self, piece: str) -> None:
+        '''
+        summary: hashes the next piece of the script
+        '''
+        text = self.carry + piece
+        out = []
+        end = 0
+        cut = len(text)
+        for match in SMT_TOKENS.finditer(text):
+            # an opening quote without a match is a string literal that ends in a later piece
+            quote = text.find('"', end, match.start())
+            if quote >= 0:
+                cut = quote
+                break
+            if match.end() == len(text):
+                cut = match.start()
+                break
+            self.__token(out, text[end:match.start()], match.group(1))
+            end = match.end()
+        else:
+            quote = text.find('"', end)
+            if quote >= 0:
+                cut = quote
+        self.__token(out, text[end:cut], None, space=False)
+        self.carry = text[cut:]
+        self.digest.update("".join(out).encode('utf-8'))
+
+    def tee(self, pieces: Iterable[str]) -> Iterator[str]:
+        '''
+        summary: yields the pieces and hashes each of them on the way, e.g. while they are written into Z3
+        '''
+        for piece in pieces:
+            self.update(piece)
+            yield piece
+
+    def copy(self) -> "SmtHash":
+        '''
+        returns an independent copy of the hash
+        '''
+        other = SmtHash()
+        other.digest = self.digest.copy()
+        other.carry, other.spaces, other.started = self.carry, self.spaces, self.started
+        return other
+
+    def hexdigest(self) -> str:
+        '''
+        returns the formula_hash of the script so far
+        '''
+        return self.__finished().hexdigest()
+
+    def key(self, timeout: int, config: str) -> str:
+        '''
+        returns the ResultCache.key of the script so far
+        '''
+        digest = self.__finished()
+        digest.update(("\0" + str(timeout) + "\0" + config).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __finished(self):
+        # at the end of the script, the tokens that were held back are complete
+        other = self.copy()
+        out = []
+        end = 0
+        for match in SMT_TOKENS.finditer(other.carry):
+            other.__token(out, other.carry[end:match.start()], match.group(1))
+            end = match.end()
+        other.__token(out, other.carry[end:], None, space=False)
+        other.digest.update("".join(out).encode('utf-8'))
+        return other.digest
+
+    def __token(self, out: list[str], before: str, literal: str | None, space: bool = True) -> None:
+        # writes the text before a token and the token: a string literal as it is, whitespace or a comment as a space
+        for text in (before, literal):
+            if text:
+                if self.spaces > 0:
+                    out.append(" " * self.spaces)
+                    self.spaces = 0
+                out.append(text)
+                self.started = True
+        if space and literal is None and self.started:
+            self.spaces += 1
+
+
+@lru_cache(maxsize=16)
+def _after(preamble: str) -> SmtHash:
+    smt_hash = SmtHash()
+    smt_hash.update(preamble)
+    return smt_hash
+
+
+class ResultCache():
+    '''
+    summary: stores the results of Z3 in a sqlite database at path.
+    refresh: if True, cached results are never returned, but new results are still stored
+    '''
+
+    # evictions only run every so many stores, to keep them off the hot path
+    EVICT_INTERVAL = 1000
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = 1000000, refresh: bool = False) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.stores = 0
+        self.connection = None
+        self.pid = None
+
+    def key(self, smt_expr: str, timeout: int, config: str) -> str:
+        '''
+        summary: returns the address of the result of running smt_expr with the given timeout and driver config
+        '''
+        content = "\0".join([normalize_smt(smt_expr), str(timeout), config])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Z3Result | None:
+        '''
+        summary: returns the cached result for key, None if there is none.
+        Its runtime is the time [seconds] that Z3 took when the result was stored
+        '''
+        if self.refresh:
+            return None
+        with self.lock:
+            connection = self.__connect()
+            row = connection.execute("SELECT output, error, runtime FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+        return Z3Result(*row)
+
+    def put(self, key: str, result: Z3Result, runtime: float) -> None:
+        '''
+        summary: stores the result and the runtime [seconds] it took for key
+        '''
+        with self.lock:
+            connection = self.__connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, output, error, runtime, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, result.output, result.error, runtime, time.time()))
+            self.stores += 1
+            if self.stores % self.EVICT_INTERVAL == 0:
+                connection.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+            connection.commit()
+
+    def close(self) -> None:
+        '''
+        summary: closes the connection to the database
+        '''
+        with self.lock:
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+    def __connect(self) -> sqlite3.Connection:
+        # connections must not be shared with forked processes, every process opens its own
+        if self.connection is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, output TEXT, error TEXT, runtime REAL, last_used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.pid = os.getpid()
+        return self.connection
@@ -0,0 +1,120 @@
+'''
+This module records the outcome of every test in a JSON lines file, one record per line.
+Records are buffered and synced to disk in batches, a record of a mistake of Z3 is synced right away,
+such that a crash or ctrl-c does not lose any finding.
+The records can be read back lazily, without loading the whole file into memory.
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Iterator, NamedTuple
+from result_cache import normalize_smt
+
+RESULTS_PATH = "results.jsonl"
+
+
+class TestRecord(NamedTuple):
+    '''
+    summary: the outcome of a single test
+    verdict: what Z3 answered (sat, unsat, unknown, timeout), empty if Z3 gave no answer
+    expected: the verdict that the formula is guaranteed to have
+    mistake: True if Z3 answered the opposite of the expected verdict
+    stderr: the errors reported by Z3
+    wall_time: the time [seconds] it took to get the verdict
+    formula_hash: sha256 of the normalized SMT script
+    timeout: the timeout [seconds] that Z3 had, 0 if unknown
+    z3: the z3 binary that was tested
+    finding: what differential testing found, besides mistakes: disagreement or slowdown. empty if nothing
+    '''
+    word1: str
+    word2: str
+    mode: str
+    solver: str
+    seed: int
+    verdict: str
+    expected: str
+    mistake: bool
+    stderr: str
+    wall_time: float
+    formula_hash: str
+    timestamp: float
+    timeout: int = 0
+    z3: str = "z3"
+    finding: str = ""
+
+    @property
+    def timed_out(self) -> bool:
+        '''
+        True if Z3 gave up because it ran out of time.
+        Z3 answers timeout if it is given a timeout on the command line, and unknown for the timeout option
+        '''
+        return self.verdict == "timeout" or \
+            (self.verdict == "unknown" and self.timeout > 0 and self.wall_time >= 0.9 * self.timeout)
+
+
+def formula_hash(smt_expr: str) -> str:
+    '''
+    returns the hash of smt_expr, which is the same for scripts that only differ in comments and whitespace
+    '''
+    return hashlib.sha256(normalize_smt(smt_expr).encode('utf-8')).hexdigest()
+
+
+class ResultLog():
+    '''
+    summary: appends TestRecords to the JSON lines file at path.
+    Can be shared between threads.
+    sync_every: number of buffered records after which they are written and synced to disk
+    sync_interval: max time [seconds] that a record stays in the buffer
+    '''
+
+    def __init__(self, path: str = RESULTS_PATH, sync_every: int = 256, sync_interval: float = 1.0) -> None:
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.last_sync = time.monotonic()
+        self.file = open(path, "a", encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def write(self, record: TestRecord) -> None:
+        '''
+        summary: records the outcome of a test
+        '''
+        with self.lock:
+            self.buffer.append(json.dumps(record._asdict()) + "\n")
+            if record.mistake or len(self.buffer) >= self.sync_every \
+                    or time.monotonic() - self.last_sync >= self.sync_interval:
+                self.__sync()
+
+    def close(self) -> None:
+        '''
+        summary: syncs the buffered records and closes the file
+        '''
+        with self.lock:
+            if not self.file.closed:
+                self.__sync()
+                self.file.close()
+
+    def __sync(self) -> None:
+        self.file.writelines(self.buffer)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+        self.last_sync = time.monotonic()
+
+
+def read_records(paths: list[str]) -> Iterator[TestRecord]:
+    '''
+    lazily yields the records of the JSON lines files at paths.
+    Lines that cannot be parsed (e.g. a line cut off by a crash) are skipped
+    '''
+    for path in paths:
+        with open(path, "r", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield TestRecord(**json.loads(line))
+                except (ValueError, TypeError):
+                    continue
@@ -0,0 +1,145 @@
+'''
+This module checks that Z3 agrees with the definitions of insert, remove and replace before Z3 is tested.
+The check is run once per z3 binary and string solver: every check of a process is remembered,
+and the checks that passed are saved on disk, keyed by the version of the binary and the hash of its file
+(the version of the bindings for the api backend) and the hash of the checked definitions,
+such that later runs with the same binary and definitions skip them. The checks of several binaries and solvers run in parallel.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from c_printer import print_content, print_title
+from formula_generator import get_query_for_checking_operator_definitions, wrap_preamble
+from z3_backend import ApiBackend
+from z3_driver import Z3Driver
+
+SANITY_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "madamastra", "sanity.json")
+
+# the checks that passed in this process
+_passed = set()
+_lock = threading.Lock()
+
+
+class SanityCheckError(Exception):
+    '''
+    raised if Z3 does not agree with the definitions of insert, remove and replace
+    '''
+
+
+@lru_cache(maxsize=None)
+def binary_hash(z3: str) -> str:
+    '''
+    returns the sha256 of the file of the z3 binary, empty if it is not found
+    '''
+    path = shutil.which(z3)
+    if path is None:
+        return ""
+    digest = hashlib.sha256()
+    with open(os.path.realpath(path), "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def definitions_hash(solver_config: str) -> str:
+    '''
+    returns the sha256 of the script that the check runs, such that changed definitions are checked again
+    '''
+    script = wrap_preamble(solver_config) + get_query_for_checking_operator_definitions()
+    return hashlib.sha256(script.encode('utf-8')).hexdigest()
+
+
+def check_key(driver: Z3Driver, z3: str, solver_config: str) -> str:
+    '''
+    returns what identifies a check: the backend and version of Z3, the hash of the binary, the solver
+    and the hash of the definitions. The api backend does not run the binary, its config names the version of the bindings
+    '''
+    binary = None if isinstance(driver.backend, ApiBackend) else binary_hash(z3)
+    return " ".join(part for part in [driver.backend.config(), binary, solver_config, definitions_hash(solver_config)] if part)
+
+
+def diagnose(z3: str, solver_config: str, output: str, error: str, timeout: int) -> str:
+    '''
+    returns why a check failed, given what Z3 reported
+    '''
+    verdict = output.strip()
+    name = f"z3 {z3} with the {solver_config} solver"
+    if verdict == "unsat":
+        return f"{name} does not agree with the definitions of insert, remove and replace"
+    if verdict in ("unknown", "timeout"):
+        return f"{name} answered {verdict}, it could not decide the definitions within {timeout}s"
+    if len(error) > 0:
+        return f"{name} reported errors:\n{error.strip()}"
+    return f"{name} answered \"{verdict}\" instead of sat"
+
+
+def run_check(driver: Z3Driver, z3: str, solver_config: str) -> str | None:
+    '''
+    runs the check of a single binary and solver
+    returns: the diagnosis if it failed, None if it passed
+    '''
+    try:
+        result, _ = driver.solve(get_query_for_checking_operator_definitions(), wrap_preamble(solver_config))
+    except OSError as e:
+        return f"could not run z3 {z3}: {e}"
+    if result.output.strip() != "sat":
+        return diagnose(z3, solver_config, result.output, result.error, driver.timeout)
+    return None
+
+
+def run_sanity_checks(targets: list[tuple[Z3Driver, str, str]], path: str = SANITY_PATH) -> None:
+    '''
+    checks every target, a driver, its z3 binary and a solver, unless it already passed.
+    raises: SanityCheckError with the diagnosis of every target that failed
+    '''
+    print_title("doing sanity check")
+    keys = [check_key(driver, z3, solver_config) for driver, z3, solver_config in targets]
+    saved = load(path)
+    with _lock:
+        pending = [(target, key) for target, key in zip(targets, keys) if key not in _passed and key not in saved]
+    if len(pending) == 0:
+        print_content("sanity check passed before")
+        return
+
+    with ThreadPoolExecutor(len(pending)) as executor:
+        diagnoses = list(executor.map(lambda target: run_check(*target), [target for target, _ in pending]))
+    # a binary that cannot be run fails the same way for every solver
+    failures = list(dict.fromkeys(diagnosis for diagnosis in diagnoses if diagnosis is not None))
+    passed = [key for (_, key), diagnosis in zip(pending, diagnoses) if diagnosis is None]
+    with _lock:
+        _passed.update(passed)
+    save(path, passed)
+    if len(failures) > 0:
+        raise SanityCheckError("\n".join(failures))
+    print_content("sanity check successful")
+
+
+def load(path: str) -> set[str]:
+    '''
+    returns the keys of the checks that passed in earlier runs
+    '''
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def save(path: str, keys: list[str]) -> None:
+    '''
+    adds keys to the checks that passed. The file is replaced at once, such that concurrent runs do not corrupt it
+    '''
+    if len(keys) == 0:
+        return
+    keys = sorted(load(path).union(keys))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding='utf-8') as f:
+        json.dump(keys, f)
+    os.replace(temporary, path)
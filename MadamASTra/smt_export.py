@@ -0,0 +1,169 @@
+'''
+This module exports the formulas of word pairs as a benchmark set of SMT files, e.g. for other solvers or CI.
+Every file is named by the sha256 of its content, such that a formula is only exported once.
+An exporter stores the files either in a directory tree or in a single (compressed) tar archive,
+together with a manifest: a JSON lines file that describes every file, e.g. its expected verdict.
+'''
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+from typing import NamedTuple
+from edit_distance import compute_edit_distance
+from formula_generator import iter_sat_z3_formula, iter_unsat_z3_formula, write_formula
+
+MANIFEST = "manifest.jsonl"
+# the tarfile modes of the archives, by the suffix of their path. Other paths are directories
+ARCHIVE_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tar.xz": "w:xz"}
+
+
+class ExportEntry(NamedTuple):
+    '''
+    summary: describes an exported SMT file in the manifest
+    path: where the file is, relative to the root of the export
+    sha256: the hash of the content of the file, which also names it
+    seed: the seed of the unsat formula, None in the sat mode
+    expected: the verdict that the formula has by construction
+    edit_distance: the edit distance between word1 and word2
+    size: the size of the file [bytes]
+    '''
+    path: str
+    sha256: str
+    word1: str
+    word2: str
+    mode: str
+    solver: str
+    seed: int | None
+    expected: str
+    edit_distance: int
+    length1: int
+    length2: int
+    style: str
+    deficit: int
+    size: int
+
+
+def generate(word1: str, word2: str, mode: str, solver: str, seed: int, style: str = "nested",
+             deficit: int = 1) -> tuple[bytes, ExportEntry]:
+    '''
+    returns the wrapped SMT script of a test and its entry in the manifest
+    '''
+    if mode == "sat":
+        pieces = iter_sat_z3_formula(word1, word2, style)
+        seed = None
+    else:
+        pieces = iter_unsat_z3_formula(word1, word2, seed, style, deficit)
+    sink = io.BytesIO()
+    write_formula(sink, pieces, solver)
+    data = sink.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    path = f"{mode}/{solver}/{digest[:2]}/{digest}.smt2"
+    return data, ExportEntry(path, digest, word1, word2, mode, solver, seed, mode,
+                             compute_edit_distance(word1, word2), len(word1), len(word2), style, deficit, len(data))
+
+
+def is_archive(path: str) -> bool:
+    '''
+    returns whether the export at path is a tar archive rather than a directory
+    '''
+    return any(path.endswith(suffix) for suffix in ARCHIVE_MODES)
+
+
+class DirectoryExporter():
+    '''
+    summary: writes the SMT files into a directory tree below root, and appends their entries to its manifest.
+    Exporting into the same directory again only adds the files that are not there yet
+    '''
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        manifest = os.path.join(root, MANIFEST)
+        self.known = set()
+        if os.path.exists(manifest):
+            with open(manifest, "r", encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.known.add(json.loads(line)["sha256"])
+                    except (ValueError, KeyError):
+                        continue
+        self.manifest = open(manifest, "a", encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def add(self, data: bytes, entry: ExportEntry) -> bool:
+        '''
+        summary: exports a file, unless a file with the same content was exported before
+        returns: True if the file was exported
+        '''
+        if entry.sha256 in self.known:
+            return False
+        self.known.add(entry.sha256)
+        path = os.path.join(self.root, entry.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a file is complete once it has its name, even if the export is killed
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        self.manifest.write(json.dumps(entry._asdict()) + "\n")
+        return True
+
+    def close(self) -> None:
+        '''
+        summary: closes the manifest
+        '''
+        self.manifest.close()
+
+
+class ArchiveExporter():
+    '''
+    summary: writes the SMT files into a new tar archive at path, compressed as its suffix says (see ARCHIVE_MODES).
+    The manifest is collected on the side and added as the last member of the archive
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        mode = next(mode for suffix, mode in ARCHIVE_MODES.items() if path.endswith(suffix))
+        self.archive = tarfile.open(path, mode)  # pylint: disable=consider-using-with
+        self.manifest = tempfile.SpooledTemporaryFile(max_size=1 << 20)  # pylint: disable=consider-using-with
+        self.known = set()
+
+    def add(self, data: bytes, entry: ExportEntry) -> bool:
+        '''
+        summary: exports a file, unless a file with the same content was exported before
+        returns: True if the file was exported
+        '''
+        if entry.sha256 in self.known:
+            return False
+        self.known.add(entry.sha256)
+        self.__add_member(entry.path, io.BytesIO(data), len(data))
+        self.manifest.write((json.dumps(entry._asdict()) + "\n").encode('utf-8'))
+        return True
+
+    def close(self) -> None:
+        '''
+        summary: adds the manifest and closes the archive
+        '''
+        size = self.manifest.tell()
+        self.manifest.seek(0)
+        self.__add_member(MANIFEST, self.manifest, size)
+        self.manifest.close()
+        self.archive.close()
+
+    def __add_member(self, name: str, content, size: int) -> None:
+        # the members carry no time stamps or owners, they only depend on their content
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        self.archive.addfile(info, content)
+
+
+def make_exporter(path: str) -> DirectoryExporter | ArchiveExporter:
+    '''
+    returns the exporter for path: an archive if it has one of the suffixes of ARCHIVE_MODES, a directory otherwise
+    '''
+    if is_archive(path):
+        return ArchiveExporter(path)
+    return DirectoryExporter(path)
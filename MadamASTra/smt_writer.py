@@ -0,0 +1,101 @@
+'''
+This module writes SMT scripts into a binary sink, e.g. the stdin pipe of Z3, a file or a BytesIO.
+The formula generators emit a script as a stream of small pieces, which are buffered and encoded
+in chunks of about CHUNK_SIZE bytes, such that the whole script never has to be held in memory
+as a single string, let alone as a single string and its encoding.
+Constant parts of the scripts, e.g. the preamble, are encoded once and then written as they are.
+SMT expressions are passed around either as strings or as their pieces (see pieces_of), such that the queries
+of the search are only joined by the consumers that need a string, e.g. the z3 python bindings.
+'''
+
+from functools import lru_cache
+from typing import BinaryIO, Iterable
+
+# number of characters that are buffered before they are encoded and written at once
+CHUNK_SIZE = 1 << 16
+
+
+def pieces_of(smt_expr: str | Iterable[str]) -> Iterable[str]:
+    '''
+    returns the pieces of an SMT expression that is given either as a string or as its pieces
+    '''
+    return (smt_expr,) if isinstance(smt_expr, str) else smt_expr
+
+
+def joined(smt_expr: str | Iterable[str]) -> str:
+    '''
+    returns an SMT expression that is given either as a string or as its pieces as a single string
+    '''
+    return smt_expr if isinstance(smt_expr, str) else "".join(smt_expr)
+
+
+@lru_cache(maxsize=16)
+def encoded(text: str) -> bytes:
+    '''
+    returns the utf-8 encoding of text, which is computed once per process. Meant for the few constant
+    parts of the scripts, e.g. the preambles, not for formulas
+    '''
+    return text.encode('utf-8')
+
+
+class SmtWriter():
+    '''
+    summary: writes the pieces of an SMT script into sink, encoded in chunks of about chunk_size characters.
+    Pieces are buffered until flush() is called or the writer is left as a context manager.
+    written: the number of bytes written into sink so far
+    '''
+
+    def __init__(self, sink: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+
+    def write(self, piece: str) -> None:
+        '''
+        summary: writes a piece of the script
+        '''
+        if len(piece) >= self.chunk_size:
+            # a large piece is encoded slice by slice, not as a whole
+            self.flush()
+            for start in range(0, len(piece), self.chunk_size):
+                self.write_encoded(piece[start:start + self.chunk_size].encode('utf-8'))
+            return
+        self.buffer.append(piece)
+        self.buffered += len(piece)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def write_all(self, pieces: Iterable[str]) -> None:
+        '''
+        summary: writes all pieces of an iterable, e.g. of a formula generator
+        '''
+        for piece in pieces:
+            self.write(piece)
+
+    def write_encoded(self, data: bytes) -> None:
+        '''
+        summary: writes data that is already encoded, e.g. the result of encoded(preamble),
+        after the pieces that are buffered
+        '''
+        self.flush()
+        self.sink.write(data)
+        self.written += len(data)
+
+    def flush(self) -> None:
+        '''
+        summary: encodes the buffered pieces and writes them into sink
+        '''
+        if self.buffered == 0:
+            return
+        data = "".join(self.buffer).encode('utf-8')
+        self.buffer, self.buffered = [], 0
+        self.sink.write(data)
+        self.written += len(data)
+
+    def __enter__(self) -> "SmtWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.flush()
@@ -0,0 +1,232 @@
+'''
+This module measures how long the stages of the tests take.
+A stage is timed with `with stage("formula"):` and recorded in a histogram per stage, solver and mode.
+The solver and mode are taken from the enclosing `with labels(solver, mode):` of the thread.
+Nested stages are named after their parent, e.g. "formula.distance" is part of "formula".
+Histograms have logarithmic buckets, such that the histograms of all workers (and of several runs)
+can be merged into one. Timing is disabled by default and costs next to nothing until enable() is called.
+'''
+
+import json
+import math
+import threading
+import time
+from c_printer import print_content, print_title
+
+# every bucket is 2^(1/8) (about 9%) wider than the previous one, starting at 1 microsecond
+BUCKET_BASE = 2 ** (1 / 8)
+BUCKET_START = 1e-6
+
+
+class Histogram():
+    '''
+    summary: counts durations in logarithmic buckets
+    '''
+
+    def __init__(self, buckets: dict[int, int] = None, count: int = 0, total: float = 0.0, maximum: float = 0.0) -> None:
+        self.buckets = buckets or {}
+        self.count = count
+        self.total = total
+        self.maximum = maximum
+
+    def add(self, seconds: float) -> None:
+        '''
+        summary: counts a duration [seconds]
+        '''
+        bucket = int(math.log(seconds / BUCKET_START, BUCKET_BASE)) if seconds > BUCKET_START else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        '''
+        summary: adds the counts of other to this histogram
+        '''
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, p: float) -> float:
+        '''
+        summary: returns the upper bound [seconds] of the bucket that contains the p-th percentile
+        '''
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.maximum, BUCKET_START * BUCKET_BASE ** (bucket + 1))
+        return self.maximum
+
+
+class StageTimings():
+    '''
+    summary: the histograms of the durations of the stages, per (stage, solver, mode).
+    Can be shared between threads.
+    '''
+
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, solver: str, mode: str, seconds: float) -> None:
+        '''
+        summary: records that stage name took seconds for a test of solver and mode
+        '''
+        with self.lock:
+            key = (name, solver, mode)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(seconds)
+
+    def merge(self, other: "StageTimings") -> None:
+        '''
+        summary: adds the histograms of other, e.g. the ones of a worker process
+        '''
+        with self.lock:
+            for key, histogram in other.histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(histogram)
+
+    def take(self) -> "StageTimings":
+        '''
+        summary: returns the recorded histograms and starts over with empty ones
+        '''
+        taken = StageTimings()
+        with self.lock:
+            taken.histograms, self.histograms = self.histograms, {}
+        return taken
+
+    def to_dict(self) -> dict:
+        '''
+        summary: returns the histograms as a dict that can be pickled and written as JSON
+        '''
+        with self.lock:
+            return {"stages": [
+                {"stage": name, "solver": solver, "mode": mode,
+                 "count": histogram.count, "total": histogram.total, "max": histogram.maximum,
+                 "p50": histogram.percentile(50), "p95": histogram.percentile(95), "p99": histogram.percentile(99),
+                 "buckets": histogram.buckets}
+                for (name, solver, mode), histogram in sorted(self.histograms.items())]}
+
+    @staticmethod
+    def from_dict(data: dict) -> "StageTimings":
+        '''
+        summary: inverse of to_dict
+        '''
+        timings = StageTimings()
+        for entry in data["stages"]:
+            buckets = {int(bucket): count for bucket, count in entry["buckets"].items()}
+            timings.histograms[(entry["stage"], entry["solver"], entry["mode"])] = \
+                Histogram(buckets, entry["count"], entry["total"], entry["max"])
+        return timings
+
+    def write_json(self, path: str) -> None:
+        '''
+        summary: exports the histograms to the JSON file at path
+        '''
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def print_report(self) -> None:
+        '''
+        summary: prints the count and the percentiles of every stage
+        '''
+        print_title("stage timings")
+        if len(self.histograms) == 0:
+            print_content("nothing was timed")
+        for entry in self.to_dict()["stages"]:
+            print_content(f"{entry['stage']:16} solver: {entry['solver'] or '-':7} mode: {entry['mode'] or '-':5} "
+                          f"count: {entry['count']:7} total: {entry['total']:9.3f}s "
+                          f"p50: {entry['p50'] * 1000:9.3f}ms p95: {entry['p95'] * 1000:9.3f}ms "
+                          f"p99: {entry['p99'] * 1000:9.3f}ms max: {entry['max'] * 1000:9.3f}ms")
+
+
+_timings = StageTimings()
+_enabled = False
+_labels = threading.local()
+
+
+def enable() -> None:
+    '''
+    starts recording the durations of the stages in this process
+    '''
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    '''
+    returns True if the durations of the stages are recorded
+    '''
+    return _enabled
+
+
+def timings() -> StageTimings:
+    '''
+    returns the durations of the stages recorded by this process
+    '''
+    return _timings
+
+
+class labels():
+    '''
+    summary: the solver and mode that the stages timed by this thread in the with block are recorded for
+    '''
+
+    def __init__(self, solver: str, mode: str) -> None:
+        self.solver = solver
+        self.mode = mode
+        self.previous = None
+
+    def __enter__(self) -> None:
+        self.previous = getattr(_labels, "current", ("", ""))
+        _labels.current = (self.solver, self.mode)
+
+    def __exit__(self, *exc_info) -> None:
+        _labels.current = self.previous
+
+
+class _Stage():
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        solver, mode = getattr(_labels, "current", ("", ""))
+        _timings.add(self.name, solver, mode, time.perf_counter() - self.start)
+
+
+class _NoStage():
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    '''
+    returns a context manager that records how long its with block takes as stage name
+    '''
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name)
+
+
+def record_duration(name: str, seconds: float, solver: str = "", mode: str = "") -> None:
+    '''
+    records a duration that was measured elsewhere as stage name
+    '''
+    if _enabled:
+        _timings.add(name, solver, mode, seconds)
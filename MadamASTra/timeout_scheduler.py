@@ -0,0 +1,157 @@
+'''
+This module schedules the timeouts of the search.
+Most tests are solved in milliseconds, while some always run into the timeout.
+The search therefore runs every test with a short timeout first and only gives the tests that timed out
+a second chance with the full timeout, in a second pass after all other tests.
+The solve times are kept per bucket of (mode, solver, edit distance, word length), where edit distances
+and word lengths are grouped by powers of two. Once a bucket solved enough tests, its first pass gets a multiple
+of its p95 solve time as timeout, within the short and the full timeout, such that the tests of slow buckets
+are not all escalated. A bucket whose escalated tests keep timing out with the full timeout is considered
+hopeless and its tests are not escalated anymore.
+'''
+
+import math
+import threading
+from collections import deque
+from typing import Iterator
+from c_printer import print_content, print_title
+from edit_distance import compute_edit_distance
+from result_log import TestRecord
+from stage_timer import Histogram
+
+# the first pass timeout of a bucket is this multiple of its p95 solve time
+P95_FACTOR = 4
+# number of solved tests of a bucket before its first pass timeout is derived from its solve times
+MIN_SOLVED = 20
+
+
+class BucketStats():
+    '''
+    summary: what happened to the tests of a bucket
+    '''
+
+    def __init__(self) -> None:
+        self.tests = 0
+        self.solve_times = Histogram()
+        self.timeouts = 0
+        self.escalated = 0
+        self.escalated_solved = 0
+        self.escalated_timeouts = 0
+
+
+class TimeoutScheduler():
+    '''
+    summary: keeps the statistics of the buckets and the tests that are escalated to the second pass.
+    Can be shared between threads.
+    first_timeout, timeout: the short and the full timeout [seconds]
+    hopeless_after: number of escalated tests of a bucket that timed out again (without any being solved),
+    after which the tests of the bucket are not escalated anymore
+    '''
+
+    def __init__(self, first_timeout: int, timeout: int, hopeless_after: int = 5) -> None:
+        self.first_timeout = first_timeout
+        self.timeout = timeout
+        self.hopeless_after = hopeless_after
+        self.buckets = {}
+        self.lock = threading.Lock()
+        # the (work item, record of the first pass) of the tests that still have to be retried
+        self.escalations = deque()
+
+    @staticmethod
+    def bucket(work_item: tuple) -> tuple:
+        '''
+        summary: returns the bucket of a work item: mode, solver and the bit lengths of the edit distance
+        and of the length of the longer word
+        '''
+        word1, word2, mode_config, solver_config, _ = work_item
+        distance = compute_edit_distance(word1, word2)
+        return (mode_config, solver_config, distance.bit_length(), max(len(word1), len(word2)).bit_length())
+
+    def record(self, work_item: tuple, record: TestRecord, escalated: bool) -> None:
+        '''
+        summary: updates the statistics of the bucket of work_item with the outcome of its test
+        escalated: True if the test was run in the second pass
+        '''
+        with self.lock:
+            stats = self.__stats(work_item)
+            if escalated:
+                if record.timed_out:
+                    stats.escalated_timeouts += 1
+                else:
+                    stats.escalated_solved += 1
+                    stats.solve_times.add(record.wall_time)
+                return
+            stats.tests += 1
+            if record.timed_out:
+                stats.timeouts += 1
+            else:
+                stats.solve_times.add(record.wall_time)
+
+    def first_timeout_of(self, work_item: tuple) -> int:
+        '''
+        summary: returns the timeout [seconds] of work_item in the first pass: the short timeout until its bucket
+        solved MIN_SOLVED tests, then P95_FACTOR times the p95 solve time of the bucket, within the short and the full timeout
+        '''
+        key = self.bucket(work_item)
+        with self.lock:
+            stats = self.buckets.get(key)
+            return self.first_timeout if stats is None else self.__first_timeout(stats)
+
+    def escalate(self, work_item: tuple, record: TestRecord) -> bool:
+        '''
+        summary: queues a test that timed out in the first pass for the second pass
+        returns: True if the test was queued, False if its bucket is hopeless or it already had the full timeout
+        '''
+        if record.timeout >= self.timeout or self.hopeless(work_item):
+            return False
+        # the seed of the first pass is kept, such that the same formula is tried again
+        self.escalations.append((work_item[:4] + (record.seed,), record))
+        return True
+
+    def hopeless(self, work_item: tuple) -> bool:
+        '''
+        summary: returns True if the escalated tests of the bucket of work_item keep timing out
+        '''
+        with self.lock:
+            stats = self.__stats(work_item)
+        return stats.escalated_solved == 0 and stats.escalated_timeouts >= self.hopeless_after
+
+    def escalation_work(self, skip) -> Iterator[tuple]:
+        '''
+        summary: takes the queued tests of the second pass off the queue and yields them.
+        skip(record) is called with the record of the first pass for every test whose bucket turned hopeless meanwhile
+        '''
+        while len(self.escalations) > 0:
+            work_item, record = self.escalations.popleft()
+            if self.hopeless(work_item):
+                skip(record)
+                continue
+            with self.lock:
+                self.__stats(work_item).escalated += 1
+            yield work_item
+
+    def print_report(self) -> None:
+        '''
+        summary: prints the statistics of every bucket
+        '''
+        print_title("timeouts per bucket")
+        for (mode, solver, distance, length), stats in sorted(self.buckets.items()):
+            solved = stats.solve_times.count
+            print_content(f"mode: {mode:5} solver: {solver:7} distance < {2 ** distance:5} length < {2 ** length:5} "
+                          f"tests: {stats.tests:6} solved: {solved:6} "
+                          f"p50: {stats.solve_times.percentile(50) * 1000 if solved else 0:9.3f}ms "
+                          f"p95: {stats.solve_times.percentile(95) * 1000 if solved else 0:9.3f}ms "
+                          f"first timeout: {self.__first_timeout(stats):4}s timeouts: {stats.timeouts:6} escalated: {stats.escalated:6} "
+                          f"solved then: {stats.escalated_solved:6}")
+
+    def __first_timeout(self, stats: BucketStats) -> int:
+        if stats.solve_times.count < MIN_SOLVED:
+            return self.first_timeout
+        derived = math.ceil(P95_FACTOR * stats.solve_times.percentile(95))
+        return min(self.timeout, max(self.first_timeout, derived))
+
+    def __stats(self, work_item: tuple) -> BucketStats:
+        key = self.bucket(work_item)
+        if key not in self.buckets:
+            self.buckets[key] = BucketStats()
+        return self.buckets[key]
@@ -0,0 +1,268 @@
+'''
+This module spreads the tests of a search over several machines.
+A coordinator hands out chunks of work items to the workers that connect to it, over sockets
+of multiprocessing.connection, and collects their results as they complete.
+Chunks are leased: the items of a chunk whose worker left, or that did not report for lease_timeout seconds,
+are leased out again, and every item is only counted once, no matter how many workers ran it.
+Workers can join and leave at any time.
+'''
+
+import threading
+import time
+from itertools import islice
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Callable, Iterator
+from c_printer import print_content, print_warning
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    '''
+    returns the host and port of an address of the form host:port
+    '''
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"invalid address {address}, expected host:port")
+    return host, int(port)
+
+
+class Lease():
+    '''
+    summary: the items of a chunk that are not done yet, and who has to do them until when
+    '''
+
+    def __init__(self, items: dict[int, tuple], owner: int | None, deadline: float) -> None:
+        self.items = items
+        self.owner = owner
+        self.deadline = deadline
+
+
+class WorkQueue():
+    '''
+    summary: hands out chunks of the work items and keeps track of which of them are done.
+    Can be shared between threads.
+    lease_timeout: time [seconds] after which a chunk without any results is leased out again
+    '''
+
+    def __init__(self, work: Iterator[tuple], lease_timeout: float = 300) -> None:
+        self.work = work
+        self.lease_timeout = lease_timeout
+        self.condition = threading.Condition()
+        self.leases = {}
+        self.next_chunk = 0
+        self.exhausted = False
+
+    def lease(self, owner: int, size: int) -> tuple[int, list[tuple[int, tuple]]] | None:
+        '''
+        summary: leases up to size work items to owner
+        returns: the chunk id and the (index, work item) pairs of the chunk,
+        None if there is nothing to lease right now
+        '''
+        with self.condition:
+            now = time.monotonic()
+            for chunk_id, lease in self.leases.items():
+                if lease.owner is None or lease.deadline < now:
+                    lease.owner, lease.deadline = owner, now + self.lease_timeout
+                    return chunk_id, list(lease.items.items())
+            if self.exhausted:
+                return None
+            items = list(islice(self.work, size))
+            if len(items) < size:
+                self.exhausted = True
+            if len(items) == 0:
+                self.condition.notify_all()
+                return None
+            chunk_id = self.next_chunk
+            self.next_chunk += 1
+            self.leases[chunk_id] = Lease(dict(enumerate(items)), owner, now + self.lease_timeout)
+            return chunk_id, list(enumerate(items))
+
+    def complete(self, chunk_id: int, index: int) -> bool:
+        '''
+        summary: marks a work item as done and renews the lease of its chunk
+        returns: True if the item was not done before
+        '''
+        with self.condition:
+            lease = self.leases.get(chunk_id)
+            if lease is None or index not in lease.items:
+                return False
+            del lease.items[index]
+            lease.deadline = time.monotonic() + self.lease_timeout
+            if len(lease.items) == 0:
+                del self.leases[chunk_id]
+                self.condition.notify_all()
+            return True
+
+    def release(self, owner: int) -> int:
+        '''
+        summary: makes the chunks of owner, who left, available to the other workers
+        returns: the number of work items that are not done
+        '''
+        with self.condition:
+            released = 0
+            for lease in self.leases.values():
+                if lease.owner == owner:
+                    lease.owner = None
+                    released += len(lease.items)
+            return released
+
+    def stop(self) -> None:
+        '''
+        summary: stops handing out new work items. The leased ones are still finished
+        '''
+        with self.condition:
+            self.exhausted = True
+            self.condition.notify_all()
+
+    def done(self) -> bool:
+        '''
+        summary: True once the work ran out and every leased work item is done
+        '''
+        with self.condition:
+            return self.exhausted and len(self.leases) == 0
+
+    def wait(self, timeout: float) -> bool:
+        '''
+        summary: waits until the queue is done or timeout [seconds] passed, returns done()
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.exhausted and len(self.leases) == 0, timeout)
+            return self.exhausted and len(self.leases) == 0
+
+
+class Coordinator():
+    '''
+    summary: serves the chunks of queue to the workers that connect to address.
+    settings: what the workers need to know about the search, e.g. the timeout, sent when they connect
+    handle_results(results, timings) is called with the results that a worker reported,
+    a list of (chunk id, index, results of the work item) triples, and the stage timings of the worker (or None).
+    It is called from one thread at a time
+    '''
+
+    def __init__(self, address: tuple[str, int], authkey: bytes, queue: WorkQueue, settings: dict,
+                 handle_results: Callable[[list, dict | None], None]) -> None:
+        self.queue = queue
+        self.settings = settings
+        self.handle_results = handle_results
+        self.lock = threading.Lock()
+        self.listener = Listener(address, authkey=authkey)
+        self.workers = 0
+        # the workers that are connected right now
+        self.connected = 0
+        self.idle = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def wait_for_workers(self, timeout: float) -> None:
+        '''
+        summary: waits until every worker left, e.g. after it was told that the search is done,
+        or timeout [seconds] passed
+        '''
+        with self.idle:
+            self.idle.wait_for(lambda: self.connected == 0, timeout)
+
+    def close(self) -> None:
+        '''
+        summary: stops accepting workers
+        '''
+        self.closed = True
+        self.listener.close()
+
+    def __accept(self) -> None:
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (OSError, AuthenticationError):
+                # the listener was closed, or a client failed the authentication
+                if self.closed:
+                    return
+                continue
+            with self.lock:
+                self.workers += 1
+                owner = self.workers
+            with self.idle:
+                self.connected += 1
+            threading.Thread(target=self.__serve, args=(connection, owner), daemon=True).start()
+
+    def __serve(self, connection: Connection, owner: int) -> None:
+        print_content(f"worker {owner} joined")
+        try:
+            connection.send(("hello", self.settings))
+            while True:
+                message = connection.recv()
+                if message[0] == "lease":
+                    chunk = self.queue.lease(owner, message[1])
+                    if chunk is not None:
+                        connection.send(("chunk",) + chunk)
+                    else:
+                        connection.send(("done",) if self.queue.done() else ("wait",))
+                elif message[0] == "results":
+                    with self.lock:
+                        self.handle_results(*message[1:])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            with self.idle:
+                self.connected -= 1
+                self.idle.notify_all()
+            released = self.queue.release(owner)
+            if released > 0:
+                print_warning(f"worker {owner} left, {released} tests are leased out again")
+            else:
+                print_content(f"worker {owner} left")
+
+
+class WorkerConnection():
+    '''
+    summary: the connection of a worker to its coordinator. Can be shared between threads
+    '''
+
+    # time [seconds] to wait before asking again, when all remaining work is leased to other workers
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, address: tuple[str, int], authkey: bytes) -> None:
+        self.connection = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+        _, self.settings = self.connection.recv()
+
+    def leases(self, size: int, stop: threading.Event) -> Iterator[tuple[int, int, tuple]]:
+        '''
+        summary: leases chunks of up to size work items until the coordinator runs out of work,
+        the connection is lost or stop is set, and yields their (chunk id, index, work item) triples
+        '''
+        while not stop.is_set():
+            try:
+                with self.lock:
+                    self.connection.send(("lease", size))
+                    reply = self.connection.recv()
+            except (EOFError, OSError):
+                print_warning("lost the connection to the coordinator")
+                return
+            if reply[0] == "done":
+                return
+            if reply[0] == "wait":
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            _, chunk_id, items = reply
+            for index, work_item in items:
+                yield chunk_id, index, work_item
+
+    def report(self, results: list[tuple[int, int, list]], timings: dict | None = None) -> bool:
+        '''
+        summary: sends the results of work items, (chunk id, index, results of the work item) triples,
+        and the stage timings of the worker to the coordinator
+        returns: False if the connection is lost
+        '''
+        try:
+            with self.lock:
+                self.connection.send(("results", results, timings))
+            return True
+        except (EOFError, OSError):
+            return False
+
+    def close(self) -> None:
+        '''
+        summary: leaves the coordinator
+        '''
+        self.connection.close()
@@ -0,0 +1,302 @@
+'''
+This module defines the backends that the Z3Driver can use to solve formulas.
+A backend takes an SMT expression and the preamble it builds upon and returns what Z3 found.
+The SMT expression is either a string or its pieces (see smt_writer.pieces_of), e.g. of a formula generator.
+The pieces of a batch must be lists, since queries are sent again after Z3 crashed.
+- SubprocessBackend: runs the z3 binary once per formula
+- ApiBackend: solves formulas in-process through the z3 python bindings (z3-solver),
+  inside a process pool such that the GIL does not serialize the solving
+The pool of persistent z3 processes lives in z3_pool.
+Backends can also run batches of formulas, which Z3 solves one after another in a single script.
+Every query of a batch is timed on its own, up to the echo of its marker, such that a query that ran into
+its timeout is told apart from the quick ones.
+Scripts are streamed into the stdin of Z3 in chunks (see smt_writer), the preamble in its pre-encoded form.
+'''
+
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from multiprocessing import Pool, current_process
+from typing import Callable, Iterable, Iterator, NamedTuple
+from smt_writer import SmtWriter, encoded, joined, pieces_of
+from stage_timer import stage
+
+# marker that is echoed by Z3 after every query of a script, followed by the index of the query
+DONE_MARKER = "madamastra-done"
+# extra time [seconds] that Z3 gets on top of its own timeout before it is considered hung
+HANG_GRACE = 5
+
+
+class Z3Result(NamedTuple):
+    '''
+    summary: the outcome of a single Z3 query
+    output: what Z3 printed (e.g. "sat\\n")
+    error: the errors reported by Z3, empty if there were none
+    runtime: the time [seconds] that Z3 took for the query, if it was measured by the backend (e.g. within a batch),
+    None otherwise
+    '''
+    output: str
+    error: str
+    runtime: float | None = None
+
+
+class Z3Backend():
+    '''
+    summary: interface of the ways to run Z3
+    '''
+
+    def run(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        '''
+        summary: runs smt_expr on top of preamble with a timeout [seconds] and returns the findings of Z3
+        '''
+        raise NotImplementedError
+
+    def run_batch(self, queries: list[tuple[str | list[str], str]], timeout: int) -> list[Z3Result]:
+        '''
+        summary: runs the queries, pairs of an SMT expression and its preamble, each with a timeout [seconds]
+        and returns the findings of Z3 in the same order, each with its runtime
+        '''
+        results = []
+        for smt_expr, preamble in queries:
+            start = time.perf_counter()
+            result = self.run(smt_expr, preamble, timeout)
+            results.append(result._replace(runtime=time.perf_counter() - start))
+        return results
+
+    def config(self) -> str:
+        '''
+        summary: describes the backend and the version of Z3 it runs.
+        Cached results are only reused by backends with the same config
+        '''
+        raise NotImplementedError
+
+    def close(self) -> None:
+        '''
+        summary: frees the resources held by the backend
+        '''
+
+
+class SubprocessBackend(Z3Backend):
+    '''
+    summary: spawns a z3 process for every formula. The formula is passed over stdin.
+    A batch of formulas is run by a single z3 process.
+    reset: if True, batches (reset) Z3 between formulas instead of using (push)/(pop)
+    '''
+
+    def __init__(self, command=None, reset=False) -> None:
+        self.command = command or ["z3", "-in", "-smt2"]
+        self.reset = reset
+
+    def run(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        process = self.__spawn(self.command + [f"-T:{timeout}"])
+
+        def write(writer: SmtWriter) -> None:
+            writer.write_encoded(encoded(preamble))
+            writer.write_all(pieces_of(smt_expr))
+
+        stdout, stderr, _ = stream_to_process(process, write)
+        return Z3Result(stdout.decode('utf-8'), stderr.decode())
+
+    def run_batch(self, queries: list[tuple[str | list[str], str]], timeout: int) -> list[Z3Result]:
+        if len(queries) == 0:
+            return []
+        process = self.__spawn(self.command)
+        markers = [time.perf_counter()]
+        stdout, stderr, timed_out = stream_to_process(
+            process, lambda writer: writer.write_all(batch_pieces(queries, timeout, self.reset)),
+            timeout=len(queries) * timeout + HANG_GRACE, markers=markers)
+        results = parse_batch(stdout.decode('utf-8'), len(queries), markers)
+        if None not in results:
+            if len(stderr) > 0:
+                results[-1] = results[-1]._replace(error=results[-1].error + stderr.decode())
+            return results
+        # Z3 hung on or crashed at the first query without a result, the queries after it get a new process
+        index = results.index(None)
+        runtime = time.perf_counter() - markers[-1]
+        if timed_out:
+            results[index] = Z3Result("timeout\n", "", runtime)
+        else:
+            results[index] = Z3Result("", stderr.decode() + "z3 process crashed", runtime)
+        return results[:index + 1] + self.run_batch(queries[index + 1:], timeout)
+
+    @staticmethod
+    def __spawn(command: list[str]) -> subprocess.Popen:
+        with stage("z3.spawn"):
+            return subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True)  # ctrl-c stops the search, not the running Z3
+
+    def config(self) -> str:
+        return " ".join(["subprocess", z3_version(tuple(self.command))] + self.command)
+
+
+class ApiBackend(Z3Backend):
+    '''
+    summary: solves formulas with the z3 python bindings in a pool of size processes.
+    Inside of a worker process of a pool (which cannot have children), formulas are solved in-process.
+    Requires the optional z3-solver package.
+    '''
+
+    def __init__(self, size: int) -> None:
+        try:
+            import z3  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as e:
+            raise ImportError("the api backend requires the z3-solver package (pip install z3-solver)") from e
+        self.pool = None if current_process().daemon else Pool(size)
+
+    def run(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        # the bindings parse a single string
+        if self.pool is None:
+            return _api_check(preamble + joined(smt_expr), timeout)
+        return self.pool.apply(_api_check, (preamble + joined(smt_expr), timeout))
+
+    def run_batch(self, queries: list[tuple[str | list[str], str]], timeout: int) -> list[Z3Result]:
+        if self.pool is None:
+            return super().run_batch(queries, timeout)
+        # the formulas of a batch are independent, so they are spread over the pool
+        return self.pool.starmap(_api_check, [(preamble + joined(smt_expr), timeout) for smt_expr, preamble in queries])
+
+    def config(self) -> str:
+        import z3  # pylint: disable=import-outside-toplevel
+        return "api " + z3.get_full_version()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def batch_script(queries: list[tuple[str | list[str], str]], timeout: int, reset=False, loaded_preamble=None) -> str:
+    '''
+    summary: returns the SMT script that runs the queries (pairs of an SMT expression and its preamble)
+    one after another. Every query gets its own timeout [seconds] and is followed by an echo of
+    DONE_MARKER and its index. Preambles are only sent when they change.
+    reset: if True, Z3 is (reset) before every query instead of running it between (push) and (pop)
+    loaded_preamble: the preamble that Z3 has already loaded, if any
+    '''
+    return "".join(batch_pieces(queries, timeout, reset, loaded_preamble))
+
+
+def batch_pieces(queries: list[tuple[str | list[str], str]], timeout: int, reset=False, loaded_preamble=None) -> Iterator[str]:
+    '''
+    summary: yields the script of batch_script in pieces, such that it can be written without building it as a whole
+    '''
+    for index, (smt_expr, preamble) in enumerate(queries):
+        if reset or preamble != loaded_preamble:
+            yield "(reset)\n"
+            yield preamble
+            yield "\n"
+            loaded_preamble = preamble
+        yield f"(set-option :timeout {timeout * 1000})\n"
+        if not reset:
+            yield "(push)\n"
+        yield from pieces_of(smt_expr)
+        yield "\n" if reset else "\n(pop)\n"
+        yield f"(echo \"{DONE_MARKER} {index}\")\n"
+
+
+def stream_to_process(process: subprocess.Popen, write: Callable[[SmtWriter], None],
+                      timeout: float | None = None, markers: list[float] | None = None) -> tuple[bytes, bytes, bool]:
+    '''
+    summary: like process.communicate, but the input is written by write into an SmtWriter on the stdin of process,
+    such that it never has to be held in memory as a whole. stdout and stderr are read by threads meanwhile,
+    such that Z3 never blocks on a full pipe. The process is killed once timeout [seconds] passed.
+    markers: if given, the time (time.perf_counter) at which every line of stdout that starts with DONE_MARKER
+    arrived is appended to it
+    returns: what the process wrote to stdout and stderr, and whether it was killed
+    '''
+    outputs = [b"", b""]
+
+    def read(index: int, stream) -> None:
+        if index == 1 or markers is None:
+            outputs[index] = stream.read()
+            return
+        lines = []
+        marker = DONE_MARKER.encode('utf-8')
+        for line in stream:
+            if line.startswith(marker):
+                markers.append(time.perf_counter())
+            lines.append(line)
+        outputs[index] = b"".join(lines)
+
+    readers = [threading.Thread(target=read, args=(index, stream), daemon=True)
+               for index, stream in enumerate((process.stdout, process.stderr))]
+    for reader in readers:
+        reader.start()
+    killed = threading.Event()
+
+    def kill() -> None:
+        killed.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    if timer is not None:
+        timer.start()
+    try:
+        with SmtWriter(process.stdin) as writer:
+            write(writer)
+    except BrokenPipeError:
+        # Z3 exited (or was killed) before it read the whole script, its output tells why
+        pass
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    for reader in readers:
+        reader.join()
+    if timer is not None:
+        timer.cancel()
+    process.wait()
+    return outputs[0], outputs[1], killed.is_set()
+
+
+def parse_batch(output: str, size: int, markers: list[float] | None = None) -> list[Z3Result | None]:
+    '''
+    summary: splits the output of a script of size queries from batch_script into the results of the queries.
+    Queries whose marker is missing (e.g. because Z3 was killed) get None
+    markers: the start of the script followed by the times at which the markers arrived (see stream_to_process),
+    from which the runtime of every query is computed
+    '''
+    results = [None] * size
+    lines, errors = [], []
+    count = 0
+    for line in output.splitlines(keepends=True):
+        if line.startswith(DONE_MARKER):
+            count += 1
+            runtime = markers[count] - markers[count - 1] if markers is not None and count < len(markers) else None
+            results[int(line.split()[1])] = Z3Result("".join(lines), "".join(errors), runtime)
+            lines, errors = [], []
+        elif line.startswith("(error"):
+            errors.append(line)
+        else:
+            lines.append(line)
+    return results
+
+
+@lru_cache(maxsize=None)
+def z3_version(command: tuple) -> str:
+    '''
+    summary: returns the version that the z3 binary of command reports
+    '''
+    try:
+        result = subprocess.run([command[0], "--version"], capture_output=True, check=False)
+    except OSError:
+        return "unknown"
+    return result.stdout.decode('utf-8').strip()
+
+
+def _api_check(smt_expr: str, timeout: int) -> Z3Result:
+    # runs inside the processes of the ApiBackend pool
+    import z3  # pylint: disable=import-outside-toplevel
+    start = time.perf_counter()
+    solver = z3.Solver()
+    solver.set("timeout", timeout * 1000)
+    try:
+        solver.from_string(smt_expr)
+        return Z3Result(str(solver.check()) + "\n", "", time.perf_counter() - start)
+    except z3.Z3Exception as e:
+        return Z3Result("", str(e), time.perf_counter() - start)
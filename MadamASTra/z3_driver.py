@@ -3,21 +3,48 @@ This module is responsible for abstracting the interaction between Z3 and MadamA
 It provides the Z3Driver class, which when given a SMT string runs Z3 and returns the result.
 It does not have any knowledge of the SMT language, and does not know how to generate SMT formulas.
 It just handles the process of running Z3.
+Queries are given either as strings or as their pieces (e.g. of a formula generator), which are hashed on their way
+into Z3 (see result_cache.SmtHash) instead of being joined.
 '''
 
-import subprocess
+import asyncio
+import os
+import time
+from typing import Iterable
 from c_printer import print_content, print_warning
+from result_cache import ResultCache, SmtHash
+from smt_writer import SmtWriter, encoded, pieces_of
+from stage_timer import stage
+from z3_backend import Z3Backend, Z3Result, SubprocessBackend, ApiBackend, z3_version
+from z3_pool import Z3WorkerPool
+
+BACKENDS = ["subprocess", "api"]
+
 
 class Z3Driver():
     '''
     summary: handles interactions between Z3 and MadamASTra.
-    Spawns a process for every requested Z3 formula,
-    waits for the process to complete and returns its result.
+    The actual solving is delegated to a backend:
+    - subprocess: spawns a process for every requested Z3 formula,
+      waits for the process to complete and returns its result.
+      If workers > 0, a pool of that many long-lived Z3 processes is reused instead.
+    - api: solves the formulas with the z3 python bindings in a pool of workers processes
+      (one per CPU if workers is 0)
+    worker_reset: if True, the persistent Z3 processes and batches are (reset) between formulas
+    cache: path of the on-disk cache of results. Formulas that were already solved are not run again.
+      None disables the cache
+    cache_refresh: if True, cached results are not used, but the new results are still cached
+    z3: the z3 binary that the subprocess backend runs (a name on the PATH or a path)
     '''
 
-    def __init__(self, verbose=False, timeout=5) -> None:
+    def __init__(self, verbose=False, timeout=5, workers=0, worker_reset=False, backend="subprocess",
+                 cache=None, cache_refresh=False, z3="z3") -> None:
         self.set_verbose(verbose)
         self.set_timeout(timeout)
+        self.backend = self.__make_backend(backend, workers, worker_reset, [z3, "-in", "-smt2"])
+        self.worker_reset = worker_reset
+        self.cache = None if cache is None else ResultCache(cache, refresh=cache_refresh)
+        self.config = None
 
     def set_verbose(self, value: bool) -> None:
         '''
@@ -31,17 +58,256 @@ class Z3Driver():
         '''
         self.timeout = value
 
-    def run(self, smt_expr: str) -> str:
+    def run(self, smt_expr: str, preamble: str = "") -> str:
+        '''
+        summary: given an SMT expression runs Z3 and returns its findings
+        preamble: definitions that smt_expr builds upon. Persistent workers only load them once
+        '''
+        result, _ = self.solve(smt_expr, preamble)
+        return result.output
+
+    def solve(self, smt_expr: str | Iterable[str], preamble: str = "", timeout: int = None,
+              smt_hash: SmtHash = None) -> tuple[Z3Result, float]:
+        '''
+        summary: like run, but returns everything Z3 reported and the time [seconds] it took.
+        The time of a cached result is the one that Z3 took when it was solved
+        smt_expr: the query as a string or as its pieces, which are streamed into Z3 without being joined
+        timeout: the timeout [seconds] of this formula, by default the one of the driver
+        smt_hash: the hash of preamble (see SmtHash.after), which the pieces are added to on their way,
+        e.g. for the record of the test. The cache hashes them anyway
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        if smt_hash is None and self.cache is not None:
+            smt_hash = SmtHash.after(preamble)
+        if smt_hash is not None:
+            smt_expr = smt_hash.tee(pieces_of(smt_expr))
+        runtime = None
+        if self.cache is None:
+            result = self.backend.run(smt_expr, preamble, timeout)
+            if smt_hash is not None:
+                # the pieces that Z3 did not read, e.g. because it crashed, still belong to the formula
+                for _ in smt_expr:
+                    pass
+        else:
+            if self.config is None:
+                self.config = self.backend.config()
+            with stage("z3.cache"):
+                # the pieces are kept, they are needed again if the result is not cached
+                smt_expr = list(smt_expr)
+                key = smt_hash.key(timeout, self.config)
+                result = self.cache.get(key)
+            if result is None:
+                # only the time of Z3 is stored, such that a hit takes as long as Z3 without the cache
+                run_start = time.perf_counter()
+                result = self.backend.run(smt_expr, preamble, timeout)
+                runtime = time.perf_counter() - run_start
+                # errors can be caused by the environment (e.g. a crashed process), so they are not cached
+                if len(result.error) == 0:
+                    self.cache.put(key, result, runtime)
+            else:
+                runtime = result.runtime
+        report_error(result.error, self.verbose)
+        return result, time.perf_counter() - start if runtime is None else runtime
+
+    def run_batch(self, queries: list[tuple[str, str]]) -> list[str]:
+        '''
+        summary: runs a batch of independent queries, pairs of an SMT expression and its preamble,
+        in a single Z3 script and returns the findings of Z3 for each of them.
+        Every query has its own timeout, a query that times out does not affect the others.
+        '''
+        return [result.output for result, _ in self.solve_batch(queries)]
+
+    def solve_batch(self, queries: list[tuple[str | Iterable[str], str]], timeout: int = None,
+                    smt_hashes: list[SmtHash] = None) -> list[tuple[Z3Result, float]]:
+        '''
+        summary: like run_batch, but returns everything Z3 reported and the time [seconds] it took for each query.
+        The backends time every query of a batch on its own, the time of a batch is only split evenly between
+        the queries that were not timed. The time of a cached result is the one that Z3 took when it was solved
+        timeout: the timeout [seconds] of every query, by default the one of the driver
+        smt_hashes: the hash of the preamble of every query, like for solve
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        if len(queries) == 1:
+            return [self.solve(*queries[0], timeout=timeout, smt_hash=None if smt_hashes is None else smt_hashes[0])]
+        if smt_hashes is None and self.cache is not None:
+            smt_hashes = [SmtHash.after(preamble) for _, preamble in queries]
+        # the queries after one that crashed Z3 are sent again, so their pieces are kept
+        queries = [(list(pieces_of(smt_expr)) if smt_hashes is None else list(smt_hash.tee(pieces_of(smt_expr))), preamble)
+                   for (smt_expr, preamble), smt_hash in zip(queries, smt_hashes or [None] * len(queries))]
+        results = [None] * len(queries)
+        runtimes = [0.0] * len(queries)
+        keys = [None] * len(queries)
+        if self.cache is not None:
+            if self.config is None:
+                self.config = self.backend.config()
+            # the formulas of a batch share a process, which can change the results
+            config = self.config + (" batch reset" if self.worker_reset else " batch push")
+            for index, smt_hash in enumerate(smt_hashes):
+                keys[index] = smt_hash.key(timeout, config)
+                results[index] = self.cache.get(keys[index])
+                if results[index] is not None:
+                    runtimes[index] = results[index].runtime or 0.0
+        missing = [index for index, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            start = time.perf_counter()
+            solved = self.backend.run_batch([queries[index] for index in missing], timeout)
+            runtime = (time.perf_counter() - start) / len(missing)
+            for index, result in zip(missing, solved):
+                results[index] = result
+                runtimes[index] = runtime if result.runtime is None else result.runtime
+                if self.cache is not None and len(result.error) == 0:
+                    self.cache.put(keys[index], result, runtimes[index])
+        for result in results:
+            report_error(result.error, self.verbose)
+        return list(zip(results, runtimes))
+
+    def close(self) -> None:
+        '''
+        summary: frees the backend, e.g. stops the persistent Z3 processes, and the cache
+        '''
+        self.backend.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    @staticmethod
+    def __make_backend(backend: str, workers: int, worker_reset: bool, command: list[str]) -> Z3Backend:
+        if backend == "subprocess":
+            if workers > 0:
+                return Z3WorkerPool(workers, command, reset=worker_reset)
+            return SubprocessBackend(command, reset=worker_reset)
+        if backend == "api":
+            return ApiBackend(workers if workers > 0 else os.cpu_count())
+        raise ValueError(f"unknown backend {backend}. Z3Driver only supports {', '.join(BACKENDS)}")
+
+
+class AsyncZ3Driver():
+    '''
+    summary: runs Z3 from an asyncio event loop.
+    Every formula gets its own z3 process that is fed over stdin (no shell involved).
+    At most concurrency processes run at the same time, a process that overruns
+    the timeout is killed right away instead of relying on the timeout of Z3 alone.
+    cache, cache_refresh: like for Z3Driver. Results are shared with the subprocess backend
+    '''
+
+    def __init__(self, verbose=False, timeout=5, concurrency=32, command=None,
+                 cache=None, cache_refresh=False) -> None:
+        self.verbose = verbose
+        self.timeout = timeout
+        self.command = command or ["z3", "-in", "-smt2"]
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.cache = None if cache is None else ResultCache(cache, refresh=cache_refresh)
+        self.config = None
+
+    async def run(self, smt_expr: str, preamble: str = "") -> str:
         '''
         summary: given an SMT expression runs Z3 and returns its findings
         '''
-        command = 'echo \'' + smt_expr.replace("'", "\"") + f"\' | z3 -in -smt2 -T:{self.timeout}"
-        result = subprocess.run(command, capture_output=True, shell=True, check=False)
-        err_decoded = result.stderr.decode()
-        if len(err_decoded) > 0:
-            print_warning("z3 raised an error")
-            if self.verbose:
-                print_content(err_decoded)
+        result, _ = await self.solve(smt_expr, preamble)
+        return result.output
+
+    async def solve(self, smt_expr: str | Iterable[str], preamble: str = "", timeout: int = None,
+                    smt_hash: SmtHash = None) -> tuple[Z3Result, float]:
+        '''
+        summary: like run, but returns everything Z3 reported and the time [seconds] it took.
+        The time of a cached result is the one that Z3 took when it was solved
+        smt_expr, timeout, smt_hash: like for Z3Driver.solve
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        if smt_hash is None and self.cache is not None:
+            smt_hash = SmtHash.after(preamble)
+        if smt_hash is not None:
+            smt_expr = smt_hash.tee(pieces_of(smt_expr))
+        runtime = None
+        if self.cache is None:
+            result = await self.__run(smt_expr, preamble, timeout)
+            if smt_hash is not None:
+                for _ in smt_expr:
+                    pass
+        else:
+            # the cache blocks on sqlite and the version on z3, so they run in the default executor of the loop
+            loop = asyncio.get_running_loop()
+            if self.config is None:
+                # every formula gets its own z3 process, just like with the SubprocessBackend
+                version = await loop.run_in_executor(None, z3_version, tuple(self.command))
+                self.config = " ".join(["subprocess", version] + self.command)
+            smt_expr = list(smt_expr)
+            key = smt_hash.key(timeout, self.config)
+            result = await loop.run_in_executor(None, self.cache.get, key)
+            if result is None:
+                run_start = time.perf_counter()
+                result = await self.__run(smt_expr, preamble, timeout)
+                runtime = time.perf_counter() - run_start
+                if len(result.error) == 0:
+                    await loop.run_in_executor(None, self.cache.put, key, result, runtime)
+            else:
+                runtime = result.runtime
+        report_error(result.error, self.verbose)
+        return result, time.perf_counter() - start if runtime is None else runtime
 
-        result_readable = result.stdout.decode('utf-8')
-        return result_readable
+    def close(self) -> None:
+        '''
+        summary: frees the cache
+        '''
+        if self.cache is not None:
+            self.cache.close()
+
+    async def __run(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        async with self.semaphore:
+            with stage("z3.spawn"):
+                process = await asyncio.create_subprocess_exec(
+                    *self.command, f"-T:{timeout}",
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True)  # ctrl-c stops the search, not the running Z3
+            try:
+                stdout, stderr = await asyncio.wait_for(self.__communicate(process, smt_expr, preamble), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.__kill(process)
+                return Z3Result("timeout\n", "")
+            except asyncio.CancelledError:
+                await self.__kill(process)
+                raise
+        return Z3Result(stdout.decode('utf-8'), stderr.decode())
+
+    @staticmethod
+    async def __communicate(process: asyncio.subprocess.Process, smt_expr: str | Iterable[str],
+                            preamble: str) -> tuple[bytes, bytes]:
+        # like process.communicate, but the pieces are written in chunks, and the output is read meanwhile
+        output = asyncio.gather(process.stdout.read(), process.stderr.read())
+        try:
+            writer = SmtWriter(process.stdin)
+            writer.write_encoded(encoded(preamble))
+            drained = 0
+            for piece in pieces_of(smt_expr):
+                writer.write(piece)
+                if writer.written > drained:
+                    await process.stdin.drain()
+                    drained = writer.written
+            writer.flush()
+            await process.stdin.drain()
+            process.stdin.close()
+        except ConnectionError:
+            # Z3 exited before it read the whole script, its output tells why
+            pass
+        stdout, stderr = await output
+        await process.wait()
+        return stdout, stderr
+
+    @staticmethod
+    async def __kill(process: asyncio.subprocess.Process) -> None:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+def report_error(err_decoded: str, verbose: bool) -> None:
+    '''
+    summary: warns about errors that Z3 reported
+    '''
+    if len(err_decoded) > 0:
+        print_warning("z3 raised an error")
+        if verbose:
+            print_content(err_decoded)
@@ -0,0 +1,197 @@
+'''
+This module provides a pool of long-lived Z3 processes.
+Instead of spawning a shell and a new Z3 process for every formula,
+every worker keeps a single `z3 -in` process alive and feeds it formulas
+over its stdin/stdout pipes. The preamble (solver option and define-funs)
+is sent once per process and every formula is run between (push) and (pop).
+A batch of formulas is sent to a single worker at once.
+Note that (push) puts Z3 into its incremental mode, which uses different code paths.
+Workers can therefore also (reset) Z3 and resend the preamble before every formula.
+'''
+
+import queue
+import subprocess
+import threading
+import time
+from typing import Iterable
+from smt_writer import SmtWriter
+from z3_backend import DONE_MARKER, HANG_GRACE, Z3Backend, Z3Result, batch_pieces, z3_version
+
+
+class Z3Worker():
+    '''
+    summary: wraps a single long-lived Z3 process.
+    Restarts the process if it crashes or hangs.
+    '''
+
+    def __init__(self, command: list[str], reset=False) -> None:
+        self.command = command
+        self.reset = reset
+        self.process = None
+        self.lines = None
+        self.preamble = None
+        self.start()
+
+    def start(self) -> None:
+        '''
+        summary: (re)starts the Z3 process and the thread reading its output
+        '''
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            start_new_session=True)  # ctrl-c stops the search, not the running Z3
+        # every process gets its own queue, such that lines of a killed process never leak into the next one
+        self.lines = queue.Queue()
+        threading.Thread(target=self.__read, args=(self.process, self.lines), daemon=True).start()
+        self.preamble = None
+
+    def stop(self) -> None:
+        '''
+        summary: kills the Z3 process
+        '''
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self) -> None:
+        '''
+        summary: kills the Z3 process and starts a fresh one
+        '''
+        self.stop()
+        self.start()
+
+    def query(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        '''
+        summary: runs smt_expr on top of preamble and returns the findings of Z3.
+        The preamble is only sent if the process has not loaded it yet.
+        '''
+        return self.query_batch([(smt_expr, preamble)], timeout)[0]
+
+    def query_batch(self, queries: list[tuple[str | list[str], str]], timeout: int) -> list[Z3Result]:
+        '''
+        summary: runs the queries (pairs of an SMT expression and its preamble) one after another
+        and returns the findings of Z3 for each of them.
+        If Z3 hangs on or crashes at a query, the remaining queries are run by a fresh process.
+        '''
+        if len(queries) == 0:
+            return []
+        if self.process.poll() is not None:
+            self.start()
+
+        # every query is timed up to its marker, starting with the end of the query before it
+        last = time.perf_counter()
+        try:
+            # the text layer of stdin is bypassed, the script is encoded in chunks by the writer
+            with SmtWriter(self.process.stdin.buffer) as writer:
+                writer.write_all(batch_pieces(queries, timeout, self.reset, self.preamble))
+            self.process.stdin.buffer.flush()
+        except OSError:
+            self.restart()
+            return [Z3Result("", "z3 process crashed", time.perf_counter() - last)] + self.query_batch(queries[1:], timeout)
+        self.preamble = queries[-1][1]
+
+        results = []
+        output, error = [], []
+        deadline = time.monotonic() + timeout + HANG_GRACE
+        while len(results) < len(queries):
+            try:
+                line = self.lines.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                # Z3 did not respect its own timeout, kill it
+                self.restart()
+                results.append(Z3Result("timeout\n", "", time.perf_counter() - last))
+                return results + self.query_batch(queries[len(results):], timeout)
+            if line is None:
+                # EOF: the process died while working on the query
+                self.start()
+                results.append(Z3Result("".join(output), "".join(error) + "z3 process crashed", time.perf_counter() - last))
+                return results + self.query_batch(queries[len(results):], timeout)
+            if line.startswith(DONE_MARKER):
+                now = time.perf_counter()
+                results.append(Z3Result("".join(output), "".join(error), now - last))
+                last = now
+                output, error = [], []
+                deadline = time.monotonic() + timeout + HANG_GRACE
+            elif line.startswith("(error"):
+                error.append(line)
+            else:
+                output.append(line)
+        return results
+
+    @staticmethod
+    def __read(process: subprocess.Popen, lines: queue.Queue) -> None:
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+
+class Z3WorkerPool(Z3Backend):
+    '''
+    summary: keeps up to size long-lived Z3 processes and hands out queries to them.
+    Can be shared between threads. Workers that already loaded the requested
+    preamble are preferred, such that it does not need to be parsed again.
+    reset: if True, workers (reset) Z3 before every formula instead of using (push)/(pop)
+    '''
+
+    def __init__(self, size: int, command=None, reset=False) -> None:
+        if size < 1:
+            raise ValueError("Z3WorkerPool needs at least one worker")
+        self.size = size
+        self.reset = reset
+        self.command = command or ["z3", "-in", "-smt2"]
+        self.workers = []
+        self.idle = []
+        self.lock = threading.Condition()
+
+    def run(self, smt_expr: str | Iterable[str], preamble: str, timeout: int) -> Z3Result:
+        '''
+        summary: runs smt_expr on top of preamble on an idle worker
+        '''
+        return self.run_batch([(smt_expr, preamble)], timeout)[0]
+
+    def run_batch(self, queries: list[tuple[str | list[str], str]], timeout: int) -> list[Z3Result]:
+        '''
+        summary: runs all queries on the same idle worker
+        '''
+        if len(queries) == 0:
+            return []
+        worker = self.__checkout(queries[0][1])
+        try:
+            return worker.query_batch(queries, timeout)
+        finally:
+            with self.lock:
+                self.idle.append(worker)
+                self.lock.notify()
+
+    def config(self) -> str:
+        # (reset) and (push)/(pop) use different code paths of Z3, so their results are kept apart
+        mode = "reset" if self.reset else "push"
+        return " ".join(["pool", mode, z3_version(tuple(self.command))] + self.command)
+
+    def close(self) -> None:
+        '''
+        summary: stops all Z3 processes of the pool
+        '''
+        with self.lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+            self.idle = []
+
+    def __checkout(self, preamble: str) -> Z3Worker:
+        with self.lock:
+            while len(self.idle) == 0:
+                if len(self.workers) < self.size:
+                    worker = Z3Worker(self.command, self.reset)
+                    self.workers.append(worker)
+                    return worker
+                self.lock.wait()
+            for worker in self.idle:
+                if worker.preamble == preamble:
+                    self.idle.remove(worker)
+                    return worker
+            return self.idle.pop()
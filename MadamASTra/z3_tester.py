@@ -3,70 +3,225 @@ This module is an abstraction of the Z3 solver. You give it 2 words, and it trie
 It also compares the result of Z3 to the expected result.
 """
 
-from formula_generator import get_sat_z3_formulas, get_unsat_z3_formula, wrap_formula, get_formula_for_checking_operator_definitions
+from itertools import chain
+from typing import Iterator
+from formula_generator import iter_sat_z3_formula, iter_unsat_z3_formula, wrap_preamble
+from sanity_check import run_sanity_checks
 from z3_driver import Z3Driver
-from c_printer import print_content, print_warning, print_title, print_success
+from z3_backend import Z3Result
+from result_cache import SmtHash
+from result_log import ResultLog, TestRecord
+from stage_timer import labels, record_duration, stage
+from c_printer import print_content, print_warning, print_success
 from random import randint
+import time
+
+# the response of Z3 that would be wrong for a formula of the given mode
+WRONG_RESPONSES = {"sat": "unsat", "unsat": "sat"}
+SOLVERS = ["seq", "z3str3"]
+
 
 class Z3Tester(object):
     '''
     Given two words, this class generates SMT formulas for them and tries them on Z3.
+    cache: path of the on-disk cache of the results of Z3, None to always run Z3
+    cache_refresh: if True, Z3 is run even for cached formulas (e.g. to hunt for nondeterminism)
+    results: path of the JSON lines file that the outcome of every test is recorded in, None to not record them
+    z3: the z3 binary that is tested
+    deficit: how many operations less than the edit distance the unsat formulas use
     '''
-    def __init__(self, verbose=False, timeout=5) -> None:
-        self.z3_driver = Z3Driver(verbose, timeout)
+    def __init__(self, verbose=False, timeout=5, workers=0, worker_reset=False, backend="subprocess",
+                 formula_style="nested", sanity_check=True, cache=None, cache_refresh=False, results=None,
+                 z3="z3", deficit=1) -> None:
+        self.z3_driver = Z3Driver(verbose, timeout, workers, worker_reset, backend, cache, cache_refresh, z3)
+        self.z3 = z3
+        self.results = None if results is None else ResultLog(results)
         self.error_log = []
+        self.timeout_log = []
+        self.finding_log = []
         self.verbose = verbose
+        self.formula_style = formula_style
+        self.deficit = deficit
+
+        if sanity_check:
+            self.sanity_check()
 
-        # sanity check
-        print_title("doing sanity check")
-        sanity_check_formula = get_formula_for_checking_operator_definitions()
-        sanity_check_result = self.z3_driver.run(sanity_check_formula)
-        assert "unsat" not in sanity_check_result
-        print_content("sanity check successful")
+    def sanity_check(self) -> None:
+        '''
+        checks that Z3 agrees with the definitions of insert, remove and replace with both solvers.
+        Checks that passed before with the same z3 binary are skipped
+        raises: SanityCheckError if it does not
+        '''
+        run_sanity_checks([(self.z3_driver, self.z3, solver_config) for solver_config in SOLVERS])
 
-    def test(self, word1, word2, mode_config="sat", solver_config="seq", seed=None) -> None:
+    def test(self, word1, word2, mode_config="sat", solver_config="seq", seed=None) -> bool:
         '''
         1. computes a SMT formula for word1 and word2
         2. tries word1 and word2 on Z3
         3. compares the result of Z3 to the expected result
         4. if Z3 made a mistake, it is logged in error_log
+        5. the outcome is recorded in the results file
         returns: True if Z3 made a mistake, False otherwise
         '''
+        error, record = self.check(word1, word2, mode_config, solver_config, seed)
+        self.log_result(error, record)
+        if record.timed_out:
+            self.log_timeout(record)
+        return error is not None
+
+    def check(self, word1, word2, mode_config="sat", solver_config="seq", seed=None) -> tuple[tuple | None, TestRecord]:
+        '''
+        like test, but does not log anything. Can be called from worker processes.
+        returns: the entry for error_log if Z3 made a mistake (None otherwise) and the record of the test
+        '''
+        with labels(solver_config, mode_config):
+            pieces, preamble, seed = self.prepare_pieces(word1, word2, mode_config, solver_config, seed)
+
+            # run Z3. the preamble is split off such that persistent Z3 processes only parse it once.
+            # the pieces of the query are hashed on their way into Z3
+            smt_hash = SmtHash.after(preamble)
+            z3_result, wall_time = self.z3_driver.solve(pieces, preamble=preamble, smt_hash=smt_hash)
+            record_duration("z3", wall_time, solver_config, mode_config)
+
+            with stage("check"):
+                error = self.evaluate(z3_result.output, word1, word2, mode_config, solver_config, seed)
+                record = self.record(z3_result, wall_time, smt_hash.hexdigest(), word1, word2, mode_config, solver_config,
+                                     seed)
+        return error, record
+
+    def check_batch(self, work_items: list[tuple], timeout: int = None) -> list[tuple[tuple | None, TestRecord]]:
+        '''
+        like check, but for a list of (word1, word2, mode_config, solver_config, seed) tuples,
+        which are all sent to a single Z3 process
+        timeout: the timeout [seconds] of the work items, by default the one of set_timeout
+        returns: the entry for error_log (or None) and the record for each work item
+        '''
+        prepared = []
+        for word1, word2, mode_config, solver_config, seed in work_items:
+            with labels(solver_config, mode_config):
+                prepared.append(self.prepare_pieces(word1, word2, mode_config, solver_config, seed))
+        smt_hashes = [SmtHash.after(preamble) for _, preamble, _ in prepared]
+        z3_results = self.z3_driver.solve_batch([(pieces, preamble) for pieces, preamble, _ in prepared], timeout,
+                                                smt_hashes)
+        checked = []
+        for (z3_result, wall_time), (word1, word2, mode_config, solver_config, _), (_, _, seed), smt_hash \
+                in zip(z3_results, work_items, prepared, smt_hashes):
+            record_duration("z3", wall_time, solver_config, mode_config)
+            with labels(solver_config, mode_config), stage("check"):
+                error = self.evaluate(z3_result.output, word1, word2, mode_config, solver_config, seed)
+                record = self.record(z3_result, wall_time, smt_hash.hexdigest(), word1, word2, mode_config, solver_config,
+                                     seed, timeout)
+            checked.append((error, record))
+        return checked
+
+    def prepare(self, word1, word2, mode_config="sat", solver_config="seq", seed=None) -> tuple[str, str, int]:
+        '''
+        computes a SMT formula for word1 and word2
+        returns: the query for Z3, the preamble it builds upon and the seed that was used
+        '''
+        pieces, preamble, seed = self.prepare_pieces(word1, word2, mode_config, solver_config, seed)
+        return "".join(pieces), preamble, seed
+
+    def prepare_pieces(self, word1, word2, mode_config="sat", solver_config="seq",
+                       seed=None) -> tuple[Iterator[str], str, int]:
+        '''
+        like prepare, but the query is given as the pieces of the formula generator, which are never joined.
+        The operations of the formula are computed right away, only the pieces are written lazily
+        '''
         if seed is None:
             seed = randint(0, 2**32)
 
-        # print(f"mode: {mode_config}, solver: {solver_config}, seed: {seed}")
-        if mode_config == "sat":
-            generated_z3_formula, _ = get_sat_z3_formulas(word1, word2)
-            wrong_response_config = "unsat"
-        elif mode_config == "unsat":
-            generated_z3_formula, seed = get_unsat_z3_formula(word1, word2, seed=seed)
-            wrong_response_config = "sat"
-        else:
-            raise ValueError("mode_config must be either \"sat\" or \"unsat\"")
+        with stage("formula"):
+            if mode_config == "sat":
+                pieces = iter_sat_z3_formula(word1, word2, self.formula_style)
+            elif mode_config == "unsat":
+                pieces = iter_unsat_z3_formula(word1, word2, seed, self.formula_style, self.deficit)
+            else:
+                raise ValueError("mode_config must be either \"sat\" or \"unsat\"")
 
-        assert isinstance(generated_z3_formula, str)
         assert isinstance(seed, int or str or bytearray or bytes)
 
-        full_input = wrap_formula(generated_z3_formula, solver_config)
-
-        # run Z3
-        z3_result = self.z3_driver.run(full_input)
+        with stage("wrap"):
+            return chain(pieces, ("\n(check-sat)\n",)), wrap_preamble(solver_config), seed
 
+    def evaluate(self, z3_result, word1, word2, mode_config, solver_config, seed) -> tuple | None:
+        '''
+        compares the result of Z3 to the expected result
+        returns: the entry for error_log if Z3 made a mistake, None otherwise
+        '''
         if self.verbose:
             print_content("Z3 Response: " + z3_result)
 
         # check if Z3 made a mistake
-        if wrong_response_config == z3_result.replace("\n", ""):
+        if WRONG_RESPONSES[mode_config] == z3_result.replace("\n", ""):
             print_warning("Z3 Made a mistake!")
-            self.error_log.append((word1, word2, "solver: " + solver_config, "mode: " + mode_config, "seed: " + str(seed)))
-            return True
-        return False
+            return (word1, word2, "solver: " + solver_config, "mode: " + mode_config, "seed: " + str(seed))
+        return None
+
+    def record(self, z3_result: Z3Result, wall_time: float, digest: str,
+               word1, word2, mode_config, solver_config, seed, timeout: int = None) -> TestRecord:
+        '''
+        returns the record of a test, given what Z3 reported for it
+        digest: the formula_hash of the script of the test, e.g. the hexdigest of the SmtHash it was solved with
+        timeout: the timeout [seconds] that Z3 had, by default the one of set_timeout
+        '''
+        verdict = z3_result.output.strip()
+        return TestRecord(word1, word2, mode_config, solver_config, seed, verdict, mode_config,
+                          WRONG_RESPONSES[mode_config] == verdict, z3_result.error, wall_time,
+                          digest, time.time(),
+                          self.z3_driver.timeout if timeout is None else timeout, self.z3)
+
+    def log_result(self, error: tuple | None, record: TestRecord) -> None:
+        '''
+        logs the mistake in error_log (or the differential finding in finding_log), if any,
+        and records the outcome of the test
+        '''
+        if error is not None:
+            if record.finding:
+                self.finding_log.append(error)
+            else:
+                self.error_log.append(error)
+        if self.results is not None:
+            self.results.write(record)
+
+    def log_timeout(self, record: TestRecord) -> None:
+        '''
+        logs a test on which Z3 ran out of time in timeout_log
+        '''
+        self.timeout_log.append((record.word1, record.word2, "solver: " + record.solver, "mode: " + record.mode,
+                                 "seed: " + str(record.seed), "timeout: " + str(record.timeout)))
+
+    def set_timeout(self, value: int) -> None:
+        '''
+        sets the timeout [seconds] of the following tests
+        '''
+        self.z3_driver.set_timeout(value)
+
+    def close(self) -> None:
+        '''
+        stops the Z3 processes that are kept alive by the driver and syncs the recorded results
+        '''
+        self.z3_driver.close()
+        if self.results is not None:
+            self.results.close()
 
     def print_errors(self) -> None:
         '''
-        saves the error log to "bugs.txt"
+        saves the error log to "bugs.txt", the timeout log to "timeouts.txt"
+        and the differential findings to "findings.txt"
         '''
+        if len(self.timeout_log) > 0:
+            print_warning(f"Z3 timed out on {len(self.timeout_log)} tests")
+            with open("timeouts.txt", "a", encoding='utf-8') as f:
+                for timeout in self.timeout_log:
+                    f.write(", ".join(timeout) + "\n")
+            print_content("timeouts written to \"timeouts.txt\"")
+        if len(self.finding_log) > 0:
+            print_warning(f"the solvers disagreed or differed in speed on {len(self.finding_log)} tests")
+            with open("findings.txt", "a", encoding='utf-8') as f:
+                for finding in self.finding_log:
+                    f.write(", ".join(finding) + "\n")
+            print_content("findings written to \"findings.txt\"")
         if len(self.error_log) == 0:
             print_success("Z3 made no mistakes")
         else:
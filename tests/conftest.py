@@ -0,0 +1,8 @@
+'''
+The modules of MadamASTra import each other flat, as they do when it is run as python3 MadamASTra
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MadamASTra"))
@@ -0,0 +1,42 @@
+'''
+Tests of the argument types and checks that are shared by the subcommands
+'''
+
+import argparse
+import pytest
+from arguments import check_source_args, non_negative_int, positive_int
+from core_search import add_parser
+
+
+def parse(*argv: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_parser(parser)
+    args = parser.parse_args(argv)
+    args.check_method(args)
+    return args
+
+
+def test_bounded_ints():
+    assert positive_int("3") == 3
+    assert non_negative_int("0") == 0
+    for parse_int, value in [(positive_int, "0"), (non_negative_int, "-1"), (positive_int, "x")]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_int(value)
+
+
+@pytest.mark.parametrize("argv", [["-r", "-1"], ["-b", "0"], ["--source", "dictionary"],
+                                  ["--source", "dictionary", "--dictionary", "/does/not/exist"],
+                                  ["--source", "alphabet", "--lengths", "5", "2"],
+                                  ["--source", "alphabet", "--alphabet="], ["--source", "mutation", "--alphabet="]])
+def test_invalid_search_arguments_exit(argv):
+    with pytest.raises(SystemExit):
+        parse(*argv)
+
+
+def test_valid_search_arguments(tmp_path):
+    words = tmp_path / "words.txt"
+    words.write_text("foo\n", encoding='utf-8')
+    assert parse("-r", "0").runs == 0
+    assert parse("--source", "dictionary", "--dictionary", str(words)).dictionary == str(words)
+    assert parse("--source", "alphabet", "--lengths", "3", "3").lengths == [3, 3]
+    assert check_source_args(argparse.ArgumentParser(), parse()) is None
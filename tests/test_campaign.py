@@ -0,0 +1,108 @@
+'''
+Tests of the checkpoints of campaigns, which need no Z3
+'''
+
+import json
+import pytest
+from campaign import CHECKPOINTS, Campaign, merge_ranges, to_ranges
+import result_log
+
+
+def make_record(**fields) -> result_log.TestRecord:
+    record = result_log.TestRecord("foo", "bar", "sat", "seq", 1, "sat", "sat", False, "", 0.1, "0" * 64, 0.0, 5, "z3")
+    return record._replace(**fields)
+
+
+def stats(tests: int) -> dict:
+    return {"tests": tests, "mistakes": 0, "timeouts": 0, "findings": 0, "elapsed": 1.0}
+
+
+def work(count: int) -> list[tuple]:
+    return [("word", str(index), "sat", "seq", index) for index in range(count)]
+
+
+def test_to_ranges():
+    assert to_ranges([]) == []
+    assert to_ranges([3]) == [[3, 3]]
+    assert to_ranges([5, 1, 2, 3, 7, 8]) == [[1, 3], [5, 5], [7, 8]]
+    assert to_ranges([2, 2, 1]) == [[1, 2]]
+
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    assert merge_ranges([[5, 6], [0, 2]]) == [[0, 2], [5, 6]]
+    # overlapping, adjacent and contained ranges are merged
+    assert merge_ranges([[0, 2], [1, 4], [5, 6], [9, 9], [8, 10]]) == [[0, 6], [8, 10]]
+    assert merge_ranges([[0, 10], [2, 3]]) == [[0, 10]]
+
+
+def test_track_skips_the_work_items_that_completed_before(tmp_path):
+    with open(tmp_path / CHECKPOINTS, "w", encoding='utf-8') as f:
+        f.write(json.dumps({"done": [[0, 1], [4, 4]], "stats": stats(3)}) + "\n")
+        f.write(json.dumps({"done": [[2, 2], [6, 7]], "stats": stats(6)}) + "\n")
+    campaign = Campaign(str(tmp_path))
+    assert campaign.done == [[0, 2], [4, 4], [6, 7]]
+    assert campaign.completed_before() == 6
+    assert campaign.stats["tests"] == 6
+    assert list(campaign.track(iter(work(10)))) == [work(10)[index] for index in [3, 5, 8, 9]]
+    campaign.close()
+
+
+def test_checkpoint_is_resumed(tmp_path):
+    campaign = Campaign(str(tmp_path))
+    items = list(campaign.track(iter(work(4))))
+    for work_item in items[1:3]:
+        campaign.complete(work_item, make_record(verdict="timeout"))
+    campaign.close()
+    resumed = Campaign(str(tmp_path))
+    assert resumed.done == [[1, 2]]
+    assert resumed.stats["timeouts"] == 2
+    assert list(resumed.track(iter(work(4)))) == [items[0], items[3]]
+    resumed.close()
+
+
+def test_work_item_completes_with_all_of_its_targets(tmp_path):
+    campaign = Campaign(str(tmp_path), targets=2)
+    items = list(campaign.track(iter(work(2))))
+    campaign.complete(items[0], make_record())
+    campaign.complete(items[1], make_record())
+    campaign.complete(items[1], make_record())
+    campaign.close()
+    assert Campaign(str(tmp_path)).done == [[1, 1]]
+
+
+def test_identical_work_items_complete_in_order(tmp_path):
+    campaign = Campaign(str(tmp_path))
+    work_item = work(1)[0]
+    assert list(campaign.track(iter([work_item, work_item, work_item]))) == [work_item] * 3
+    campaign.complete(work_item, make_record())
+    campaign.complete(work_item, make_record())
+    campaign.close()
+    assert Campaign(str(tmp_path)).done == [[0, 1]]
+
+
+def test_cut_off_checkpoint_is_skipped(tmp_path):
+    with open(tmp_path / CHECKPOINTS, "w", encoding='utf-8') as f:
+        f.write(json.dumps({"done": [[0, 1]], "stats": stats(2)}) + "\n")
+        f.write('{"done": [[2, 5]], "sta')
+    campaign = Campaign(str(tmp_path))
+    assert campaign.done == [[0, 1]]
+    items = list(campaign.track(iter(work(3))))
+    campaign.complete(items[0], make_record())
+    campaign.close()
+    # the next checkpoint is not glued to the cut off one
+    assert Campaign(str(tmp_path)).done == [[0, 2]]
+
+
+def test_snapshot_copies_the_words(tmp_path):
+    words = tmp_path / "words.list"
+    words.write_text("foo\nbar\n", encoding='utf-8')
+    directory = str(tmp_path / "camp")
+    copy = Campaign.snapshot(directory, str(words))
+    words.write_text("changed\n", encoding='utf-8')
+    with open(copy, "r", encoding='utf-8') as f:
+        assert f.read() == "foo\nbar\n"
+    Campaign.create(directory, {"runs": 1})
+    assert Campaign.settings(directory) == {"runs": 1}
+    with pytest.raises(FileExistsError):
+        Campaign.snapshot(directory, str(words))
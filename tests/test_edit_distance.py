@@ -0,0 +1,82 @@
+'''
+Tests of the edit distance engines against the plain DP of formula_generator
+'''
+
+import random
+import pytest
+from edit_distance import INSERT, REMOVE, REPLACE, ENGINES, compute_edit_distance, compute_edit_script, \
+    hirschberg_edit_script, myers_edit_distance
+from formula_generator import just_compute_edit_distance
+
+EDGE_CASES = [("", ""), ("", "abc"), ("abc", ""), ("a", "a"), ("a", "b"), ("abc", "abc"), ("kitten", "sitting"),
+              ("ä€😀", "a€x"), ("a" * 64, "a" * 63 + "b"), ("ab" * 40, "ba" * 40), ("x" * 130, "y" * 70),
+              ("abcdefgh" * 20, "abcdefgh" * 20)]
+
+
+def random_pairs(count: int, max_length: int, seed: int = 7) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        word1 = "".join(rng.choice("abc") for _ in range(rng.randint(0, max_length)))
+        # half of the pairs are close to each other, like the pairs of the mutation source
+        if rng.random() < 0.5:
+            word2 = "".join(rng.choice("abc") for _ in range(rng.randint(0, max_length)))
+        else:
+            word2 = list(word1)
+            for _ in range(rng.randint(1, 4)):
+                position = rng.randint(0, len(word2))
+                word2.insert(position, rng.choice("abcd"))
+            word2 = "".join(word2)
+        pairs.append((word1, word2))
+    return pairs
+
+
+PAIRS = EDGE_CASES + random_pairs(120, 150)
+
+
+def replay(word: str, script) -> str:
+    for op in script:
+        if op.kind == INSERT:
+            word = word[:op.index] + op.char + word[op.index:]
+        elif op.kind == REMOVE:
+            word = word[:op.index] + word[op.index + 1:]
+        else:
+            assert op.kind == REPLACE
+            word = word[:op.index] + op.char + word[op.index + 1:]
+    return word
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engines_match_the_dp(engine):
+    for word1, word2 in PAIRS:
+        assert compute_edit_distance(word1, word2, engine) == just_compute_edit_distance(word1, word2), (word1, word2)
+
+
+def test_myers_over_more_than_64_characters():
+    for length in (63, 64, 65, 128, 129, 300):
+        word1 = "".join(random.Random(length).choice("ab") for _ in range(length))
+        word2 = word1[1:] + "c"
+        assert myers_edit_distance(word1, word2) == just_compute_edit_distance(word1, word2)
+
+
+def test_band_within_and_beyond_the_bound():
+    for word1, word2 in PAIRS:
+        distance = just_compute_edit_distance(word1, word2)
+        for bound in (0, 1, 3, distance - 1, distance, distance + 2):
+            if bound < 0:
+                continue
+            expected = distance if distance <= bound else bound + 1
+            assert compute_edit_distance(word1, word2, bound=bound) == expected, (word1, word2, bound)
+
+
+@pytest.mark.parametrize("table_cells", [1, 64, 4096])
+def test_hirschberg_script_is_minimal_and_replays(table_cells):
+    for word1, word2 in PAIRS:
+        script = hirschberg_edit_script(word1, word2, table_cells)
+        assert len(script) == just_compute_edit_distance(word1, word2), (word1, word2)
+        assert replay(word1, script) == word2, (word1, word2)
+
+
+def test_edit_script_replays():
+    for word1, word2 in PAIRS:
+        assert replay(word1, compute_edit_script(word1, word2)) == word2
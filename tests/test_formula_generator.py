@@ -0,0 +1,34 @@
+'''
+Tests of the bookkeeping of the constants of the formulas
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from formula_generator import FormulaBuilder, get_sat_z3_formulas
+
+
+def test_builders_do_not_share_constants():
+    first, second = FormulaBuilder(), FormulaBuilder()
+    assert first.int_const(3) == "int_const_0"
+    assert first.str_const("a") == "str_const_0"
+    assert first.int_const(5) == "int_const_1"
+    # every builder numbers its constants from 0
+    assert second.str_const("b") == "str_const_0"
+    assert second.int_consts == []
+    assert first.consts_to_vals == {"int_const_0": "3", "str_const_0": "a", "int_const_1": "5"}
+    assert second.consts_to_vals == {"str_const_0": "b"}
+
+
+def test_declarations_and_substitution():
+    builder = FormulaBuilder()
+    position, char = builder.int_const(2), builder.str_const("x")
+    assert builder.declarations() == ("(declare-const str_const_0 String)\n(assert (= (str.len str_const_0) 1))\n"
+                                      "(declare-const int_const_0 Int)\n")
+    assert builder.substitute(f"(insert {char} {position} \"ab\")") == "(insert \"x\" 2 \"ab\")"
+
+
+def test_formulas_of_concurrent_threads_are_independent():
+    pairs = [("kitten", "sitting"), ("foo", "bar"), ("abcdef", "fedcba"), ("", "abc")] * 8
+    expected = [get_sat_z3_formulas(word1, word2) for word1, word2 in pairs]
+    with ThreadPoolExecutor(8) as executor:
+        formulas = list(executor.map(lambda pair: get_sat_z3_formulas(*pair), pairs))
+    assert formulas == expected
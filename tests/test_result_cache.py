@@ -0,0 +1,55 @@
+'''
+Tests of the hashes of SMT scripts that are given in pieces
+'''
+
+import random
+from formula_generator import iter_sat_z3_formula, iter_unsat_z3_formula, wrap_preamble
+from result_cache import ResultCache, SmtHash, normalize_smt
+from result_log import formula_hash
+
+SCRIPTS = ["", "   ", "(check-sat)", "  (assert  (= x \"a  b\"))  \n\n(check-sat)\n",
+           "; a comment\n(assert (= x \"say \"\"hi\"\" ; not a comment\"))\t; another\n(check-sat) ",
+           "(assert (= x \"\"))\n;\n\n;;\n(echo \"  \")", "\"open ; string\"\n; \"not a string\n" + "x " * 50]
+
+
+def split(script: str, rng: random.Random) -> list[str]:
+    cuts = sorted(rng.sample(range(len(script) + 1), min(len(script) + 1, rng.randint(0, 8))))
+    return [script[start:end] for start, end in zip([0] + cuts, cuts + [len(script)])]
+
+
+def hashed(pieces, preamble: str = "") -> SmtHash:
+    smt_hash = SmtHash.after(preamble)
+    for _ in smt_hash.tee(pieces):
+        pass
+    return smt_hash
+
+
+def test_pieces_hash_like_the_joined_script(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    rng = random.Random(3)
+    for script in SCRIPTS:
+        for preamble in ("", "(set-option :smt.string_solver seq) ; the solver\n"):
+            for _ in range(200):
+                smt_hash = hashed(split(script, rng), preamble)
+                assert smt_hash.hexdigest() == formula_hash(preamble + script), (preamble, script)
+                assert smt_hash.key(5, "config") == cache.key(preamble + script, 5, "config")
+    cache.close()
+
+
+def test_pieces_of_the_formula_generators():
+    for word1, word2 in [("kitten", "sitting"), ("", "ab"), ("same", "same"), ("a b", "\"q\"")]:
+        for style in ("nested", "let", "steps"):
+            for solver in ("seq", "z3str3"):
+                preamble = wrap_preamble(solver)
+                for pieces in (iter_sat_z3_formula(word1, word2, style), iter_unsat_z3_formula(word1, word2, 7, style)):
+                    pieces = list(pieces) + ["\n(check-sat)\n"]
+                    assert hashed(pieces, preamble).hexdigest() == formula_hash(preamble + "".join(pieces))
+
+
+def test_hash_goes_on_after_a_digest():
+    smt_hash = SmtHash()
+    smt_hash.update("(assert  ")
+    assert smt_hash.hexdigest() == formula_hash("(assert")
+    smt_hash.update(" true)")
+    assert smt_hash.hexdigest() == formula_hash("(assert true)")
+    assert normalize_smt("(assert   true)") == "(assert true)"
@@ -0,0 +1,89 @@
+'''
+Tests of the leases of the WorkQueue, which need no Z3
+'''
+
+import time
+from work_queue import WorkQueue
+
+
+def make_queue(count: int = 5, lease_timeout: float = 300) -> WorkQueue:
+    return WorkQueue(iter([("word", str(index)) for index in range(count)]), lease_timeout)
+
+
+def test_lease_hands_out_chunks_until_the_work_runs_out():
+    queue = make_queue(5)
+    first = queue.lease(owner=1, size=3)
+    second = queue.lease(owner=2, size=3)
+    assert first == (0, [(0, ("word", "0")), (1, ("word", "1")), (2, ("word", "2"))])
+    assert second == (1, [(0, ("word", "3")), (1, ("word", "4"))])
+    assert queue.lease(owner=3, size=3) is None
+    assert not queue.done()
+
+
+def test_expired_lease_is_leased_out_again():
+    queue = make_queue(2, lease_timeout=0.05)
+    chunk_id, items = queue.lease(owner=1, size=2)
+    assert queue.lease(owner=2, size=2) is None
+    time.sleep(0.1)
+    assert queue.lease(owner=2, size=2) == (chunk_id, items)
+
+
+def test_results_renew_the_lease():
+    queue = make_queue(2, lease_timeout=0.2)
+    chunk_id, _ = queue.lease(owner=1, size=2)
+    time.sleep(0.15)
+    assert queue.complete(chunk_id, 0)
+    time.sleep(0.1)
+    assert queue.lease(owner=2, size=2) is None
+
+
+def test_expired_lease_only_hands_out_the_missing_items():
+    queue = make_queue(3, lease_timeout=0.05)
+    chunk_id, _ = queue.lease(owner=1, size=3)
+    queue.complete(chunk_id, 1)
+    time.sleep(0.1)
+    assert queue.lease(owner=2, size=3) == (chunk_id, [(0, ("word", "0")), (2, ("word", "2"))])
+
+
+def test_duplicate_completion_is_counted_once():
+    queue = make_queue(2)
+    chunk_id, _ = queue.lease(owner=1, size=2)
+    assert queue.complete(chunk_id, 0)
+    assert not queue.complete(chunk_id, 0)
+    assert queue.complete(chunk_id, 1)
+    # the chunk is gone once all of its items are done
+    assert not queue.complete(chunk_id, 1)
+    assert not queue.complete(chunk_id + 1, 0)
+
+
+def test_release_makes_the_chunks_of_a_worker_available():
+    queue = make_queue(4)
+    mine, _ = queue.lease(owner=1, size=2)
+    other, _ = queue.lease(owner=2, size=2)
+    queue.complete(mine, 0)
+    assert queue.release(1) == 1
+    assert queue.lease(owner=3, size=2) == (mine, [(1, ("word", "1"))])
+    assert queue.release(1) == 0
+    assert queue.release(2) == 2
+    assert queue.lease(owner=3, size=2)[0] == other
+
+
+def test_done_once_every_item_is_complete():
+    queue = make_queue(2)
+    chunk_id, items = queue.lease(owner=1, size=4)
+    assert queue.lease(owner=1, size=4) is None
+    for index, _ in items:
+        assert not queue.done()
+        queue.complete(chunk_id, index)
+    assert queue.done()
+    assert queue.wait(0)
+
+
+def test_stop_finishes_the_leased_items_only():
+    queue = make_queue(4)
+    chunk_id, _ = queue.lease(owner=1, size=1)
+    queue.stop()
+    assert queue.lease(owner=2, size=1) is None
+    assert not queue.done()
+    queue.complete(chunk_id, 0)
+    assert queue.done()
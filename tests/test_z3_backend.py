@@ -0,0 +1,47 @@
+'''
+Tests of the scripts of batches and how their output is split, which need no Z3
+'''
+
+from z3_backend import DONE_MARKER, Z3Result, batch_pieces, batch_script, parse_batch
+
+
+def test_parse_batch_splits_on_the_markers():
+    output = (f"sat\n{DONE_MARKER} 0\n"
+              f"{DONE_MARKER} 1\n"
+              f"(error \"line 3 column 1: unknown constant x\")\nunknown\n{DONE_MARKER} 2\n")
+    assert parse_batch(output, 3) == [Z3Result("sat\n", ""), Z3Result("", ""),
+                                      Z3Result("unknown\n", "(error \"line 3 column 1: unknown constant x\")\n")]
+
+
+def test_parse_batch_leaves_the_queries_without_a_marker_out():
+    # Z3 was killed while it worked on the second query
+    output = f"unsat\n{DONE_MARKER} 0\nsat\n"
+    assert parse_batch(output, 3) == [Z3Result("unsat\n", ""), None, None]
+    assert parse_batch("", 2) == [None, None]
+
+
+def test_parse_batch_times_the_queries_between_the_markers():
+    output = f"sat\n{DONE_MARKER} 0\nunknown\n{DONE_MARKER} 1\n"
+    results = parse_batch(output, 3, [10.0, 10.5, 12.5])
+    assert [result.runtime for result in results[:2]] == [0.5, 2.0]
+    assert results[2] is None
+
+
+def test_batch_pieces_send_the_preamble_only_when_it_changes():
+    queries = [(["(assert true)", "\n(check-sat)"], "P1"), ("(check-sat)", "P1"), ("(check-sat)", "P2")]
+    script = "".join(batch_pieces(queries, 2))
+    assert script == batch_script(queries, 2)
+    assert script.count("(reset)\n") == 2
+    assert script.count("P1") == 1
+    assert script.count("(set-option :timeout 2000)\n") == 3
+    assert script.count("(push)\n") == script.count("(pop)\n") == 3
+    assert script.index("P2") > script.index(f"{DONE_MARKER} 1")
+    for index in range(3):
+        assert f"(echo \"{DONE_MARKER} {index}\")\n" in script
+
+
+def test_batch_pieces_reset_before_every_query():
+    queries = [("(check-sat)", "P"), ("(check-sat)", "P")]
+    script = batch_script(queries, 1, reset=True, loaded_preamble="P")
+    assert script.count("(reset)\nP\n") == 2
+    assert "(push)" not in script
@@ -0,0 +1,45 @@
+'''
+Tests of the times that the driver reports, run against fake_z3 instead of Z3
+'''
+
+import os
+import stat
+import sys
+import pytest
+from z3_driver import Z3Driver
+
+# the time [seconds] that the fake z3 takes for every (check-sat)
+DELAY = 0.2
+
+
+@pytest.fixture(name="fake_z3")
+def fixture_fake_z3(tmp_path) -> str:
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MadamASTra", "fake_z3.py")
+    path = tmp_path / "z3"
+    path.write_text(f"#!/bin/sh\nFAKE_Z3_DELAY={DELAY} exec {sys.executable} {script} \"$@\"\n", encoding='utf-8')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_cached_result_takes_as_long_as_z3(tmp_path, fake_z3):
+    driver = Z3Driver(timeout=5, cache=str(tmp_path / "results.sqlite"), z3=fake_z3)
+    result, runtime = driver.solve("(check-sat)\n")
+    cached, cached_runtime = driver.solve("(check-sat)\n")
+    driver.close()
+    assert result.output == cached.output == "unknown\n"
+    assert runtime >= DELAY
+    assert cached_runtime == runtime
+
+
+def test_batch_queries_are_timed_on_their_own(tmp_path, fake_z3):
+    driver = Z3Driver(timeout=5, cache=str(tmp_path / "results.sqlite"), z3=fake_z3)
+    # the first query answers right away, the others take DELAY each
+    queries = [("(echo \"quick\")\n", ""), ("(check-sat)\n", ""), ("(check-sat)\n(check-sat)\n", "")]
+    solved = driver.solve_batch(queries)
+    cached = driver.solve_batch(queries)
+    driver.close()
+    runtimes = [runtime for _, runtime in solved]
+    assert runtimes[0] < DELAY / 2
+    assert DELAY <= runtimes[1] < 2 * DELAY
+    assert runtimes[2] >= 2 * DELAY
+    assert [runtime for _, runtime in cached] == runtimes